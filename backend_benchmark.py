@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the list endpoints: latency and bytes on the wire for a 10k-row
+customer list, fetched page by page, with each response encoding.
+
+Run it once per server configuration and compare, e.g.:
+
+    FAST_JSON=false uvicorn server:app   ->  python backend_benchmark.py --label baseline
+    FAST_JSON=true  uvicorn server:app   ->  python backend_benchmark.py --label fast-json
+
+Results accumulate in --output, and every run prints all labels recorded so far.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+import zlib
+
+import requests
+
+try:
+    import brotli
+except ImportError:  # without it the br pass is skipped
+    brotli = None
+
+BACKEND_URL = os.environ.get("BENCHMARK_URL", "http://localhost:8000/api")
+
+ENCODINGS = ["identity", "gzip", "br"]
+
+
+def fetch_rows(base_url, rows, page_size, encoding):
+    """Walk the cursor pages until ``rows`` customers were read; returns (seconds, wire bytes, rows)"""
+    session = requests.Session()
+    headers = {"Accept-Encoding": encoding}
+    cursor = None
+    fetched = 0
+    bodies = []
+    started = time.perf_counter()
+    while fetched < rows:
+        params = {"limit": min(page_size, rows - fetched)}
+        if cursor:
+            params["cursor"] = cursor
+        response = session.get(f"{base_url}/customers", params=params, headers=headers, stream=True)
+        response.raise_for_status()
+        # Raw bytes as sent, not decompressed by requests
+        bodies.append((response.headers.get("Content-Encoding"), response.raw.read(decode_content=False)))
+        fetched += params["limit"]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    elapsed = time.perf_counter() - started
+
+    # Decoded outside the timed loop, only to check the pages really hold the rows
+    read = sum(len(json.loads(decode(content_encoding, body))) for content_encoding, body in bodies)
+    return elapsed, sum(len(body) for _, body in bodies), read
+
+
+def decode(content_encoding, body):
+    if content_encoding == "gzip":
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    if content_encoding == "br":
+        return brotli.decompress(body)
+    return body
+
+
+def seed_customers(base_url, rows):
+    """Bulk import customers until the list has at least ``rows`` of them"""
+    existing = 0
+    cursor = None
+    while existing < rows:
+        params = {"limit": 1000, "fields": "id"}
+        if cursor:
+            params["cursor"] = cursor
+        response = requests.get(f"{base_url}/customers", params=params)
+        response.raise_for_status()
+        existing += len(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    missing = rows - existing
+    if missing <= 0:
+        return 0
+
+    batch = uuid.uuid4().hex[:8]
+    lines = "\n".join(json.dumps({
+        "name": f"Cliente Benchmark {i}",
+        "cpf": f"bench-{batch}-{i:06d}",
+        "email": f"benchmark{i}@email.com",
+        "phone": "(11) 90000-0000",
+        "address": "Rua do Benchmark, 100 - São Paulo/SP",
+        "birth_date": "1990-01-01",
+        "medical_notes": "Sem restrições",
+    }) for i in range(missing))
+    response = requests.post(f"{base_url}/customers/bulk?format=ndjson", data=lines.encode())
+    response.raise_for_status()
+    return response.json()["inserted"]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run(base_url, rows, runs, page_size):
+    results = {}
+    for encoding in ENCODINGS:
+        if encoding == "br" and brotli is None:
+            continue
+        # One warm-up pass so connection setup and caches do not skew the first sample
+        fetch_rows(base_url, rows, page_size, encoding)
+        timings = []
+        wire_bytes = 0
+        for _ in range(runs):
+            seconds, wire_bytes, read = fetch_rows(base_url, rows, page_size, encoding)
+            timings.append(seconds * 1000)
+        results[encoding] = {
+            "rows": read,
+            "p50_ms": round(statistics.median(timings), 1),
+            "p95_ms": round(percentile(timings, 0.95), 1),
+            "mean_ms": round(statistics.mean(timings), 1),
+            "kb": round(wire_bytes / 1024, 1),
+        }
+    return results
+
+
+def print_table(recorded):
+    print(f"\n{'label':<16}{'encoding':<10}{'rows':>7}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}{'KB':>10}")
+    for label, results in recorded.items():
+        for encoding, r in results.items():
+            print(f"{label:<16}{encoding:<10}{r['rows']:>7}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['mean_ms']:>10}{r['kb']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=BACKEND_URL)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    print(f"🚀 Benchmarking {args.base_url}/customers with {args.rows} rows, {args.runs} runs per encoding")
+    seeded = seed_customers(args.base_url, args.rows)
+    if seeded:
+        print(f"✅ Imported {seeded} customers")
+
+    recorded = {}
+    if os.path.exists(args.output):
+        with open(args.output) as f:
+            recorded = json.load(f)
+    recorded[args.label] = run(args.base_url, args.rows, args.runs, args.page_size)
+    with open(args.output, "w") as f:
+        json.dump(recorded, f, indent=2)
+
+    print_table(recorded)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
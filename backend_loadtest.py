@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+"""
+Load test for the FitManager API: seeds a synthetic studio of a given size,
+then drives a weighted mix of routes from concurrent clients and reports
+p50/p95/p99 latency and requests per second per route.
+
+    python backend_loadtest.py seed --scale 100k
+    python backend_loadtest.py run --scale 100k --concurrency 32 --label "$(git rev-parse --short HEAD)"
+
+`seed` writes straight to Postgres (--database-url, DATABASE_URL by default)
+with COPY, applying the migrations first; it is resumable and re-running it
+at the same scale adds nothing. `run` talks to a server at --base-url, or
+with --asgi imports render_deploy/server.py and calls it in-process (start
+it from the directory holding build/, as with uvicorn). In-process numbers
+include the client's own CPU time, since both share one event loop.
+
+Results accumulate in --output keyed by label, and each run is compared
+with the previous one recorded under the same settings.
+
+    python backend_loadtest.py writes --concurrency 1 16 64 --window 0 2
+
+`writes` skips HTTP and books appointments and records payments straight
+through the Postgres storage layer, once per group-commit window
+(WRITE_BATCH_WINDOW_MS) and concurrency, to measure what batching buys.
+Its rows use days from 2095 on and are deleted after each run.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+import httpx
+
+RENDER_DEPLOY_DIR = Path(__file__).resolve().parent / "render_deploy"
+sys.path.insert(0, str(RENDER_DEPLOY_DIR))
+
+from scheduling import end_time_for, parse_time  # noqa: E402
+
+BACKEND_URL = os.environ.get("BENCHMARK_URL", "http://localhost:8000/api")
+
+# Customers per scale; every customer brings one package purchase and the rows below
+SCALES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+APPOINTMENTS_PER_CUSTOMER = 6
+PAYMENTS_PER_CUSTOMER = 2
+
+# Customers written per COPY transaction, together with their other rows
+SEED_CHUNK = 10_000
+
+FIRST_NAMES = ["Ana", "Bruno", "Carla", "Diego", "Eduarda", "Felipe", "Gabriela", "Henrique", "Isabela", "João",
+               "Larissa", "Marcos", "Natália", "Otávio", "Paula", "Rafael", "Sofia", "Thiago", "Vanessa", "William"]
+LAST_NAMES = ["Silva", "Santos", "Oliveira", "Souza", "Lima", "Pereira", "Costa", "Almeida", "Ferreira", "Rodrigues",
+              "Gomes", "Martins", "Araújo", "Ribeiro", "Carvalho"]
+INSTRUCTORS = ["Ana Paula Silva", "Carlos Roberto", "Fernanda Lima", "Gustavo Rocha", "Juliana Castro",
+               "Marcelo Dias", "Patrícia Nunes", "Ricardo Alves"]
+SERVICES = ["Pilates", "Musculação", "Fisioterapia", "Avaliação", "Funcional"]
+PAYMENT_METHODS = ["pix", "credit_card", "debit_card", "cash"]
+# (name, type, price, duration_days, sessions_included)
+PACKAGES = [
+    ("Pilates Mensal", "monthly", Decimal("280.00"), 30, 8),
+    ("Pilates Trimestral", "monthly", Decimal("750.00"), 90, 24),
+    ("Musculação Mensal", "monthly", Decimal("120.00"), 30, None),
+    ("Musculação Anual", "monthly", Decimal("1100.00"), 365, None),
+    ("10 Sessões Fisioterapia", "sessions", Decimal("900.00"), 120, 10),
+    ("5 Sessões Fisioterapia", "sessions", Decimal("480.00"), 60, 5),
+    ("Funcional 12 Aulas", "sessions", Decimal("360.00"), 60, 12),
+    ("Avaliação Física", "procedure", Decimal("150.00"), None, 1),
+]
+
+
+def customer_id(i: int) -> str:
+    return f"lt-c-{i:07d}"
+
+
+# ===============================
+# SEEDING
+# ===============================
+
+def customer_rows(i: int, today: date) -> dict:
+    """Every row of customer ``i``, reproducible from ``i`` alone"""
+    rng = random.Random(i)
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    created_at = datetime.combine(today, datetime.min.time()) - timedelta(seconds=rng.randrange(3 * 365 * 86400))
+    customer = (
+        customer_id(i), f"{first} {last}", f"lt{i:09d}", f"{first.lower()}.{last.lower()}{i}@exemplo.com.br",
+        f"(11) 9{rng.randrange(10**8):08d}", f"Rua {rng.choice(LAST_NAMES)}, {rng.randrange(1, 2000)} - São Paulo/SP",
+        date(1950, 1, 1) + timedelta(days=rng.randrange(55 * 365)),
+        "Sem restrições" if rng.random() < 0.8 else "Dor lombar, evitar carga axial", created_at,
+    )
+
+    package = rng.randrange(len(PACKAGES))
+    _, _, price, duration_days, sessions = PACKAGES[package]
+    purchase_date = today - timedelta(days=rng.randrange(365))
+    expiry_date = purchase_date + timedelta(days=duration_days) if duration_days else None
+    customer_package_id = f"lt-cp-{i:07d}"
+    customer_package = (
+        customer_package_id, customer_id(i), f"lt-p-{package}", purchase_date, price, rng.choice(PAYMENT_METHODS),
+        "expired" if expiry_date and expiry_date < today else "active",
+        rng.randrange(sessions + 1) if sessions else None, expiry_date,
+        datetime.combine(purchase_date, datetime.min.time()),
+    )
+
+    appointments = []
+    for j in range(APPOINTMENTS_PER_CUSTOMER):
+        day = today + timedelta(days=rng.randrange(-180, 30))
+        slot = f"{rng.randrange(6, 21):02d}:{rng.choice(['00', '30'])}"
+        service = rng.choice(SERVICES)
+        if day >= today:
+            status = "scheduled"
+        else:
+            status = rng.choices(["completed", "no_show", "cancelled"], [80, 10, 10])[0]
+        start = parse_time(slot)
+        appointments.append((
+            f"lt-a-{i:07d}-{j}", customer_id(i), f"lt-p-{package}", day, slot, service,
+            rng.choice(INSTRUCTORS), status, None, start, end_time_for(start, service),
+        ))
+
+    payments = [
+        (f"lt-pay-{i:07d}-{j}", customer_package_id, (price / PAYMENTS_PER_CUSTOMER).quantize(Decimal("0.01")),
+         min(today, purchase_date + timedelta(days=30 * j)), customer_package[5], None)
+        for j in range(PAYMENTS_PER_CUSTOMER)
+    ]
+    return {"customers": [customer], "customer_packages": [customer_package],
+            "appointments": appointments, "payments": payments}
+
+
+SEED_COLUMNS = {
+    "customers": ["id", "name", "cpf", "email", "phone", "address", "birth_date", "medical_notes", "created_at"],
+    "customer_packages": ["id", "customer_id", "package_id", "purchase_date", "amount_paid", "payment_method",
+                          "status", "remaining_sessions", "expiry_date", "created_at"],
+    "appointments": ["id", "customer_id", "package_id", "date", "time", "service_type", "instructor", "status",
+                     "notes", "start_time", "end_time"],
+    "payments": ["id", "customer_package_id", "amount", "payment_date", "payment_method", "notes"],
+}
+
+
+async def seeded_customers(conn, upper: int) -> int:
+    """Customers 0..n-1 are always seeded as a prefix, so n is found by bisecting on primary key lookups"""
+    low, high = 0, upper
+    while low < high:
+        middle = (low + high) // 2
+        if await conn.fetchval("SELECT 1 FROM customers WHERE id = $1", customer_id(middle)):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+async def seed(database_url: str, customers: int):
+    import asyncpg
+    from migrations import run_migrations
+
+    conn = await asyncpg.connect(database_url)
+    try:
+        await run_migrations(conn)
+        await conn.executemany('''
+            INSERT INTO packages (id, name, type, price, description, duration_days, sessions_included)
+            VALUES ($1, $2, $3, $4, $5, $6, $7) ON CONFLICT (id) DO NOTHING
+        ''', [(f"lt-p-{k}", name, kind, price, f"{name} (carga sintética)", days, sessions)
+              for k, (name, kind, price, days, sessions) in enumerate(PACKAGES)])
+
+        today = date.today()
+        seeded = 0
+        started = time.perf_counter()
+        for first in range(await seeded_customers(conn, customers), customers, SEED_CHUNK):
+            last = min(first + SEED_CHUNK, customers) - 1
+            rows = {table: [] for table in SEED_COLUMNS}
+            for i in range(first, last + 1):
+                for table, records in customer_rows(i, today).items():
+                    rows[table] += records
+            async with conn.transaction():
+                for table, columns in SEED_COLUMNS.items():
+                    await conn.copy_records_to_table(table, records=rows[table], columns=columns)
+            seeded += last + 1 - first
+            print(f"   {last + 1:>9} / {customers} customers ({time.perf_counter() - started:.0f}s)")
+
+        if seeded:
+            await conn.execute("ANALYZE")
+        return seeded
+    finally:
+        await conn.close()
+
+
+# ===============================
+# LOAD
+# ===============================
+
+def scenarios(customers: int, writes: bool) -> list:
+    """(route, weight, request builder); builders return (method, path, params, json)"""
+    today = date.today()
+
+    def some_customer(rng):
+        return customer_id(rng.randrange(customers))
+
+    def some_day(rng, back=30, ahead=30):
+        return today + timedelta(days=rng.randrange(-back, ahead))
+
+    def some_week(rng):
+        start = some_day(rng)
+        return {"from": start.isoformat(), "to": (start + timedelta(days=6)).isoformat(), "limit": 100}
+
+    routes = [
+        ("GET /customers", 10, lambda rng: ("GET", "/customers", {"limit": 50}, None)),
+        ("GET /customers/{id}", 20, lambda rng: ("GET", f"/customers/{some_customer(rng)}", {}, None)),
+        ("GET /customers/search", 8, lambda rng: ("GET", "/customers/search", {"q": rng.choice(FIRST_NAMES)}, None)),
+        ("GET /customers/{id}/overview", 12, lambda rng: ("GET", f"/customers/{some_customer(rng)}/overview", {}, None)),
+        ("GET /appointments?customer_id", 10,
+         lambda rng: ("GET", "/appointments", {"customer_id": some_customer(rng), "limit": 50}, None)),
+        ("GET /appointments?from&to", 6, lambda rng: ("GET", "/appointments", some_week(rng), None)),
+        ("GET /appointments/date/{day}", 6, lambda rng: ("GET", f"/appointments/date/{some_day(rng)}", {}, None)),
+        ("GET /availability", 8, lambda rng: ("GET", "/availability", {
+            "date": some_day(rng, 0).isoformat(), "instructor": rng.choice(INSTRUCTORS),
+        }, None)),
+        ("GET /payments", 4, lambda rng: ("GET", "/payments", {"limit": 50}, None)),
+        ("GET /dashboard/stats", 10, lambda rng: ("GET", "/dashboard/stats", {}, None)),
+        ("GET /reports/revenue", 2, lambda rng: ("GET", "/reports/revenue", {"granularity": "week"}, None)),
+        ("GET /reports/attendance", 2, lambda rng: ("GET", "/reports/attendance", {"granularity": "week"}, None)),
+    ]
+    if writes:
+        routes += [
+            ("POST /appointments", 4, lambda rng: ("POST", "/appointments", {}, {
+                "customer_id": some_customer(rng), "package_id": "lt-p-0", "date": some_day(rng, 0).isoformat(),
+                "time": f"{rng.randrange(6, 21):02d}:00", "service_type": rng.choice(SERVICES),
+                "instructor": rng.choice(INSTRUCTORS),
+            })),
+            ("POST /payments", 2, lambda rng: ("POST", "/payments", {}, {
+                "customer_package_id": f"lt-cp-{rng.randrange(customers):07d}", "amount": 140.0,
+                "payment_date": today.isoformat(), "payment_method": rng.choice(PAYMENT_METHODS),
+            })),
+        ]
+    return routes
+
+
+async def open_asgi_client():
+    """The render_deploy app called in-process, with its startup hooks run"""
+    os.environ.setdefault("JOBS_ENABLED", "false")
+    import server
+    # server.py logs at INFO, which would print a line per request from httpx
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    await server.app.router.startup()
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://loadtest/api")
+    return client, server.app.router.shutdown
+
+
+async def load(client, routes: list, concurrency: int, duration: float, warmup: float, seed: int) -> dict:
+    """Run ``concurrency`` clients; returns route -> [(seconds, status)] for requests started after warm-up"""
+    names = [route for route, _, _ in routes]
+    weights = [weight for _, weight, _ in routes]
+    builders = {route: build for route, _, build in routes}
+    samples = {route: [] for route in names}
+    loop = asyncio.get_running_loop()
+    measure_from = loop.time() + warmup
+    stop_at = measure_from + duration
+
+    async def worker(n: int):
+        rng = random.Random(seed * 1000 + n)
+        while loop.time() < stop_at:
+            route = rng.choices(names, weights)[0]
+            method, path, params, body = builders[route](rng)
+            started = loop.time()
+            try:
+                response = await client.request(method, path, params=params, json=body)
+                await response.aread()
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 0
+            if started >= measure_from:
+                samples[route].append((loop.time() - started, status))
+
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return samples
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(samples: dict, duration: float) -> dict:
+    # 409 is a booking conflict, an expected answer under concurrent writes
+    routes = {}
+    for route, results in samples.items():
+        if not results:
+            continue
+        timings = [seconds * 1000 for seconds, _ in results]
+        failed = collections.Counter(str(status) for _, status in results if not 200 <= status < 300 and status != 409)
+        routes[route] = {
+            "requests": len(results),
+            "errors": sum(failed.values()),
+            # 0 is a request that got no response at all
+            "error_statuses": dict(failed),
+            "rps": round(len(results) / duration, 1),
+            "p50_ms": round(statistics.median(timings), 1),
+            "p95_ms": round(percentile(timings, 0.95), 1),
+            "p99_ms": round(percentile(timings, 0.99), 1),
+            "max_ms": round(max(timings), 1),
+        }
+    everything = [seconds * 1000 for results in samples.values() for seconds, _ in results]
+    total = {
+        "requests": len(everything),
+        "errors": sum(r["errors"] for r in routes.values()),
+        "rps": round(len(everything) / duration, 1),
+        "p50_ms": round(statistics.median(everything), 1) if everything else 0,
+        "p95_ms": round(percentile(everything, 0.95), 1) if everything else 0,
+        "p99_ms": round(percentile(everything, 0.99), 1) if everything else 0,
+    }
+    return {"total": total, "routes": routes}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def previous_run(recorded: dict, label: str, result: dict):
+    """Latest other run recorded with the same target, scale, concurrency and request mix"""
+    same = ("target", "scale", "concurrency", "writes", "skipped")
+    candidates = [
+        (other, run) for other, run in recorded.items()
+        if other != label and all(run.get(key) == result[key] for key in same)
+    ]
+    return max(candidates, key=lambda item: item[1]["recorded_at"], default=(None, None))
+
+
+def change(now, before):
+    if not before:
+        return ""
+    return f"{(now - before) / before * 100:+.0f}%"
+
+
+def print_report(label: str, result: dict, baseline_label, baseline):
+    print(f"\n{label} — {result['scale']} customers, concurrency {result['concurrency']}, {result['duration_s']}s"
+          f" on {result['target']}")
+    header = f"{'route':<34}{'req':>7}{'err':>6}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    if baseline:
+        header += f"{'Δrps':>8}{'Δp95':>8}"
+        print(f"compared with {baseline_label}")
+    print(header)
+    rows = list(result["routes"].items()) + [("TOTAL", result["total"])]
+    for route, r in rows:
+        line = f"{route:<34}{r['requests']:>7}{r['errors']:>6}{r['rps']:>8}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}"
+        if baseline:
+            before = baseline["total"] if route == "TOTAL" else baseline["routes"].get(route)
+            if before:
+                line += f"{change(r['rps'], before['rps']):>8}{change(r['p95_ms'], before['p95_ms']):>8}"
+        print(line)
+
+
+async def run(args) -> dict:
+    customers = SCALES[args.scale]
+    if args.asgi:
+        client, shutdown = await open_asgi_client()
+        target = "asgi"
+    else:
+        client = httpx.AsyncClient(
+            base_url=args.base_url, timeout=30,
+            limits=httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency),
+        )
+        shutdown = None
+        target = args.base_url
+    try:
+        routes = [route for route in scenarios(customers, args.writes)
+                  if not any(skipped in route[0] for skipped in args.skip)]
+        samples = await load(client, routes, args.concurrency, args.duration, args.warmup, args.seed)
+    finally:
+        await client.aclose()
+        if shutdown:
+            await shutdown()
+    return dict(
+        scale=args.scale, concurrency=args.concurrency, duration_s=args.duration, target=target,
+        writes=args.writes, skipped=args.skip, commit=git_commit(), recorded_at=datetime.now().isoformat(timespec="seconds"),
+        **summarize(samples, args.duration),
+    )
+
+
+# ===============================
+# STORAGE WRITES
+# ===============================
+
+# Rows written by `writes`: days and a package purchase no seeded or real data uses
+WRITES_FIRST_DAY = date(2095, 1, 1)
+WRITES_CUSTOMER_PACKAGE = "lt-writes"
+
+
+async def write_load(database_url: str, window_ms: float, concurrency: int, duration: float) -> dict:
+    """Two bookings for every payment from ``concurrency`` clients, through PostgresStorage"""
+    from storage import Conflict
+    from storage_postgres import PostgresStorage
+
+    storage = PostgresStorage(database_url, write_batch_window_ms=window_ms)
+    await storage.open()
+    counts = collections.Counter()
+    timings = []
+    loop = asyncio.get_running_loop()
+    stop_at = loop.time() + duration
+
+    async def worker(n: int):
+        rng = random.Random(n)
+        while loop.time() < stop_at:
+            started = loop.time()
+            if rng.random() < 2 / 3:
+                try:
+                    await storage.book_appointment({
+                        "id": str(uuid.uuid4()), "customer_id": uuid.uuid4().hex, "package_id": "lt-p-0",
+                        "date": WRITES_FIRST_DAY + timedelta(days=rng.randrange(3000)),
+                        "time": f"{rng.randrange(6, 21):02d}:00", "service_type": rng.choice(SERVICES),
+                        "instructor": rng.choice(INSTRUCTORS), "notes": None,
+                    })
+                    counts["appointments"] += 1
+                except Conflict:
+                    counts["conflicts"] += 1
+            else:
+                await storage.payments.insert({
+                    "id": str(uuid.uuid4()), "customer_package_id": WRITES_CUSTOMER_PACKAGE, "amount": 140.0,
+                    "payment_date": WRITES_FIRST_DAY, "payment_method": rng.choice(PAYMENT_METHODS), "notes": None,
+                })
+                counts["payments"] += 1
+            timings.append((loop.time() - started) * 1000)
+
+    try:
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    finally:
+        await storage.close()
+    return {
+        "window_ms": window_ms, "concurrency": concurrency,
+        "writes_per_s": round(len(timings) / duration), "p50_ms": round(statistics.median(timings), 1),
+        "p99_ms": round(percentile(timings, 0.99), 1), **counts,
+    }
+
+
+async def clear_writes(database_url: str):
+    import asyncpg
+
+    conn = await asyncpg.connect(database_url)
+    try:
+        await conn.execute("DELETE FROM appointments WHERE date >= $1", WRITES_FIRST_DAY)
+        await conn.execute("DELETE FROM payments WHERE customer_package_id = $1", WRITES_CUSTOMER_PACKAGE)
+    finally:
+        await conn.close()
+
+
+async def compare_windows(args) -> list:
+    results = []
+    await clear_writes(args.database_url)
+    for concurrency in args.concurrency:
+        for window_ms in args.window:
+            results.append(await write_load(args.database_url, window_ms, concurrency, args.duration))
+            # Each run starts from the same schedule, or later ones would mostly hit conflicts
+            await clear_writes(args.database_url)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="fill Postgres with a synthetic dataset")
+    seed_parser.add_argument("--scale", choices=SCALES, default="1k")
+    seed_parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+
+    run_parser = commands.add_parser("run", help="drive the API and record latencies")
+    run_parser.add_argument("--scale", choices=SCALES, default="1k", help="dataset the ids are drawn from")
+    run_parser.add_argument("--base-url", default=BACKEND_URL)
+    run_parser.add_argument("--asgi", action="store_true", help="call render_deploy/server.py in-process")
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    run_parser.add_argument("--warmup", type=float, default=5, help="seconds run before measuring")
+    run_parser.add_argument("--writes", action="store_true", help="mix in bookings and payments")
+    run_parser.add_argument("--skip", action="append", default=[], metavar="ROUTE",
+                            help="leave out routes containing this text, e.g. --skip search")
+    run_parser.add_argument("--seed", type=int, default=1, help="random seed of the request mix")
+    run_parser.add_argument("--label", default=None, help="defaults to the current git commit")
+    run_parser.add_argument("--output", default="loadtest_results.json")
+
+    writes_parser = commands.add_parser("writes", help="time bookings and payments with and without group commit")
+    writes_parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    writes_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    writes_parser.add_argument("--window", type=float, nargs="+", default=[0, 2],
+                               help="WRITE_BATCH_WINDOW_MS values to compare; 0 writes each row alone")
+    writes_parser.add_argument("--duration", type=float, default=8, help="seconds per window and concurrency")
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        if not args.database_url:
+            parser.error("--database-url or DATABASE_URL is required")
+        customers = SCALES[args.scale]
+        print(f"🌱 Seeding {customers} customers, {customers * APPOINTMENTS_PER_CUSTOMER} appointments"
+              f" and {customers * PAYMENTS_PER_CUSTOMER} payments")
+        seeded = asyncio.run(seed(args.database_url, customers))
+        print(f"✅ Seeded {seeded} new customers" if seeded else "✅ Dataset already in place")
+        return 0
+
+    if args.command == "writes":
+        if not args.database_url:
+            parser.error("--database-url or DATABASE_URL is required")
+        print(f"{'window ms':>10}{'clients':>9}{'writes/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'booked':>8}{'409':>7}{'paid':>7}")
+        for r in asyncio.run(compare_windows(args)):
+            print(f"{r['window_ms']:>10g}{r['concurrency']:>9}{r['writes_per_s']:>10}{r['p50_ms']:>9}{r['p99_ms']:>9}"
+                  f"{r.get('appointments', 0):>8}{r.get('conflicts', 0):>7}{r.get('payments', 0):>7}")
+        return 0
+
+    label = args.label or git_commit() or "run"
+    print(f"🚀 {args.concurrency} clients for {args.duration:.0f}s against {'asgi' if args.asgi else args.base_url}")
+    result = asyncio.run(run(args))
+
+    recorded = {}
+    if os.path.exists(args.output):
+        with open(args.output) as f:
+            recorded = json.load(f)
+    baseline_label, baseline = previous_run(recorded, label, result)
+    recorded[label] = result
+    with open(args.output, "w") as f:
+        json.dump(recorded, f, indent=2, ensure_ascii=False)
+
+    print_report(label, result, baseline_label, baseline)
+    return 1 if result["total"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
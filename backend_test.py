@@ -8,12 +8,20 @@ import requests
 import json
 from datetime import datetime, date, timedelta
 import base64
+import random
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 # Get backend URL from frontend .env file
 BACKEND_URL = "https://fa7c640b-54f3-419e-be86-4a033b35843e.preview.emergentagent.com/api"
 
+# CPF is unique per customer, so every run needs fresh numbers
+RUN_SUFFIX = datetime.now().strftime("%H%M%S")
+
+# 1x1 PNG, the smallest photo the server accepts as a real image
+TEST_PHOTO_PNG = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGM4UREFAAOmAZutoK8PAAAAAElFTkSuQmCC"
+
 class BackendTester:
     def __init__(self):
         self.base_url = BACKEND_URL
@@ -76,17 +84,17 @@ class BackendTester:
         customers_data = [
             {
                 "name": "Maria Silva Santos",
-                "cpf": "123.456.789-01",
+                "cpf": f"123.{RUN_SUFFIX}-01",
                 "email": "maria.santos@email.com",
                 "phone": "(11) 99999-1234",
                 "address": "Rua das Flores, 123 - São Paulo, SP",
                 "birth_date": "1985-03-15",
-                "photo": base64.b64encode(b"fake_photo_data_maria").decode(),
+                "photo": TEST_PHOTO_PNG,
                 "medical_notes": "Histórico de lesão no joelho direito. Evitar exercícios de alto impacto."
             },
             {
                 "name": "João Carlos Oliveira",
-                "cpf": "987.654.321-09",
+                "cpf": f"987.{RUN_SUFFIX}-09",
                 "email": "joao.oliveira@email.com",
                 "phone": "(11) 88888-5678",
                 "address": "Av. Paulista, 456 - São Paulo, SP",
@@ -126,6 +134,17 @@ class BackendTester:
         else:
             self.log_error(f"Failed to retrieve customer {customer_id}")
             
+        # Photo is served from the photo store, not inlined in the payload
+        photo_url = created_customers[0].get('photo')
+        if photo_url and not photo_url.startswith("data:"):
+            response = requests.get(f"{self.base_url}{photo_url.replace('/api', '', 1)}&size=small")
+            if response.status_code == 200 and response.headers.get("ETag"):
+                self.log_success(f"Retrieved customer photo thumbnail ({len(response.content)} bytes)")
+            else:
+                self.log_error(f"Failed to retrieve customer photo: {response.status_code}")
+        else:
+            self.log_error(f"Customer photo not returned as URL: {str(photo_url)[:40]}")
+            
         # UPDATE customer
         update_data = customers_data[0].copy()
         update_data['phone'] = "(11) 99999-9999"
@@ -466,6 +485,125 @@ class BackendTester:
         
         return True
     
+    def test_stats_counters(self):
+        """Test that the incrementally maintained counters match real counts"""
+        print("\n🔍 Testing Dashboard Counters Consistency...")
+        
+        if not self.test_data.get('customers') or not self.test_data.get('packages'):
+            self.log_error("Missing customers or packages data - cannot test counters")
+            return False
+            
+        customer_ids = []
+        package_id = self.test_data['packages'][0]['id']
+        appointment_date = date.today()
+        
+        # Random mix of creates and deletes against the tables the counters track
+        for i in range(40):
+            if customer_ids and random.random() < 0.3:
+                self.make_request("DELETE", f"/customers/{customer_ids.pop(random.randrange(len(customer_ids)))}")
+            elif customer_ids and random.random() < 0.5:
+                self.make_request("POST", "/appointments", {
+                    "customer_id": random.choice(customer_ids),
+                    "package_id": package_id,
+                    "date": (appointment_date + timedelta(days=random.randint(0, 3))).isoformat(),
+                    "time": f"{random.randint(7, 20):02d}:00",
+                    "service_type": "Pilates Mat"
+                })
+            else:
+                result = self.make_request("POST", "/customers", {
+                    "name": f"Cliente Contador {i}",
+                    "cpf": f"555.{RUN_SUFFIX}.{i:03d}-00",
+                    "email": f"contador{i}@email.com",
+                    "phone": "(11) 90000-0000",
+                    "address": "Rua Teste, 1",
+                    "birth_date": "1995-05-05"
+                })
+                if result and "id" in result:
+                    customer_ids.append(result['id'])
+        
+        # A dry run recounts everything and reports counters that disagree
+        result = self.make_request("POST", "/system/counters/reconcile?dry_run=true")
+        if result is None:
+            self.log_error("Failed to reconcile counters")
+            return False
+        if result.get('drift'):
+            self.log_error(f"Counters drifted from real counts: {result['drift']}")
+            return False
+        self.log_success("Dashboard counters match real counts after random creates/deletes")
+        return True
+    
+    def test_session_redemption(self):
+        """Test that parallel check-ins never redeem more sessions than a package has"""
+        print("\n🔍 Testing Concurrent Session Redemption...")
+        
+        if not self.test_data.get('customers') or not self.test_data.get('packages'):
+            self.log_error("Missing customers or packages data - cannot test redemption")
+            return False
+            
+        package = self.test_data['packages'][0]
+        sessions = 50
+        
+        # A fresh customer, so no other package of theirs can absorb check-ins
+        customer = self.make_request("POST", "/customers", {
+            "name": "Cliente Check-in",
+            "cpf": f"666.{RUN_SUFFIX}.000-00",
+            "email": "checkin@email.com",
+            "phone": "(11) 90000-0001",
+            "address": "Rua Teste, 2",
+            "birth_date": "1990-01-01"
+        })
+        if not customer:
+            self.log_error("Failed to create customer for redemption test")
+            return False
+        
+        customer_package = self.make_request("POST", "/customer-packages", {
+            "customer_id": customer['id'],
+            "package_id": package['id'],
+            "purchase_date": date.today().isoformat(),
+            "amount_paid": package['price'],
+            "payment_method": "Pix",
+            "remaining_sessions": sessions
+        })
+        if not customer_package:
+            self.log_error("Failed to create customer package for redemption test")
+            return False
+        
+        # Far more appointments than sessions, imported in one request
+        first_day = date.today() + timedelta(days=365)
+        lines = [json.dumps({
+            "customer_id": customer['id'],
+            "package_id": package['id'],
+            "date": (first_day + timedelta(days=i // 14)).isoformat(),
+            "time": f"{7 + i % 14:02d}:00",
+            "service_type": "Redemption Test"
+        }) for i in range(200)]
+        response = requests.post(f"{self.base_url}/appointments/bulk?format=ndjson", data="\n".join(lines))
+        if response.status_code != 200 or response.json().get('inserted') != len(lines):
+            self.log_error(f"Failed to import appointments for redemption test: {response.text}")
+            return False
+        
+        appointments = self.make_request(
+            "GET", f"/appointments?customer_id={customer['id']}&service_type=Redemption%20Test&from={first_day.isoformat()}"
+        ) or []
+        
+        def redeem(appointment_id):
+            return requests.post(f"{self.base_url}/appointments/{appointment_id}/redeem").status_code
+        
+        with ThreadPoolExecutor(max_workers=50) as executor:
+            codes = list(executor.map(redeem, [a['id'] for a in appointments]))
+        
+        redeemed = codes.count(200)
+        packages = self.make_request("GET", f"/customer-packages/customer/{customer['id']}") or []
+        remaining = next((p['remaining_sessions'] for p in packages if p['id'] == customer_package['id']), None)
+        if redeemed != sessions or remaining != 0:
+            self.log_error(f"Redeemed {redeemed} of {sessions} sessions, {remaining} left")
+            return False
+        if any(code not in (200, 409) for code in codes):
+            self.log_error(f"Unexpected redemption responses: {sorted(set(codes))}")
+            return False
+        self.log_success(f"{len(codes)} parallel check-ins redeemed exactly {sessions} sessions")
+        return True
+    
     def run_all_tests(self):
         """Run all backend API tests"""
         print("🚀 Starting Comprehensive Backend API Testing...")
@@ -484,7 +622,9 @@ class BackendTester:
             self.test_customer_package_relationships,
             self.test_appointment_scheduling,
             self.test_payment_control,
-            self.test_dashboard_statistics
+            self.test_dashboard_statistics,
+            self.test_stats_counters,
+            self.test_session_redemption
         ]
         
         for test_method in test_methods:
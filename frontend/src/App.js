@@ -36,6 +36,29 @@ const DashboardIcon = () => (
   </svg>
 );
 
+// Live updates from /api/events: onChange gets each write to one of the tables,
+// onReset is called when events were missed and the data shown must be refetched
+const useChangeEvents = (tables, onChange, onReset) => {
+  useEffect(() => {
+    const source = new EventSource(`${API}/events?tables=${tables.join(',')}`);
+    source.addEventListener('change', (message) => onChange(JSON.parse(message.data)));
+    source.addEventListener('reset', onReset);
+    return () => source.close();
+  }, []);
+};
+
+// List endpoints answer one page at a time; follow X-Next-Cursor to the last page
+const fetchAllPages = async (url, params = {}) => {
+  const items = [];
+  let cursor = null;
+  do {
+    const response = await axios.get(url, { params: cursor ? { ...params, cursor } : params });
+    items.push(...response.data);
+    cursor = response.headers['x-next-cursor'];
+  } while (cursor);
+  return items;
+};
+
 const Dashboard = () => {
   const [stats, setStats] = useState({});
   const [loading, setLoading] = useState(true);
@@ -44,6 +67,13 @@ const Dashboard = () => {
     fetchStats();
   }, []);
 
+  // Every write may move a number on the dashboard
+  useChangeEvents(
+    ['customers', 'packages', 'customer_packages', 'appointments', 'payments'],
+    () => fetchStats(),
+    () => fetchStats(),
+  );
+
   const fetchStats = async () => {
     try {
       const response = await axios.get(`${API}/dashboard/stats`);
@@ -166,14 +196,20 @@ const CustomerForm = ({ customer, onSave, onCancel }) => {
     photo: customer?.photo || "",
     medical_notes: customer?.medical_notes || ""
   });
+  const [photoFile, setPhotoFile] = useState(null);
 
   const handleSubmit = async (e) => {
     e.preventDefault();
     try {
-      if (customer) {
-        await axios.put(`${API}/customers/${customer.id}`, formData);
-      } else {
-        await axios.post(`${API}/customers`, formData);
+      // The photo is uploaded separately; the JSON payload only echoes the current URL
+      const data = { ...formData, photo: customer?.photo || null };
+      const response = customer
+        ? await axios.put(`${API}/customers/${customer.id}`, data)
+        : await axios.post(`${API}/customers`, data);
+      if (photoFile) {
+        const upload = new FormData();
+        upload.append("file", photoFile);
+        await axios.post(`${API}/customers/${response.data.id}/photo`, upload);
       }
       onSave();
     } catch (error) {
@@ -184,11 +220,8 @@ const CustomerForm = ({ customer, onSave, onCancel }) => {
   const handlePhotoUpload = (e) => {
     const file = e.target.files[0];
     if (file) {
-      const reader = new FileReader();
-      reader.onload = (e) => {
-        setFormData({ ...formData, photo: e.target.result });
-      };
-      reader.readAsDataURL(file);
+      setPhotoFile(file);
+      setFormData({ ...formData, photo: URL.createObjectURL(file) });
     }
   };
 
@@ -315,8 +348,7 @@ const Customers = () => {
 
   const fetchCustomers = async () => {
     try {
-      const response = await axios.get(`${API}/customers`);
-      setCustomers(response.data);
+      setCustomers(await fetchAllPages(`${API}/customers`));
     } catch (error) {
       console.error("Error fetching customers:", error);
     } finally {
@@ -394,7 +426,7 @@ const Customers = () => {
                       {customer.photo && (
                         <img
                           className="h-10 w-10 rounded-full mr-3"
-                          src={customer.photo}
+                          src={`${customer.photo}&size=small`}
                           alt={customer.name}
                         />
                       )}
@@ -584,8 +616,7 @@ const Packages = () => {
 
   const fetchPackages = async () => {
     try {
-      const response = await axios.get(`${API}/packages`);
-      setPackages(response.data);
+      setPackages(await fetchAllPages(`${API}/packages`));
     } catch (error) {
       console.error("Error fetching packages:", error);
     } finally {
@@ -848,14 +879,20 @@ const Appointments = () => {
 
   useEffect(() => {
     fetchAppointments();
-    fetchCustomers();
-    fetchPackages();
   }, []);
 
+  // Full lists are only needed by the form selects
+  useEffect(() => {
+    if (showForm) {
+      fetchCustomers();
+      fetchPackages();
+    }
+  }, [showForm]);
+
   const fetchAppointments = async () => {
     try {
-      const response = await axios.get(`${API}/appointments`);
-      setAppointments(response.data);
+      // Customer and package of each appointment come in the same query
+      setAppointments(await fetchAllPages(`${API}/appointments`, { expand: 'customer,package' }));
     } catch (error) {
       console.error("Error fetching appointments:", error);
     } finally {
@@ -865,8 +902,7 @@ const Appointments = () => {
 
   const fetchCustomers = async () => {
     try {
-      const response = await axios.get(`${API}/customers`);
-      setCustomers(response.data);
+      setCustomers(await fetchAllPages(`${API}/customers`));
     } catch (error) {
       console.error("Error fetching customers:", error);
     }
@@ -874,13 +910,27 @@ const Appointments = () => {
 
   const fetchPackages = async () => {
     try {
-      const response = await axios.get(`${API}/packages`);
-      setPackages(response.data);
+      setPackages(await fetchAllPages(`${API}/packages`));
     } catch (error) {
       console.error("Error fetching packages:", error);
     }
   };
 
+  // Appointment changes reload the page of appointments (one query); customer and
+  // package edits are patched into the appointments that embed them
+  const applyChange = (event) => {
+    if (event.table === 'appointments' || !event.data) {
+      fetchAppointments();
+      return;
+    }
+    const relation = event.table === 'customers' ? 'customer' : 'package';
+    setAppointments((list) => list.map((appointment) => (
+      appointment[`${relation}_id`] === event.id ? { ...appointment, [relation]: event.data } : appointment
+    )));
+  };
+
+  useChangeEvents(['appointments', 'customers', 'packages'], applyChange, () => fetchAppointments());
+
   const handleSave = () => {
     setShowForm(false);
     setEditingAppointment(null);
@@ -892,14 +942,12 @@ const Appointments = () => {
     setShowForm(true);
   };
 
-  const getCustomerName = (customerId) => {
-    const customer = customers.find(c => c.id === customerId);
-    return customer ? customer.name : 'Cliente não encontrado';
+  const getCustomerName = (appointment) => {
+    return appointment.customer ? appointment.customer.name : 'Cliente não encontrado';
   };
 
-  const getPackageName = (packageId) => {
-    const pkg = packages.find(p => p.id === packageId);
-    return pkg ? pkg.name : 'Pacote não encontrado';
+  const getPackageName = (appointment) => {
+    return appointment.package ? appointment.package.name : 'Pacote não encontrado';
   };
 
   const getStatusColor = (status) => {
@@ -907,6 +955,7 @@ const Appointments = () => {
       case 'scheduled': return 'bg-yellow-100 text-yellow-800';
       case 'completed': return 'bg-green-100 text-green-800';
       case 'cancelled': return 'bg-red-100 text-red-800';
+      case 'no_show': return 'bg-orange-100 text-orange-800';
       default: return 'bg-gray-100 text-gray-800';
     }
   };
@@ -959,10 +1008,10 @@ const Appointments = () => {
                 <tr key={appointment.id}>
                   <td className="px-6 py-4 whitespace-nowrap">
                     <div className="text-sm font-medium text-gray-900">
-                      {getCustomerName(appointment.customer_id)}
+                      {getCustomerName(appointment)}
                     </div>
                     <div className="text-sm text-gray-500">
-                      {getPackageName(appointment.package_id)}
+                      {getPackageName(appointment)}
                     </div>
                   </td>
                   <td className="px-6 py-4 whitespace-nowrap">
@@ -980,6 +1029,7 @@ const Appointments = () => {
                       {appointment.status === 'scheduled' && 'Agendado'}
                       {appointment.status === 'completed' && 'Concluído'}
                       {appointment.status === 'cancelled' && 'Cancelado'}
+                      {appointment.status === 'no_show' && 'Faltou'}
                     </span>
                   </td>
                   <td className="px-6 py-4 whitespace-nowrap text-sm font-medium">
@@ -0,0 +1,88 @@
+"""Group commit: concurrent writes of the same kind share one transaction.
+
+A request calls ``GroupCommit.submit(item)`` and waits. The first item of a
+batch starts a timer of ``window`` seconds; when it fires, or as soon as
+``max_size`` items are waiting, the batch is handed to ``write_batch``,
+which writes them all in a single transaction and returns one result per
+item, or an exception for the items it refused. Each ``submit`` returns
+only after that transaction committed, so to the route a batched write
+looks like any other.
+
+Only one batch is written at a time: items arriving meanwhile make up the
+next one, written as soon as the current one commits. Under load batches
+grow instead of piling up behind each other's locks, and a quiet worker
+only pays the window.
+
+If ``write_batch`` itself raises (a bad row fails the whole statement, or
+the database went away), every item is retried alone with ``write_one`` so
+only the requests at fault see an error.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommit:
+    def __init__(self, name: str, write_batch: Callable[[list], Awaitable[list]],
+                 write_one: Callable[[object], Awaitable], window: float, max_size: int):
+        self.name = name
+        self.write_batch = write_batch
+        self.write_one = write_one
+        self.window = window
+        self.max_size = max_size
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._writing: Optional[asyncio.Future] = None
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None and self._writing is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._writing is not None or not self._pending:
+            # The batch being written flushes what is pending once it is done
+            return
+        batch, self._pending = self._pending[:self.max_size], self._pending[self.max_size:]
+        self._writing = asyncio.ensure_future(self._write(batch))
+        self._writing.add_done_callback(self._written)
+
+    def _written(self, task: asyncio.Future):
+        self._writing = None
+        self._flush()
+
+    async def _write(self, batch: List[tuple]):
+        items = [item for item, _ in batch]
+        metrics.DB_WRITE_BATCH_ROWS.observe(len(items), self.name)
+        try:
+            results = await self.write_batch(items)
+        except Exception as e:
+            if len(items) > 1:
+                logger.warning("Batch of %d %s failed, writing them one by one: %s", len(items), self.name, e)
+            results = await asyncio.gather(*(self.write_one(item) for item in items), return_exceptions=True)
+        for (_, future), result in zip(batch, results):
+            # Cancelled when the client went away; the row is written all the same
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def drain(self):
+        """Write whatever is waiting and wait for the batches in progress, before the pool closes"""
+        self._flush()
+        while self._writing is not None:
+            await asyncio.gather(self._writing, return_exceptions=True)
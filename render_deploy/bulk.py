@@ -0,0 +1,110 @@
+"""Streaming NDJSON/CSV parsing for the bulk import endpoints.
+
+Request bodies are consumed chunk by chunk, so an import of any size only
+keeps one batch of validated rows in memory.
+"""
+
+import csv
+import json
+import os
+from typing import AsyncIterator, Optional, Tuple, Union
+
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', '1000'))
+
+# Cap on the per-row errors echoed back; the failed count is always exact
+BULK_MAX_ERRORS = 1000
+
+
+def bulk_format(content_type: Optional[str], fmt: Optional[str]) -> str:
+    """Pick the body format from ``?format=`` or the Content-Type header"""
+    if fmt:
+        if fmt not in ("ndjson", "csv"):
+            raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+        return fmt
+    if content_type and "csv" in content_type:
+        return "csv"
+    return "ndjson"
+
+
+async def _iter_lines(stream) -> AsyncIterator[str]:
+    buffer = b""
+    first = True
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig" if first else "utf-8", errors="replace").rstrip("\r")
+            first = False
+    if buffer:
+        yield buffer.decode("utf-8-sig" if first else "utf-8", errors="replace").rstrip("\r")
+
+
+async def iter_records(stream, fmt: str) -> AsyncIterator[Tuple[int, Union[dict, str]]]:
+    """Yield ``(line_number, record)`` pairs; ``record`` is an error message for unparseable lines"""
+    header = None
+    pending = []
+    line_no = 0
+    async for text in _iter_lines(stream):
+        line_no += 1
+        if fmt == "ndjson":
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError as e:
+                yield line_no, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield line_no, "Each line must be a JSON object"
+                continue
+            yield line_no, record
+            continue
+
+        # CSV: a quoted field may contain newlines, so keep joining physical
+        # lines until the quotes balance
+        pending.append(text)
+        joined = "\n".join(pending)
+        if joined.count('"') % 2:
+            continue
+        record_line = line_no - len(pending) + 1
+        pending = []
+        values = next(csv.reader([joined]), [])
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if not any(values):
+            continue
+        if len(values) != len(header):
+            yield record_line, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        # Empty cells mean "not provided" so optional fields fall back to their defaults
+        yield record_line, {name: value for name, value in zip(header, values) if value != ""}
+
+    if pending:
+        yield line_no - len(pending) + 1, "Unterminated quoted field"
+
+
+def validate_record(model, record: dict) -> Union[BaseModel, str]:
+    """Validated model instance, or a one-line description of what is wrong"""
+    try:
+        return model(**record)
+    except ValidationError as e:
+        return "; ".join(f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors())
+
+
+class BulkResult:
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line: int, error: str):
+        self.failed += 1
+        if len(self.errors) < BULK_MAX_ERRORS:
+            self.errors.append({"line": line, "error": error})
+
+    def as_dict(self) -> dict:
+        return {"inserted": self.inserted, "failed": self.failed, "errors": self.errors}
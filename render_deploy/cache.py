@@ -0,0 +1,133 @@
+"""In-process caches for read-heavy endpoints.
+
+Caches live in each uvicorn worker, so an invalidation only reaches the
+worker that handled the write; other workers catch up when the TTL expires.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+MISSING = object()
+
+
+class TTLCache:
+    """Values that expire ``ttl`` seconds after being stored.
+
+    ``generation`` is bumped by every invalidation. Readers capture it before
+    querying and pass it to ``set`` so a result computed while a write was
+    landing is dropped instead of being cached stale.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._data = {}
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._data.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return MISSING
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        if generation is not None and generation != self.generation:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key: Hashable = MISSING):
+        """Drop one key, or everything when called without arguments"""
+        self.generation += 1
+        self.invalidations += 1
+        if key is MISSING:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "ttl": self.ttl,
+            "entries": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0,
+            "invalidations": self.invalidations,
+        }
+
+
+class LRUCache(TTLCache):
+    """TTLCache holding at most ``max_size`` entries, evicting the least recently used.
+
+    ``get_or_load`` reads through: a miss awaits ``loader()`` once, and
+    concurrent misses for the same key wait on that same load instead of
+    each querying the database. Invalidating a key also detaches its
+    in-flight load, so later callers do not receive a value read before
+    the write.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        super().__init__(ttl)
+        self.max_size = max_size
+        self.evictions = 0
+        self.coalesced = 0
+        self._data = OrderedDict()
+        self._loading = {}
+
+    def get(self, key: Hashable) -> Any:
+        value = super().get(key)
+        if value is not MISSING:
+            self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        super().set(key, value, generation)
+        if key in self._data:
+            self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable = MISSING):
+        super().invalidate(key)
+        if key is MISSING:
+            self._loading.clear()
+        else:
+            self._loading.pop(key, None)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Cached value of ``key``, loading it on a miss; None results are returned but not cached"""
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+        load = self._loading.get(key)
+        if load is None:
+            load = self._loading[key] = asyncio.ensure_future(self._load(key, loader, self.generation))
+        else:
+            self.coalesced += 1
+        # Shielded, so one caller giving up does not cancel the load the others wait on
+        return await asyncio.shield(load)
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], generation: int) -> Any:
+        try:
+            value = await loader()
+            if value is not None:
+                self.set(key, value, generation)
+            return value
+        finally:
+            if self._loading.get(key) is asyncio.current_task():
+                del self._loading[key]
+
+    def stats(self) -> dict:
+        return dict(
+            super().stats(),
+            max_size=self.max_size,
+            evictions=self.evictions,
+            coalesced=self.coalesced,
+        )
@@ -0,0 +1,85 @@
+"""Dashboard counters kept in stats_counters / stats_daily_counters.
+
+Triggers installed by migration 4 keep the counters current on every write;
+``reconcile_counters`` rebuilds them from the source tables when they need
+to be checked or repaired.
+"""
+
+import asyncio
+import os
+from typing import Dict
+
+# Counter name -> query producing its true value
+TOTAL_COUNTERS = {
+    "customers": "SELECT COUNT(*) FROM customers",
+    "packages": "SELECT COUNT(*) FROM packages",
+    "appointments": "SELECT COUNT(*) FROM appointments",
+    "active_customer_packages": "SELECT COUNT(*) FROM customer_packages WHERE status = 'active'",
+}
+
+
+async def reconcile_counters(conn, dry_run: bool = False) -> Dict[str, dict]:
+    """Recount every counter from scratch and return the ones that had drifted.
+
+    Source tables are locked in SHARE mode for the duration, which blocks
+    writes (not reads) so the recount and the stored values cannot diverge.
+    """
+    drift = {}
+    async with conn.transaction():
+        await conn.execute('LOCK TABLE customers, packages, appointments, customer_packages IN SHARE MODE')
+
+        stored = {row['name']: row['value'] for row in await conn.fetch('SELECT name, value FROM stats_counters')}
+        for name, query in TOTAL_COUNTERS.items():
+            actual = await conn.fetchval(query)
+            if stored.get(name) != actual:
+                drift[name] = {"stored": stored.get(name), "actual": actual}
+
+        stored_days = {
+            row['day']: row['value']
+            for row in await conn.fetch("SELECT day, value FROM stats_daily_counters WHERE name = 'appointments'")
+        }
+        actual_days = {
+            row['date']: row['n']
+            for row in await conn.fetch('SELECT date, COUNT(*) AS n FROM appointments GROUP BY date')
+        }
+        for day in stored_days.keys() | actual_days.keys():
+            # Days whose appointments were all deleted may keep a zero row
+            if stored_days.get(day, 0) != actual_days.get(day, 0):
+                drift[f"appointments:{day.isoformat()}"] = {
+                    "stored": stored_days.get(day), "actual": actual_days.get(day, 0)
+                }
+
+        if not dry_run:
+            await conn.executemany(
+                '''
+                INSERT INTO stats_counters (name, value) VALUES ($1, $2)
+                ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value
+                ''',
+                [(name, drift[name]["actual"]) for name in TOTAL_COUNTERS if name in drift]
+            )
+            await conn.execute("DELETE FROM stats_daily_counters WHERE name = 'appointments'")
+            await conn.copy_records_to_table(
+                'stats_daily_counters',
+                records=[("appointments", day, n) for day, n in actual_days.items()],
+                columns=['name', 'day', 'value'],
+            )
+    return drift
+
+
+async def _main():
+    import asyncpg
+
+    conn = await asyncpg.connect(os.environ['DATABASE_URL'])
+    try:
+        drift = await reconcile_counters(conn)
+    finally:
+        await conn.close()
+    if drift:
+        for name, values in sorted(drift.items()):
+            print(f"{name}: stored={values['stored']} actual={values['actual']}")
+    print(f"Counters rebuilt, {len(drift)} had drifted")
+
+
+if __name__ == "__main__":
+    # Run as a one-off job: python counters.py
+    asyncio.run(_main())
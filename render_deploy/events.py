@@ -0,0 +1,169 @@
+"""Change events, published in-process and streamed to clients as server-sent events.
+
+Write routes publish one small event per change (table, action, id and,
+when it fits in EVENT_MAX_BYTES, the row as the API returns it). Each
+``/api/events`` connection reads from a queue of its own, bounded to
+EVENTS_QUEUE_SIZE events: a client that stops reading, or reads slower
+than writes happen, fills its queue and is sent ``reset`` and disconnected
+instead of growing memory or slowing down the writers. ``reset`` tells a
+client to refetch what it shows before applying further events.
+
+Every worker keeps the last EVENTS_QUEUE_SIZE events it published, so a
+client reconnecting with ``Last-Event-ID`` to the same worker resumes
+where it left off; elsewhere, or too late, it gets ``reset``. Events of
+the other workers arrive over LISTEN/NOTIFY (see routes.py).
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Iterable, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+# Events a connection may have waiting before it is reset; also the replay history
+EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', '256'))
+# Open /api/events connections per worker; more are answered 503
+EVENTS_MAX_CLIENTS = int(os.environ.get('EVENTS_MAX_CLIENTS', '100'))
+# Rows whose JSON is larger than this are sent without ``data``; clients fetch them by id
+EVENT_MAX_BYTES = int(os.environ.get('EVENT_MAX_BYTES', '4096'))
+# Seconds between keep-alive comments on an idle stream
+EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT', '15'))
+# Seconds before a stream is closed for the client to reconnect, so restarts are not held up by it
+EVENTS_MAX_AGE = float(os.environ.get('EVENTS_MAX_AGE', '300'))
+
+# Milliseconds EventSource waits before reconnecting
+RETRY_MS = 2000
+
+HEARTBEAT = b": ping\n\n"
+
+
+def change_event(table: str, action: str, id: Optional[str] = None, data=None) -> dict:
+    """``action`` is created, updated, deleted or, with no id, imported/swept for writes of many rows"""
+    event = {"table": table, "action": action, "id": id}
+    if data is not None:
+        data = jsonable_encoder(data)
+        if len(json.dumps(data)) <= EVENT_MAX_BYTES:
+            event["data"] = data
+    return event
+
+
+def encode(name: str, data: dict, id: Optional[str] = None) -> bytes:
+    lines = [f"id: {id}"] if id else []
+    lines += [f"event: {name}", f"data: {json.dumps(data, separators=(',', ':'))}", "", ""]
+    return "\n".join(lines).encode()
+
+
+class Subscription:
+    def __init__(self, bus: "EventBus", tables: Optional[Iterable[str]]):
+        self.bus = bus
+        self.tables = set(tables) if tables else None
+        self.queue: asyncio.Queue = asyncio.Queue(bus.queue_size)
+        self.closed = False
+
+    def wants(self, table: str) -> bool:
+        return self.tables is None or table in self.tables
+
+    def reset(self, close: bool = True):
+        """Drop whatever is queued and leave only ``reset``; with ``close`` the stream ends after sending it"""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(self.bus.reset_event())
+        self.bus.resets += 1
+        if close:
+            self.close()
+
+    def close(self):
+        self.closed = True
+        self.bus.subscribers.discard(self)
+
+    async def stream(self, heartbeat: float = EVENTS_HEARTBEAT, max_age: float = EVENTS_MAX_AGE):
+        """SSE body: queued events as they come, a comment when idle, until reset or ``max_age``"""
+        deadline = time.monotonic() + max_age
+        try:
+            yield f"retry: {RETRY_MS}\n\n".encode()
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    event = await asyncio.wait_for(self.queue.get(), min(heartbeat, remaining))
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT
+                    continue
+                yield event
+                if self.closed and self.queue.empty():
+                    return
+        finally:
+            self.close()
+
+
+class EventBus:
+    """Fans events out to every subscription; publishing never waits on a subscriber"""
+
+    def __init__(self, name: str, queue_size: int = EVENTS_QUEUE_SIZE, max_subscribers: int = EVENTS_MAX_CLIENTS):
+        self.name = name
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.subscribers = set()
+        self.seq = 0
+        self.published = 0
+        self.resets = 0
+        # (seq, table, encoded event) of the latest events, for Last-Event-ID
+        self._history = deque(maxlen=queue_size)
+
+    def reset_event(self) -> bytes:
+        return encode("reset", {}, f"{self.name}-{self.seq}")
+
+    def subscribe(self, tables: Optional[Iterable[str]] = None, last_event_id: Optional[str] = None):
+        """A new subscription, or None when EVENTS_MAX_CLIENTS are already connected"""
+        if len(self.subscribers) >= self.max_subscribers:
+            return None
+        subscription = Subscription(self, tables)
+        self.subscribers.add(subscription)
+        if last_event_id:
+            self._replay(subscription, last_event_id)
+        return subscription
+
+    def _replay(self, subscription: Subscription, last_event_id: str):
+        name, _, seq = last_event_id.rpartition("-")
+        oldest = self._history[0][0] if self._history else self.seq + 1
+        if name != self.name or not seq.isdigit() or not oldest - 1 <= int(seq) <= self.seq:
+            # Events were missed: numbered by another worker, or already forgotten
+            subscription.reset(close=False)
+            return
+        for event_seq, table, event in self._history:
+            if event_seq > int(seq) and subscription.wants(table):
+                subscription.queue.put_nowait(event)
+
+    def publish(self, event: dict):
+        self.seq += 1
+        self.published += 1
+        encoded = encode("change", event, f"{self.name}-{self.seq}")
+        self._history.append((self.seq, event["table"], encoded))
+        for subscription in list(self.subscribers):
+            if not subscription.wants(event["table"]):
+                continue
+            try:
+                subscription.queue.put_nowait(encoded)
+            except asyncio.QueueFull:
+                # Too far behind to catch up
+                subscription.reset()
+
+    def reset(self):
+        """Reset every subscription, for when events may have been missed; replays reset too"""
+        self._history.clear()
+        for subscription in list(self.subscribers):
+            subscription.reset()
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self.subscribers),
+            "max_clients": self.max_subscribers,
+            "queue_size": self.queue_size,
+            "queued": sum(subscription.queue.qsize() for subscription in self.subscribers),
+            "published": self.published,
+            "resets": self.resets,
+        }
@@ -0,0 +1,118 @@
+"""ETags and Cache-Control for read endpoints.
+
+Write routes bump a per-table version counter; a GET whose body only
+depends on those tables gets an ETag derived from their versions, so a
+matching ``If-None-Match`` is answered with 304 before the route (and the
+database) is reached.
+
+Versions live in each uvicorn worker and every worker's ETags carry its
+own token. With several workers, set NOTIFY_CHANGES: each write is then
+announced over LISTEN/NOTIFY and the other workers bump the table too
+(see ``change_received`` in routes.py); without it, another worker's ETags
+stay current only for writes it handled itself.
+"""
+
+import hashlib
+import os
+import re
+import uuid
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+
+# Hashed build assets never change under the same name
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Always revalidate; the ETag makes that a bodiless 304 when nothing changed
+REVALIDATE = "private, no-cache"
+
+
+class TableVersions:
+    def __init__(self):
+        # Distinguishes this process's counters from another worker's or a previous boot's
+        self.token = uuid.uuid4().hex[:12]
+        self.versions: Dict[str, int] = {}
+
+    def bump(self, *tables: str):
+        for table in tables:
+            self.versions[table] = self.versions.get(table, 0) + 1
+
+    def etag(self, tables: Iterable[str], path: str, query: str) -> str:
+        state = ",".join(f"{table}={self.versions.get(table, 0)}" for table in tables)
+        digest = hashlib.sha1(f"{self.token}|{state}|{path}?{query}".encode()).hexdigest()
+        return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # Weak comparison, as RFC 9110 prescribes for If-None-Match
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+class ConditionalGetMiddleware:
+    """Adds ETag/Cache-Control to GETs matching ``rules`` and answers revalidations with 304.
+
+    ``rules`` are ``(path_pattern, tables, cache_control)``: the response of
+    a matching path must depend only on ``tables`` and the query string.
+    """
+
+    def __init__(self, app, versions: TableVersions, rules: List[Tuple[str, Tuple[str, ...], str]]):
+        self.app = app
+        self.versions = versions
+        self.rules: List[Tuple[Pattern, Tuple[str, ...], str]] = [
+            (re.compile(pattern), tables, cache_control) for pattern, tables, cache_control in rules
+        ]
+
+    def _match(self, path: str):
+        for pattern, tables, cache_control in self.rules:
+            if pattern.fullmatch(path):
+                return tables, cache_control
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+        match = self._match(scope["path"])
+        if match is None:
+            await self.app(scope, receive, send)
+            return
+
+        tables, cache_control = match
+        # Taken before the route runs: a write landing meanwhile can only make the tag stale, never wrong
+        etag = self.versions.etag(tables, scope["path"], scope.get("query_string", b"").decode("latin-1"))
+        if etag_matches(Headers(scope=scope).get("if-none-match"), etag):
+            response = Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+            await response(scope, receive, send)
+            return
+
+        async def send_with_etag(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                headers = MutableHeaders(scope=message)
+                headers["ETag"] = etag
+                headers.setdefault("Cache-Control", cache_control)
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles for a fingerprinted build: every file is cacheable forever"""
+
+    def file_response(self, *args, **kwargs) -> Response:
+        response = super().file_response(*args, **kwargs)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = IMMUTABLE
+        return response
+
+
+def file_response(request: Request, path: str, cache_control: str) -> Response:
+    """FileResponse that honours If-None-Match against the file's own ETag"""
+    response = FileResponse(path, stat_result=os.stat(path), headers={"Cache-Control": cache_control})
+    if etag_matches(request.headers.get("if-none-match"), response.headers["etag"]):
+        return Response(status_code=304, headers={"ETag": response.headers["etag"], "Cache-Control": cache_control})
+    return response
@@ -0,0 +1,175 @@
+"""Periodic maintenance sweeps run inside the API process.
+
+Every uvicorn worker starts a ``JobRunner``; a session-level advisory lock
+per job makes sure only one of them actually runs a given sweep at a time,
+the others just skip that tick. Sweeps update rows in small batches so no
+statement holds row locks for long, and are idempotent: a second run right
+after the first finds nothing left to do.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Union
+
+from reports import refresh_rollups
+
+logger = logging.getLogger(__name__)
+
+JOBS_ENABLED = os.environ.get('JOBS_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+JOB_BATCH_SIZE = int(os.environ.get('JOB_BATCH_SIZE', '500'))
+
+# Advisory lock ids are JOB_LOCK_BASE + position in JOBS
+JOB_LOCK_BASE = 7_302_000
+
+
+class Job(NamedTuple):
+    name: str
+    interval: float
+    # One batch: an SQL statement touching at most $1 rows, or an async
+    # callable (conn, batch_size) returning how many rows it touched
+    batch: Union[str, Callable]
+
+
+JOBS: List[Job] = [
+    Job(
+        "expire_packages",
+        float(os.environ.get('PACKAGE_EXPIRY_INTERVAL', '3600')),
+        '''
+        UPDATE customer_packages SET status = 'expired'
+        WHERE id IN (
+            SELECT id FROM customer_packages
+            WHERE status = 'active' AND expiry_date < CURRENT_DATE
+            LIMIT $1
+            FOR UPDATE SKIP LOCKED
+        )
+        ''',
+    ),
+    Job(
+        "mark_no_shows",
+        float(os.environ.get('NO_SHOW_INTERVAL', '3600')),
+        '''
+        UPDATE appointments SET status = 'no_show'
+        WHERE id IN (
+            SELECT id FROM appointments
+            WHERE status = 'scheduled' AND date < CURRENT_DATE
+            LIMIT $1
+            FOR UPDATE SKIP LOCKED
+        )
+        ''',
+    ),
+    Job(
+        "refresh_reports",
+        float(os.environ.get('REPORT_REFRESH_INTERVAL', '60')),
+        refresh_rollups,
+    ),
+]
+
+
+class JobStats:
+    def __init__(self):
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+        self.rows_total = 0
+        self.last_run_at: Optional[float] = None
+        self.last_duration_ms: Optional[float] = None
+        self.last_rows: Optional[int] = None
+        self.last_error: Optional[str] = None
+
+    def snapshot(self) -> dict:
+        return {
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "rows_total": self.rows_total,
+            "last_run_at": self.last_run_at,
+            "last_duration_ms": self.last_duration_ms,
+            "last_rows": self.last_rows,
+            "last_error": self.last_error,
+        }
+
+
+class JobRunner:
+    """Runs every job in ``jobs`` on its own interval until ``stop`` is called.
+
+    ``acquire`` is an async context manager factory yielding a connection;
+    ``on_change(name)`` is awaited after any sweep that touched rows.
+    """
+
+    def __init__(self, acquire, jobs: List[Job] = JOBS, on_change: Optional[Callable[[str], Awaitable]] = None,
+                 batch_size: int = JOB_BATCH_SIZE):
+        self.acquire = acquire
+        self.jobs = {job.name: job for job in jobs}
+        self.lock_ids = {job.name: JOB_LOCK_BASE + i for i, job in enumerate(jobs)}
+        self.stats: Dict[str, JobStats] = {job.name: JobStats() for job in jobs}
+        self.on_change = on_change
+        self.batch_size = batch_size
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        for job in self.jobs.values():
+            self._tasks.append(asyncio.create_task(self._loop(job), name=f"job:{job.name}"))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _loop(self, job: Job):
+        while True:
+            try:
+                await self.run(job.name)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Already recorded in the job stats; keep the schedule going
+                pass
+            await asyncio.sleep(job.interval)
+
+    async def run(self, name: str) -> Optional[int]:
+        """Run one sweep now; returns rows touched, or None if another worker holds it"""
+        job = self.jobs[name]
+        stats = self.stats[name]
+        lock_id = self.lock_ids[name]
+        started = time.perf_counter()
+        rows = 0
+        try:
+            async with self.acquire() as conn:
+                if not await conn.fetchval('SELECT pg_try_advisory_lock($1)', lock_id):
+                    stats.skipped += 1
+                    return None
+                try:
+                    while True:
+                        if callable(job.batch):
+                            touched = await job.batch(conn, self.batch_size)
+                        else:
+                            result = await conn.execute(job.batch, self.batch_size)
+                            touched = int(result.split()[-1])
+                        rows += touched
+                        if touched < self.batch_size:
+                            break
+                finally:
+                    await conn.execute('SELECT pg_advisory_unlock($1)', lock_id)
+        except Exception as e:
+            stats.failures += 1
+            stats.last_error = str(e)
+            logger.exception("Job %s failed after %d rows", name, rows)
+            raise
+        finally:
+            stats.last_duration_ms = round((time.perf_counter() - started) * 1000, 2)
+
+        stats.runs += 1
+        stats.rows_total += rows
+        stats.last_rows = rows
+        stats.last_run_at = time.time()
+        stats.last_error = None
+        logger.info("Job %s touched %d rows in %.1f ms", name, rows, stats.last_duration_ms)
+        if rows and self.on_change:
+            await self.on_change(name)
+        return rows
+
+    def snapshot(self) -> dict:
+        return {name: {"interval": self.jobs[name].interval, **stats.snapshot()} for name, stats in self.stats.items()}
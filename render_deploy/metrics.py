@@ -0,0 +1,286 @@
+"""Request and query metrics, exposed in Prometheus text format at /metrics.
+
+``MetricsMiddleware`` records latency, status and response size per route
+template (``/api/customers/{customer_id}``, never the raw path). The storage
+backends report each database call through ``query_timer`` or
+``record_query``: its time and rows per statement, and the time a request
+spent in the database, so query time can be told apart from everything else
+a request does. Metrics live in each uvicorn worker, like the caches.
+"""
+
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Sequence
+
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+# Queries slower than this many milliseconds are logged; 0 disables the log
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '0'))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+logger = logging.getLogger(__name__)
+
+# Motor reports its commands from driver threads, so every update takes the lock
+_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        REGISTRY.append(self)
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+    def samples(self) -> list:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        with _lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> list:
+        return [f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    """A value set by the app, or read from ``function`` (label values -> value) at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), function: Optional[Callable] = None):
+        super().__init__(name, help, labels)
+        self.values: Dict[tuple, float] = {}
+        self.function = function
+
+    def inc(self, *label_values, amount: float = 1):
+        with _lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def samples(self) -> list:
+        values = self.function() if self.function else self.values
+        return [f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                counts = self.values[label_values] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self) -> list:
+        lines = []
+        for key, counts in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="%s"' % ("+Inf" if bound == float("inf") else _number(bound))
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(counts[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+REGISTRY: list = []
+
+HTTP_REQUESTS = Counter("http_requests_total", "Requests answered", ("method", "route", "status"))
+HTTP_DURATION = Histogram("http_request_duration_seconds", "Time to answer a request", ("method", "route"))
+HTTP_DB_TIME = Histogram(
+    "http_request_db_seconds", "Part of a request spent waiting on database queries", ("method", "route")
+)
+HTTP_RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Response body bytes as sent, after compression", ("method", "route"), SIZE_BUCKETS
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being answered right now")
+
+DB_QUERY_DURATION = Histogram("db_query_duration_seconds", "Database call time per statement", ("statement",))
+DB_QUERY_ROWS = Counter("db_query_rows_total", "Rows returned or affected per statement", ("statement",))
+DB_QUERY_ERRORS = Counter("db_query_errors_total", "Database calls that raised, per statement", ("statement",))
+DB_POOL_WAIT = Histogram("db_pool_wait_seconds", "Time spent waiting for a pooled connection")
+DB_POOL_CONNECTIONS = Gauge("db_pool_connections", "Pooled connections by state", ("state",), function=dict)
+DB_POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Requests refused because no connection freed up in time")
+DB_WRITE_BATCH_ROWS = Histogram(
+    "db_write_batch_rows", "Rows written per group commit transaction", ("batch",), BATCH_BUCKETS
+)
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+# ===============================
+# DATABASE CALLS
+# ===============================
+
+# Database seconds of the request being served; a list so tasks it spawns add to the same total
+_request_db_time: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("request_db_time", default=None)
+
+
+@lru_cache(maxsize=1024)
+def statement_label(query: str) -> str:
+    """SQL on one line, cut short, as the label of a fixed statement.
+
+    Statements whose text is built per request (projected columns, filters)
+    would add a series per variant, so their callers pass ``label=`` instead.
+    """
+    text = " ".join(query.split())
+    if len(text) <= 160:
+        return text
+    # Long statements often share their first lines, so the checksum keeps them apart
+    return f"{text[:150]}... [{zlib.crc32(text.encode()):08x}]"
+
+
+def record_query(statement: str, seconds: float, rows: int = 0, failed: bool = False):
+    DB_QUERY_DURATION.observe(seconds, statement)
+    if rows:
+        DB_QUERY_ROWS.inc(statement, amount=rows)
+    if failed:
+        DB_QUERY_ERRORS.inc(statement)
+    request_time = _request_db_time.get()
+    if request_time is not None:
+        request_time[0] += seconds
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        logger.warning("Slow query: %.1f ms, %d rows: %s", seconds * 1000, rows, statement)
+
+
+class _QueryResult:
+    rows = 0
+
+
+@contextmanager
+def query_timer(query: str, label: Optional[str] = None):
+    """Time the block as one call of ``query``, or of ``label`` when given; set ``.rows`` on the yielded object"""
+    result = _QueryResult()
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield result
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        record_query(label or statement_label(query), time.perf_counter() - started, result.rows, failed)
+
+# ===============================
+# REQUESTS
+# ===============================
+
+def route_template(scope) -> str:
+    """The route a request matched, with path parameters put back as ``{name}``"""
+    if "endpoint" not in scope:
+        return "unmatched"
+    if "app_root_path" in scope:
+        # Served by a mounted app such as /static
+        return scope["root_path"] + "/{path}"
+    segments = scope["path"].split("/")
+    for name, value in (scope.get("path_params") or {}).items():
+        value = str(value)
+        if "/" in value:
+            # A {name:path} parameter, always the tail of the path
+            segments[-(value.count("/") + 1):] = ["{" + name + "}"]
+        elif value in segments:
+            index = len(segments) - 1 - segments[::-1].index(value)
+            segments[index] = "{" + name + "}"
+    return "/".join(segments)
+
+
+class MetricsMiddleware:
+    """Latency, status, size and database time of every HTTP request.
+
+    Add it last so it wraps every other middleware and sees bytes as sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        db_time = [0.0]
+        token = _request_db_time.set(db_time)
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            _request_db_time.reset(token)
+            method, route = scope["method"], route_template(scope)
+            HTTP_REQUESTS.inc(method, route, status)
+            HTTP_DURATION.observe(elapsed, method, route)
+            HTTP_DB_TIME.observe(db_time[0], method, route)
+            HTTP_RESPONSE_SIZE.observe(size, method, route)
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,471 @@
+"""Versioned schema migrations.
+
+Each migration runs once, inside its own transaction, and is recorded in
+``schema_migrations``. To change the schema append a new ``Migration`` with
+the next version number; never edit one that has already shipped.
+"""
+
+import logging
+from typing import Callable, List, NamedTuple, Union
+
+from counters import reconcile_counters
+from photos import PhotoStore, PHOTO_STORAGE_DIR, InvalidPhoto, decode_photo
+from reports import mark_all_days_dirty
+from scheduling import end_time_for, parse_time
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key for pg_advisory_lock so only one worker migrates at a time
+MIGRATION_LOCK_ID = 7_301_001
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    steps: List[Union[str, Callable]]
+
+
+async def migrate_inline_photos(conn):
+    """Copy base64 photos stored in customers.photo into the photo store.
+
+    Migration 12 clears the inline copies this leaves behind.
+    """
+    photo_store = PhotoStore(PHOTO_STORAGE_DIR)
+    migrated = 0
+    last_id = ''
+    while True:
+        rows = await conn.fetch('''
+            SELECT id, photo FROM customers
+            WHERE photo IS NOT NULL AND photo_hash IS NULL AND id > $1
+            ORDER BY id
+            LIMIT 100
+        ''', last_id)
+        if not rows:
+            break
+        for row in rows:
+            last_id = row['id']
+            try:
+                digest = photo_store.put(decode_photo(row['photo']))
+            except InvalidPhoto as e:
+                # Leave the original data in place so nothing is lost
+                logger.warning("Could not migrate photo of customer %s: %s", row['id'], e)
+                continue
+            await conn.execute(
+                'UPDATE customers SET photo_hash = $2 WHERE id = $1', row['id'], digest
+            )
+            migrated += 1
+    if migrated:
+        print(f"Copied {migrated} inline customer photos to the photo store")
+
+
+async def clear_inline_photos(conn):
+    """Move every photo still in customers.photo to the photo store and clear the column.
+
+    PhotoStore.put() has fsynced the file before the row is cleared, so a
+    crash leaves the inline copy, the file or both, never neither. Photos
+    that do not decode are left in place.
+    """
+    photo_store = PhotoStore(PHOTO_STORAGE_DIR)
+    cleared = 0
+    last_id = ''
+    while True:
+        rows = await conn.fetch('''
+            SELECT id, photo FROM customers
+            WHERE photo IS NOT NULL AND id > $1
+            ORDER BY id
+            LIMIT 100
+        ''', last_id)
+        if not rows:
+            break
+        for row in rows:
+            last_id = row['id']
+            try:
+                digest = photo_store.put(decode_photo(row['photo']))
+            except InvalidPhoto as e:
+                logger.warning("Could not migrate photo of customer %s: %s", row['id'], e)
+                continue
+            await conn.execute(
+                'UPDATE customers SET photo_hash = COALESCE(photo_hash, $2), photo = NULL WHERE id = $1',
+                row['id'], digest
+            )
+            cleared += 1
+    if cleared:
+        print(f"Moved {cleared} inline customer photos to the photo store")
+
+
+async def backfill_appointment_slots(conn):
+    """Derive start/end times from the free-text time of existing appointments"""
+    rows = await conn.fetch('SELECT id, time, service_type FROM appointments WHERE start_time IS NULL')
+    updates = []
+    for row in rows:
+        try:
+            start = parse_time(row['time'])
+        except ValueError:
+            # Unparseable legacy times stay untyped and are ignored by conflict checks
+            logger.warning("Appointment %s has unparseable time %r", row['id'], row['time'])
+            continue
+        updates.append((row['id'], start.strftime("%H:%M"), start, end_time_for(start, row['service_type'])))
+    await conn.executemany(
+        'UPDATE appointments SET time = $2, start_time = $3, end_time = $4 WHERE id = $1', updates
+    )
+
+
+# Normalised text a customer is searched by: CPF and phone reduced to digits
+# so "123.456" and "123456" both match
+CUSTOMER_SEARCH_TEXT = (
+    "lower(coalesce(name, '') || ' ' || coalesce(email, '') || ' ' || "
+    "regexp_replace(coalesce(cpf, ''), '\\D', '', 'g') || ' ' || "
+    "regexp_replace(coalesce(phone, ''), '\\D', '', 'g'))"
+)
+
+
+MIGRATIONS = [
+    # IF NOT EXISTS keeps this a no-op on databases created before the runner existed
+    Migration(1, "initial schema", [
+        '''
+        CREATE TABLE IF NOT EXISTS customers (
+            id VARCHAR PRIMARY KEY,
+            name VARCHAR NOT NULL,
+            cpf VARCHAR NOT NULL,
+            email VARCHAR NOT NULL,
+            phone VARCHAR NOT NULL,
+            address VARCHAR NOT NULL,
+            birth_date DATE NOT NULL,
+            photo TEXT,
+            medical_notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS packages (
+            id VARCHAR PRIMARY KEY,
+            name VARCHAR NOT NULL,
+            type VARCHAR NOT NULL,
+            price DECIMAL NOT NULL,
+            description TEXT NOT NULL,
+            duration_days INTEGER,
+            sessions_included INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS customer_packages (
+            id VARCHAR PRIMARY KEY,
+            customer_id VARCHAR NOT NULL,
+            package_id VARCHAR NOT NULL,
+            purchase_date DATE NOT NULL,
+            amount_paid DECIMAL NOT NULL,
+            payment_method VARCHAR NOT NULL,
+            status VARCHAR DEFAULT 'active',
+            remaining_sessions INTEGER,
+            expiry_date DATE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS appointments (
+            id VARCHAR PRIMARY KEY,
+            customer_id VARCHAR NOT NULL,
+            package_id VARCHAR NOT NULL,
+            date DATE NOT NULL,
+            time VARCHAR NOT NULL,
+            service_type VARCHAR NOT NULL,
+            instructor VARCHAR,
+            status VARCHAR DEFAULT 'scheduled',
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS payments (
+            id VARCHAR PRIMARY KEY,
+            customer_package_id VARCHAR NOT NULL,
+            amount DECIMAL NOT NULL,
+            payment_date DATE NOT NULL,
+            payment_method VARCHAR NOT NULL,
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    Migration(2, "customer photos in the photo store", [
+        'ALTER TABLE customers ADD COLUMN IF NOT EXISTS photo_hash VARCHAR',
+        migrate_inline_photos,
+    ]),
+    Migration(3, "indexes for list, dashboard and relationship lookups", [
+        # Keyset order of the list endpoints
+        'CREATE INDEX IF NOT EXISTS idx_customers_created_at_id ON customers (created_at DESC, id DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_packages_created_at_id ON packages (created_at DESC, id DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_appointments_date_time_id ON appointments (date DESC, time DESC, id DESC)',
+        # Fails if duplicate CPFs already exist; resolve them by hand and restart
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_customers_cpf ON customers (cpf)',
+        # Dashboard filters and ordering
+        'CREATE INDEX IF NOT EXISTS idx_customer_packages_status ON customer_packages (status)',
+        'CREATE INDEX IF NOT EXISTS idx_payments_payment_date ON payments (payment_date DESC)',
+        # Relationship lookups
+        'CREATE INDEX IF NOT EXISTS idx_customer_packages_customer ON customer_packages (customer_id)',
+        'CREATE INDEX IF NOT EXISTS idx_customer_packages_package ON customer_packages (package_id)',
+        'CREATE INDEX IF NOT EXISTS idx_appointments_customer_date ON appointments (customer_id, date DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_appointments_package ON appointments (package_id)',
+        'CREATE INDEX IF NOT EXISTS idx_payments_customer_package ON payments (customer_package_id, payment_date DESC)',
+    ]),
+    # Statement-level triggers with transition tables, so a multi-row INSERT or
+    # COPY costs one counter update rather than one per row
+    Migration(4, "dashboard counters maintained by triggers", [
+        '''
+        CREATE TABLE stats_counters (
+            name VARCHAR PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE stats_daily_counters (
+            name VARCHAR NOT NULL,
+            day DATE NOT NULL,
+            value BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (name, day)
+        )
+        ''',
+        '''
+        CREATE FUNCTION stats_count_rows() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE stats_counters SET value = value + (SELECT COUNT(*) FROM new_rows)
+                WHERE name = TG_TABLE_NAME;
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE stats_counters SET value = value - (SELECT COUNT(*) FROM old_rows)
+                WHERE name = TG_TABLE_NAME;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        ''',
+        '''
+        CREATE FUNCTION stats_count_appointment_days() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO stats_daily_counters (name, day, value)
+                SELECT 'appointments', date, COUNT(*) FROM new_rows GROUP BY date
+                ON CONFLICT (name, day) DO UPDATE SET value = stats_daily_counters.value + EXCLUDED.value;
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE stats_daily_counters c SET value = c.value - o.n
+                FROM (SELECT date, COUNT(*) AS n FROM old_rows GROUP BY date) o
+                WHERE c.name = 'appointments' AND c.day = o.date;
+            ELSIF TG_OP = 'UPDATE' THEN
+                -- Only rescheduled appointments move between days
+                UPDATE stats_daily_counters c SET value = c.value - moved.n
+                FROM (SELECT o.date, COUNT(*) AS n FROM old_rows o JOIN new_rows n USING (id)
+                      WHERE o.date <> n.date GROUP BY o.date) moved
+                WHERE c.name = 'appointments' AND c.day = moved.date;
+                INSERT INTO stats_daily_counters (name, day, value)
+                SELECT 'appointments', n.date, COUNT(*) FROM old_rows o JOIN new_rows n USING (id)
+                WHERE o.date <> n.date GROUP BY n.date
+                ON CONFLICT (name, day) DO UPDATE SET value = stats_daily_counters.value + EXCLUDED.value;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        ''',
+        '''
+        CREATE FUNCTION stats_count_active_packages() RETURNS trigger AS $$
+        DECLARE
+            delta BIGINT := 0;
+        BEGIN
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                delta := delta + (SELECT COUNT(*) FROM new_rows WHERE status = 'active');
+            END IF;
+            IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                delta := delta - (SELECT COUNT(*) FROM old_rows WHERE status = 'active');
+            END IF;
+            IF delta <> 0 THEN
+                UPDATE stats_counters SET value = value + delta WHERE name = 'active_customer_packages';
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        ''',
+        *[
+            f'''
+            CREATE TRIGGER stats_{table}_{event.lower()} AFTER {event} ON {table}
+            REFERENCING {'OLD' if event == 'DELETE' else 'NEW'} TABLE AS {'old_rows' if event == 'DELETE' else 'new_rows'}
+            FOR EACH STATEMENT EXECUTE FUNCTION stats_count_rows()
+            '''
+            for table in ("customers", "packages", "appointments")
+            for event in ("INSERT", "DELETE")
+        ],
+        '''
+        CREATE TRIGGER stats_appointment_days_insert AFTER INSERT ON appointments
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION stats_count_appointment_days()
+        ''',
+        '''
+        CREATE TRIGGER stats_appointment_days_update AFTER UPDATE ON appointments
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION stats_count_appointment_days()
+        ''',
+        '''
+        CREATE TRIGGER stats_appointment_days_delete AFTER DELETE ON appointments
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION stats_count_appointment_days()
+        ''',
+        '''
+        CREATE TRIGGER stats_active_packages_insert AFTER INSERT ON customer_packages
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION stats_count_active_packages()
+        ''',
+        '''
+        CREATE TRIGGER stats_active_packages_update AFTER UPDATE ON customer_packages
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION stats_count_active_packages()
+        ''',
+        '''
+        CREATE TRIGGER stats_active_packages_delete AFTER DELETE ON customer_packages
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION stats_count_active_packages()
+        ''',
+        reconcile_counters,
+    ]),
+    Migration(5, "typed appointment slots", [
+        'ALTER TABLE appointments ADD COLUMN start_time TIME, ADD COLUMN end_time TIME',
+        backfill_appointment_slots,
+        # Overlap checks per instructor and the availability scan of a day
+        'CREATE INDEX idx_appointments_date_instructor_start ON appointments (date, instructor, start_time)',
+    ]),
+    Migration(6, "indexes for filtered appointment listings", [
+        # Equality filter first, then the listing order, so a date window
+        # under any filter is one index range scan regardless of history size
+        'DROP INDEX IF EXISTS idx_appointments_customer_date',
+        'CREATE INDEX idx_appointments_customer_date ON appointments (customer_id, date DESC, time DESC, id DESC)',
+        'CREATE INDEX idx_appointments_instructor_date ON appointments (instructor, date DESC, time DESC, id DESC)',
+        'CREATE INDEX idx_appointments_status_date ON appointments (status, date DESC, time DESC, id DESC)',
+        'CREATE INDEX idx_appointments_service_date ON appointments (service_type, date DESC, time DESC, id DESC)',
+    ]),
+    Migration(7, "customer package redemption", [
+        # Last line of defence behind the conditional UPDATE used to redeem sessions
+        'ALTER TABLE customer_packages ADD CONSTRAINT customer_packages_remaining_sessions_check'
+        ' CHECK (remaining_sessions >= 0)',
+        'CREATE INDEX idx_customer_packages_redeem ON customer_packages (customer_id, package_id, status)',
+        'CREATE INDEX idx_customer_packages_created_at_id ON customer_packages (created_at DESC, id DESC)',
+    ]),
+    Migration(8, "indexes for the background sweeps", [
+        # Partial indexes stay as small as the backlog of rows a sweep still has to visit
+        "CREATE INDEX idx_customer_packages_active_expiry ON customer_packages (expiry_date) WHERE status = 'active'",
+        "CREATE INDEX idx_appointments_scheduled_date ON appointments (date) WHERE status = 'scheduled'",
+    ]),
+    Migration(9, "customer search", [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        f'''
+        ALTER TABLE customers
+            ADD COLUMN search_text TEXT GENERATED ALWAYS AS ({CUSTOMER_SEARCH_TEXT}) STORED,
+            ADD COLUMN search_vector TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', {CUSTOMER_SEARCH_TEXT})) STORED
+        ''',
+        # Word prefixes go through the tsvector, typos and substrings through trigrams
+        'CREATE INDEX idx_customers_search_vector ON customers USING GIN (search_vector)',
+        'CREATE INDEX idx_customers_search_trgm ON customers USING GIN (search_text gin_trgm_ops)',
+    ]),
+    Migration(10, "report rollups", [
+        '''
+        CREATE TABLE report_revenue_daily (
+            day DATE NOT NULL,
+            package_type VARCHAR NOT NULL,
+            payment_method VARCHAR NOT NULL,
+            amount DECIMAL NOT NULL,
+            payments BIGINT NOT NULL,
+            PRIMARY KEY (day, package_type, payment_method)
+        )
+        ''',
+        '''
+        CREATE TABLE report_attendance_daily (
+            day DATE NOT NULL,
+            instructor VARCHAR NOT NULL,
+            service_type VARCHAR NOT NULL,
+            scheduled BIGINT NOT NULL,
+            completed BIGINT NOT NULL,
+            no_show BIGINT NOT NULL,
+            cancelled BIGINT NOT NULL,
+            PRIMARY KEY (day, instructor, service_type)
+        )
+        ''',
+        '''
+        CREATE TABLE report_dirty_days (
+            kind VARCHAR NOT NULL,
+            day DATE NOT NULL,
+            PRIMARY KEY (kind, day)
+        )
+        ''',
+        *[
+            f'''
+            CREATE FUNCTION report_mark_{kind}_days() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO report_dirty_days (kind, day)
+                    SELECT DISTINCT '{kind}', {column} FROM new_rows
+                    ON CONFLICT DO NOTHING;
+                END IF;
+                IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                    INSERT INTO report_dirty_days (kind, day)
+                    SELECT DISTINCT '{kind}', {column} FROM old_rows
+                    ON CONFLICT DO NOTHING;
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            '''
+            for kind, column in (("revenue", "payment_date"), ("attendance", "date"))
+        ],
+        *[
+            f'''
+            CREATE TRIGGER report_{kind}_{event.lower()} AFTER {event} ON {table}
+            REFERENCING {transitions}
+            FOR EACH STATEMENT EXECUTE FUNCTION report_mark_{kind}_days()
+            '''
+            for kind, table in (("revenue", "payments"), ("attendance", "appointments"))
+            for event, transitions in (
+                ("INSERT", "NEW TABLE AS new_rows"),
+                ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+                ("DELETE", "OLD TABLE AS old_rows"),
+            )
+        ],
+        # Existing history is rolled up by the refresh_reports job
+        mark_all_days_dirty,
+    ]),
+    Migration(11, "keyset index for payment listings", [
+        'CREATE INDEX IF NOT EXISTS idx_payments_created_at_id ON payments (created_at DESC, id DESC)',
+    ]),
+    Migration(12, "move the remaining inline customer photos to the photo store", [clear_inline_photos]),
+]
+
+
+async def run_migrations(conn, migrations: List[Migration] = MIGRATIONS):
+    """Apply every migration newer than the recorded schema version"""
+    await conn.execute('SELECT pg_advisory_lock($1)', MIGRATION_LOCK_ID)
+    try:
+        if await conn.fetchval("SELECT to_regclass('schema_migrations')") is None:
+            await conn.execute('''
+                CREATE TABLE schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    description VARCHAR NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+        applied = {row['version'] for row in await conn.fetch('SELECT version FROM schema_migrations')}
+
+        for migration in sorted(migrations, key=lambda m: m.version):
+            if migration.version in applied:
+                continue
+            try:
+                async with conn.transaction():
+                    for step in migration.steps:
+                        if callable(step):
+                            await step(conn)
+                        else:
+                            await conn.execute(step)
+                    await conn.execute(
+                        'INSERT INTO schema_migrations (version, description) VALUES ($1, $2)',
+                        migration.version, migration.description
+                    )
+            except Exception as e:
+                raise RuntimeError(f"Migration {migration.version} ({migration.description}) failed: {e}") from e
+            print(f"Applied migration {migration.version}: {migration.description}")
+    finally:
+        await conn.execute('SELECT pg_advisory_unlock($1)', MIGRATION_LOCK_ID)
@@ -0,0 +1,149 @@
+"""Pydantic models of the API, shared by every storage backend"""
+
+import uuid
+from datetime import date, datetime, time
+from typing import List, Optional
+
+from pydantic import BaseModel, Field, field_validator
+
+from scheduling import parse_time
+
+
+class Customer(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    cpf: str
+    email: str
+    phone: str
+    address: str
+    birth_date: date
+    photo: Optional[str] = None
+    medical_notes: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class CustomerRecord(Customer):
+    """A customer as stored: the photo lives in the photo store under photo_hash"""
+    photo_hash: Optional[str] = None
+
+class CustomerCreate(BaseModel):
+    name: str
+    cpf: str
+    email: str
+    phone: str
+    address: str
+    birth_date: date
+    photo: Optional[str] = None
+    medical_notes: Optional[str] = None
+
+class Package(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    type: str
+    price: float
+    description: str
+    duration_days: Optional[int] = None
+    sessions_included: Optional[int] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class PackageCreate(BaseModel):
+    name: str
+    type: str
+    price: float
+    description: str
+    duration_days: Optional[int] = None
+    sessions_included: Optional[int] = None
+
+class CustomerPackage(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    customer_id: str
+    package_id: str
+    purchase_date: date
+    amount_paid: float
+    payment_method: str
+    status: str = "active"
+    remaining_sessions: Optional[int] = None
+    expiry_date: Optional[date] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class CustomerPackageCreate(BaseModel):
+    customer_id: str
+    package_id: str
+    purchase_date: date
+    amount_paid: float
+    payment_method: str
+    remaining_sessions: Optional[int] = None
+    expiry_date: Optional[date] = None
+
+class Appointment(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    customer_id: str
+    package_id: str
+    date: date
+    time: str
+    service_type: str
+    instructor: Optional[str] = None
+    status: str = "scheduled"
+    notes: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class AppointmentRecord(Appointment):
+    """An appointment as stored, with the slot it takes (migration 5)"""
+    start_time: Optional[time] = None
+    end_time: Optional[time] = None
+
+class AppointmentCreate(BaseModel):
+    customer_id: str
+    package_id: str
+    date: date
+    time: str
+    service_type: str
+    instructor: Optional[str] = None
+    notes: Optional[str] = None
+
+    @field_validator('time')
+    @classmethod
+    def normalize_time(cls, value: str) -> str:
+        return parse_time(value).strftime("%H:%M")
+
+    @field_validator('instructor')
+    @classmethod
+    def blank_instructor_is_none(cls, value: Optional[str]) -> Optional[str]:
+        return value.strip() or None if value else None
+
+class Payment(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    customer_package_id: str
+    amount: float
+    payment_date: date
+    payment_method: str
+    notes: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class PaymentCreate(BaseModel):
+    customer_package_id: str
+    amount: float
+    payment_date: date
+    payment_method: str
+    notes: Optional[str] = None
+
+class BatchLookup(BaseModel):
+    ids: List[str]
+
+class AppointmentDetail(Appointment):
+    customer: Optional[Customer] = None
+    package: Optional[Package] = None
+
+class CustomerPackageDetail(CustomerPackage):
+    package: Optional[Package] = None
+
+class PaymentSummary(BaseModel):
+    count: int
+    total: float
+    last_payment_date: Optional[date] = None
+
+class CustomerOverview(BaseModel):
+    customer: Customer
+    packages: List[CustomerPackageDetail]
+    upcoming_appointments: List[Appointment]
+    recent_appointments: List[Appointment]
+    payments: PaymentSummary
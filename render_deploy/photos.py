@@ -0,0 +1,127 @@
+"""Content-addressed storage for customer photos.
+
+Originals are written once under their SHA-256 digest, so re-uploading the
+same picture (or two customers sharing one) costs no extra disk. Thumbnails
+are derived lazily per size and cached next to the originals.
+"""
+
+import base64
+import binascii
+import hashlib
+import io
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; thumbnails then fall back to the original
+    Image = None
+
+PHOTO_STORAGE_DIR = os.environ.get('PHOTO_STORAGE_DIR', 'data/photos')
+MAX_PHOTO_BYTES = int(os.environ.get('MAX_PHOTO_BYTES', str(5 * 1024 * 1024)))
+
+# Bounding box (pixels) for each thumbnail size served by the photo endpoint
+THUMBNAIL_SIZES = {
+    "small": 64,
+    "medium": 256,
+    "large": 800,
+}
+
+_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+
+class InvalidPhoto(ValueError):
+    pass
+
+
+def sniff_media_type(data: bytes) -> Optional[str]:
+    """Return the image media type from the file signature, or None if unknown"""
+    for signature, media_type in _SIGNATURES:
+        if data.startswith(signature):
+            return media_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def decode_photo(value: str) -> bytes:
+    """Decode a base64 photo, with or without a ``data:image/...;base64,`` prefix"""
+    if value.startswith("data:"):
+        _, _, value = value.partition(",")
+    try:
+        return base64.b64decode(value, validate=False)
+    except (binascii.Error, ValueError) as e:
+        raise InvalidPhoto(f"Invalid base64 photo: {e}")
+
+
+class PhotoStore:
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def _path(self, digest: str, variant: str = "original") -> Path:
+        return self.root / variant / digest[:2] / digest
+
+    def _write(self, path: Path, data: bytes):
+        # Write to a temp file and rename so readers never see a partial image
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        # The inline photo migrations clear a customer's base64 copy once put() returns,
+        # so the rename must survive a crash too
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def put(self, data: bytes) -> str:
+        """Store image bytes and return their SHA-256 digest"""
+        if not data:
+            raise InvalidPhoto("Empty photo")
+        if len(data) > MAX_PHOTO_BYTES:
+            raise InvalidPhoto(f"Photo larger than {MAX_PHOTO_BYTES} bytes")
+        if sniff_media_type(data) is None:
+            raise InvalidPhoto("Unsupported image format")
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not path.exists():
+            self._write(path, data)
+        return digest
+
+    def get(self, digest: str, size: str = "original") -> Optional[Tuple[Path, str]]:
+        """Return the file and media type for ``size``, generating the thumbnail on first use"""
+        original = self._path(digest)
+        if not original.exists():
+            return None
+        if size == "original" or Image is None:
+            with open(original, "rb") as f:
+                return original, sniff_media_type(f.read(16)) or "application/octet-stream"
+
+        thumb = self._path(digest, size)
+        if not thumb.exists():
+            self._write(thumb, self._thumbnail(original.read_bytes(), THUMBNAIL_SIZES[size]))
+        return thumb, "image/jpeg"
+
+    def _thumbnail(self, data: bytes, bound: int) -> bytes:
+        with Image.open(io.BytesIO(data)) as img:
+            img = img.convert("RGB")
+            img.thumbnail((bound, bound))
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=85, optimize=True)
+            return out.getvalue()
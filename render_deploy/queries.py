@@ -0,0 +1,260 @@
+"""Named SQL statements of the request path, prepared once per pooled connection.
+
+Each statement is declared here once with ``statement()``. The pool's
+``init`` callback parses all of them into the statement cache of every
+new connection (``prepare_statements``), so requests only bind and
+execute. Run them with ``fetch``/``fetchrow``/``fetchval``/``execute`` from
+this module: each call is timed in metrics.py under the statement's name,
+and rows come back as the statement's Pydantic model when it declares one.
+
+``check_statements`` prepares every statement against the live schema;
+``PostgresStorage.migrate`` runs it after the migrations, so a statement a
+schema change broke stops the deploy instead of failing its first request.
+
+SQL whose text depends on the request (projected columns, filters, report
+buckets) stays inline where it is built; asyncpg's per-connection statement
+cache (DB_STATEMENT_CACHE_SIZE) keeps the common variants prepared.
+"""
+
+from typing import Dict, List, NamedTuple, Optional, Type
+
+import asyncpg
+from pydantic import BaseModel
+
+from models import AppointmentRecord, CustomerPackage, CustomerRecord, Package, Payment
+from storage import APPOINTMENTS, CUSTOMER_PACKAGES, CUSTOMERS, PACKAGES, PAYMENTS
+
+
+class Statement(NamedTuple):
+    name: str
+    sql: str
+    # Rows are returned as this model instead of asyncpg Records
+    model: Optional[Type[BaseModel]] = None
+
+
+STATEMENTS: Dict[str, Statement] = {}
+
+
+def statement(name: str, sql: str, model: Optional[Type[BaseModel]] = None) -> Statement:
+    if name in STATEMENTS:
+        raise ValueError(f"Statement {name!r} is already declared")
+    STATEMENTS[name] = Statement(name, sql, model)
+    return STATEMENTS[name]
+
+# ===============================
+# STATEMENTS
+# ===============================
+
+TABLES = (CUSTOMERS, PACKAGES, CUSTOMER_PACKAGES, APPOINTMENTS, PAYMENTS)
+
+# Customers are read without the generated search_text/search_vector
+# columns (migration 9), which only the search route needs, and without the
+# inline base64 photo, which only CUSTOMER_INLINE_PHOTO reads
+CUSTOMER_COLUMNS = (
+    "id", "name", "cpf", "email", "phone", "address", "birth_date", "photo_hash", "medical_notes", "created_at",
+)
+# What rows are read with, per table; also used by the SQL built in storage_postgres.py
+COLUMNS = {entity.name: "*" for entity in TABLES}
+COLUMNS[CUSTOMERS.name] = ", ".join(CUSTOMER_COLUMNS)
+
+# What the lookups by primary key return rows as, per table. Columns the
+# statement does not read (the customer's inline photo) stay unset, so
+# model_dump(exclude_unset=True) gives back just what was read
+MODELS = {
+    CUSTOMERS.name: CustomerRecord, PACKAGES.name: Package, CUSTOMER_PACKAGES.name: CustomerPackage,
+    APPOINTMENTS.name: AppointmentRecord, PAYMENTS.name: Payment,
+}
+
+# Lookups by primary key, per table
+BY_ID = {
+    entity.name: statement(
+        f"{entity.name}_by_id", f"SELECT {COLUMNS[entity.name]} FROM {entity.name} WHERE id = $1", MODELS[entity.name]
+    )
+    for entity in TABLES
+}
+BY_IDS = {
+    entity.name: statement(
+        f"{entity.name}_by_ids", f"SELECT {COLUMNS[entity.name]} FROM {entity.name} WHERE id = ANY($1::varchar[])",
+        MODELS[entity.name],
+    )
+    for entity in TABLES
+}
+DELETE_BY_ID = {
+    entity.name: statement(f"{entity.name}_delete", f"DELETE FROM {entity.name} WHERE id = $1")
+    for entity in TABLES
+}
+
+# Photo the route falls back to when a customer's file is missing from the photo store
+CUSTOMER_INLINE_PHOTO = statement("customer_inline_photo", 'SELECT photo FROM customers WHERE id = $1')
+
+MARK_PACKAGE_REVENUE_DIRTY = statement("mark_package_revenue_dirty", '''
+    INSERT INTO report_dirty_days (kind, day)
+    SELECT DISTINCT 'revenue', pay.payment_date
+    FROM payments pay JOIN customer_packages cp ON cp.id = pay.customer_package_id
+    WHERE cp.package_id = $1
+    ON CONFLICT DO NOTHING
+''')
+
+LOCK_SCHEDULE_KEY = statement("lock_schedule_key", 'SELECT pg_advisory_xact_lock(hashtextextended($1, 0))')
+# unnest keeps the order of the array, which callers sort like lock_schedule does
+LOCK_SCHEDULE_KEYS = statement(
+    "lock_schedule_keys", 'SELECT pg_advisory_xact_lock(hashtextextended(key, 0)) FROM unnest($1::text[]) AS key'
+)
+
+OVERLAPPING_APPOINTMENTS = statement("overlapping_appointments", '''
+    SELECT customer_id, instructor, service_type FROM appointments
+    WHERE date = $1 AND status <> 'cancelled'
+      AND start_time < $3 AND end_time > $2
+      AND (customer_id = $4 OR instructor IS NOT DISTINCT FROM $5)
+      AND id <> $6
+''')
+
+# OFFSET 0 keeps the subquery apart, so each booking is looked up through the
+# date index like a single booking is, instead of a hash join over the whole table
+OVERLAPPING_APPOINTMENTS_OF_BATCH = statement("overlapping_appointments_of_batch", '''
+    SELECT b.n, a.customer_id, a.instructor, a.service_type
+    FROM unnest($1::date[], $2::time[], $3::time[], $4::varchar[], $5::varchar[]) WITH ORDINALITY
+         AS b(date, start_time, end_time, customer_id, instructor, n)
+    CROSS JOIN LATERAL (
+        SELECT customer_id, instructor, service_type FROM appointments
+        WHERE date = b.date AND status <> 'cancelled'
+          AND start_time < b.end_time AND end_time > b.start_time
+          AND (customer_id = b.customer_id OR instructor IS NOT DISTINCT FROM b.instructor)
+        OFFSET 0
+    ) AS a
+''')
+
+NOTIFY = statement("notify", 'SELECT pg_notify($1, $2)')
+
+DASHBOARD_STATS = statement("dashboard_stats", '''
+    SELECT
+        (SELECT value FROM stats_counters WHERE name = 'customers') AS total_customers,
+        (SELECT value FROM stats_counters WHERE name = 'packages') AS total_packages,
+        (SELECT value FROM stats_counters WHERE name = 'appointments') AS total_appointments,
+        (SELECT value FROM stats_counters WHERE name = 'active_customer_packages') AS active_customer_packages,
+        COALESCE((SELECT value FROM stats_daily_counters
+                  WHERE name = 'appointments' AND day = $1), 0) AS today_appointments,
+        (SELECT COALESCE(json_agg(p), '[]'::json)
+           FROM (SELECT * FROM payments ORDER BY payment_date DESC LIMIT 5) p) AS recent_payments
+''')
+
+CUSTOMER_OVERVIEW = statement("customer_overview", f'''
+    SELECT {", ".join(f"c.{column}" for column in CUSTOMER_COLUMNS)},
+        (SELECT COALESCE(jsonb_agg(to_jsonb(cp) || jsonb_build_object('package', to_jsonb(p))
+                                   ORDER BY cp.created_at DESC), '[]'::jsonb)
+           FROM customer_packages cp LEFT JOIN packages p ON p.id = cp.package_id
+          WHERE cp.customer_id = c.id) AS packages,
+        (SELECT COALESCE(jsonb_agg(to_jsonb(a) ORDER BY a.date, a.time), '[]'::jsonb)
+           FROM (SELECT * FROM appointments WHERE customer_id = c.id AND date >= $2
+                 ORDER BY date, time LIMIT $3) a) AS upcoming_appointments,
+        (SELECT COALESCE(jsonb_agg(to_jsonb(a) ORDER BY a.date DESC, a.time DESC), '[]'::jsonb)
+           FROM (SELECT * FROM appointments WHERE customer_id = c.id AND date < $2
+                 ORDER BY date DESC, time DESC LIMIT $3) a) AS recent_appointments,
+        (SELECT jsonb_build_object('count', COUNT(*), 'total', COALESCE(SUM(pay.amount), 0),
+                                   'last_payment_date', MAX(pay.payment_date))
+           FROM payments pay JOIN customer_packages cp ON cp.id = pay.customer_package_id
+          WHERE cp.customer_id = c.id) AS payments
+    FROM customers c
+    WHERE c.id = $1
+''')
+
+APPOINTMENT_FOR_CHECK_IN = statement(
+    "appointment_for_check_in",
+    'SELECT customer_id, package_id, date, status FROM appointments WHERE id = $1 FOR UPDATE',
+)
+
+# Soonest-expiring active package still valid on the appointment date ($3)
+# first; packages without a session count (remaining_sessions NULL) are
+# unlimited. The customer's other active packages of this kind already past
+# their expiry date are flipped to expired by the same UPDATE, so check-in
+# does not have to wait for the expiry sweep in jobs.py. Only the package
+# the session was taken from is returned.
+USE_PACKAGE_SESSION = statement("use_package_session", '''
+    WITH candidates AS (
+        SELECT id, expiry_date, purchase_date, remaining_sessions FROM customer_packages
+        WHERE customer_id = $1 AND package_id = $2 AND status = 'active'
+        FOR UPDATE
+    ), chosen AS (
+        SELECT id FROM candidates
+        WHERE (remaining_sessions IS NULL OR remaining_sessions > 0)
+          AND (expiry_date IS NULL OR expiry_date >= $3)
+        ORDER BY expiry_date NULLS LAST, purchase_date, id
+        LIMIT 1
+    ), updated AS (
+        UPDATE customer_packages cp SET
+            remaining_sessions = CASE WHEN cp.id IN (SELECT id FROM chosen)
+                                      THEN cp.remaining_sessions - 1 ELSE cp.remaining_sessions END,
+            status = CASE WHEN cp.id NOT IN (SELECT id FROM chosen) THEN 'expired'
+                          WHEN cp.remaining_sessions <= 1 THEN 'exhausted'
+                          ELSE cp.status END
+        FROM candidates c
+        WHERE cp.id = c.id AND cp.status = 'active'
+          AND (cp.id IN (SELECT id FROM chosen) OR c.expiry_date < CURRENT_DATE)
+        RETURNING cp.*
+    )
+    SELECT * FROM updated WHERE id IN (SELECT id FROM chosen)
+''', CustomerPackage)
+
+COMPLETE_APPOINTMENT = statement(
+    "complete_appointment", "UPDATE appointments SET status = 'completed' WHERE id = $1"
+)
+
+DAY_SCHEDULE = statement("day_schedule", '''
+    SELECT customer_id, instructor, service_type, start_time, end_time FROM appointments
+    WHERE date = $1 AND status <> 'cancelled' AND start_time IS NOT NULL
+''')
+
+PENDING_REPORT_DAYS = statement(
+    "pending_report_days", 'SELECT COUNT(*) FROM report_dirty_days WHERE kind = $1 AND day BETWEEN $2 AND $3'
+)
+
+# ===============================
+# RUNNING STATEMENTS
+# ===============================
+
+async def prepare_statements(conn):
+    """Parse every declared statement into the statement cache of a new pooled connection"""
+    for declared in STATEMENTS.values():
+        await conn.prepare_cached(declared.sql)
+
+
+async def check_statements(conn):
+    """Prepare every statement against the current schema; raises listing each one that does not fit"""
+    broken = []
+    for declared in STATEMENTS.values():
+        try:
+            prepared = await conn.prepare(declared.sql)
+        except asyncpg.PostgresError as e:
+            broken.append(f"{declared.name}: {e}")
+            continue
+        if declared.model is not None:
+            columns = {attribute.name for attribute in prepared.get_attributes()}
+            fields = declared.model.model_fields
+            missing = [name for name, field in fields.items() if field.is_required() and name not in columns]
+            if missing:
+                broken.append(f"{declared.name}: no column for {declared.model.__name__}.{', '.join(missing)}")
+    if broken:
+        raise RuntimeError("Statements do not match the schema:\n" + "\n".join(broken))
+
+
+async def fetch(conn, declared: Statement, *args) -> List:
+    rows = await conn.fetch(declared.sql, *args, label=declared.name)
+    if declared.model is not None:
+        return [declared.model(**row) for row in rows]
+    return rows
+
+
+async def fetchrow(conn, declared: Statement, *args):
+    row = await conn.fetchrow(declared.sql, *args, label=declared.name)
+    if row is not None and declared.model is not None:
+        return declared.model(**row)
+    return row
+
+
+async def fetchval(conn, declared: Statement, *args):
+    return await conn.fetchval(declared.sql, *args, label=declared.name)
+
+
+async def execute(conn, declared: Statement, *args) -> str:
+    """Run a statement for its effect; returns the command status, e.g. ``UPDATE 1``"""
+    return await conn.execute(declared.sql, *args, label=declared.name)
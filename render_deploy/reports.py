@@ -0,0 +1,116 @@
+"""Revenue and attendance reports answered from daily rollup tables.
+
+Triggers installed by migration 10 record every day whose payments or
+appointments changed in ``report_dirty_days``; the ``refresh_reports`` job
+recomputes just those days into ``report_revenue_daily`` and
+``report_attendance_daily``. Report queries only ever read the rollups, so
+a year-long range costs a few hundred rows instead of a scan of the raw
+tables.
+"""
+
+from datetime import date
+from typing import List, Optional
+
+import queries
+
+# Bucket sizes accepted by the report endpoints, as date_trunc units
+GRANULARITIES = ("day", "week", "month", "year")
+REVENUE_GROUPS = ("package_type", "payment_method")
+
+# Rollup key for appointments without an instructor
+NO_INSTRUCTOR = ""
+
+
+async def refresh_rollups(conn, batch_size: int) -> int:
+    """Recompute up to ``batch_size`` dirty days; returns how many were refreshed"""
+    async with conn.transaction():
+        dirty = await conn.fetch('''
+            DELETE FROM report_dirty_days
+            WHERE (kind, day) IN (
+                SELECT kind, day FROM report_dirty_days
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING kind, day
+        ''', batch_size)
+        revenue_days = [row['day'] for row in dirty if row['kind'] == 'revenue']
+        attendance_days = [row['day'] for row in dirty if row['kind'] == 'attendance']
+
+        if revenue_days:
+            await conn.execute('DELETE FROM report_revenue_daily WHERE day = ANY($1)', revenue_days)
+            await conn.execute('''
+                INSERT INTO report_revenue_daily (day, package_type, payment_method, amount, payments)
+                SELECT pay.payment_date, COALESCE(p.type, 'unknown'), pay.payment_method, SUM(pay.amount), COUNT(*)
+                FROM payments pay
+                LEFT JOIN customer_packages cp ON cp.id = pay.customer_package_id
+                LEFT JOIN packages p ON p.id = cp.package_id
+                WHERE pay.payment_date = ANY($1)
+                GROUP BY 1, 2, 3
+            ''', revenue_days)
+
+        if attendance_days:
+            await conn.execute('DELETE FROM report_attendance_daily WHERE day = ANY($1)', attendance_days)
+            await conn.execute('''
+                INSERT INTO report_attendance_daily
+                    (day, instructor, service_type, scheduled, completed, no_show, cancelled)
+                SELECT date, COALESCE(instructor, $2), service_type,
+                       COUNT(*) FILTER (WHERE status = 'scheduled'),
+                       COUNT(*) FILTER (WHERE status = 'completed'),
+                       COUNT(*) FILTER (WHERE status = 'no_show'),
+                       COUNT(*) FILTER (WHERE status = 'cancelled')
+                FROM appointments
+                WHERE date = ANY($1)
+                GROUP BY 1, 2, 3
+            ''', attendance_days, NO_INSTRUCTOR)
+    return len(dirty)
+
+
+async def mark_all_days_dirty(conn):
+    """Queue every day with payments or appointments for a refresh, e.g. after a package type was changed"""
+    await conn.execute('''
+        INSERT INTO report_dirty_days (kind, day)
+        SELECT DISTINCT 'revenue', payment_date FROM payments
+        UNION
+        SELECT DISTINCT 'attendance', date FROM appointments
+        ON CONFLICT DO NOTHING
+    ''')
+
+
+async def pending_days(conn, kind: str, start: date, end: date) -> int:
+    """Days in the range whose rollups are not refreshed yet"""
+    return await queries.fetchval(conn, queries.PENDING_REPORT_DAYS, kind, start, end)
+
+
+async def revenue_report(conn, start: date, end: date, granularity: str, group_by: List[str]) -> List[dict]:
+    # granularity and group_by are checked against GRANULARITIES / REVENUE_GROUPS by the caller
+    keys = "".join(f", {column}" for column in group_by)
+    rows = await conn.fetch(f'''
+        SELECT date_trunc('{granularity}', day)::date AS period{keys},
+               SUM(amount) AS amount, SUM(payments) AS payments
+        FROM report_revenue_daily
+        WHERE day BETWEEN $1 AND $2
+        GROUP BY period{keys}
+        ORDER BY period{keys}
+    ''', start, end, label="reports.revenue")
+    return [dict(row) for row in rows]
+
+
+async def attendance_report(conn, start: date, end: date, granularity: str,
+                            instructor: Optional[str] = None) -> List[dict]:
+    rows = await conn.fetch(f'''
+        SELECT date_trunc('{granularity}', day)::date AS period, NULLIF(instructor, $3) AS instructor,
+               SUM(scheduled) AS scheduled, SUM(completed) AS completed,
+               SUM(no_show) AS no_show, SUM(cancelled) AS cancelled
+        FROM report_attendance_daily
+        WHERE day BETWEEN $1 AND $2 AND ($4::varchar IS NULL OR instructor = $4)
+        GROUP BY period, instructor
+        ORDER BY period, instructor
+    ''', start, end, NO_INSTRUCTOR, instructor, label="reports.attendance")
+    report = []
+    for row in rows:
+        item = dict(row)
+        attended = item['completed'] + item['no_show']
+        # Share of past sessions the customer actually showed up for
+        item['attendance_rate'] = round(item['completed'] / attended, 3) if attended else None
+        report.append(item)
+    return report
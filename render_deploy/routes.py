@@ -0,0 +1,818 @@
+"""CRUD routes shared by the Postgres and Mongo apps.
+
+Every route here reaches the database through the ``Storage`` an app puts
+in ``app.state.storage`` (see storage.py), so both apps serve the same
+customers, packages, customer packages, appointments, payments, dashboard,
+search, overviews, check-ins, imports and exports. Routes that only one
+database can answer (reports, availability, pool and job stats...) stay in
+that app's server.py.
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from bulk import BULK_CHUNK_SIZE, BulkResult, bulk_format, iter_records, validate_record
+from cache import MISSING, LRUCache, TTLCache
+from events import EventBus, change_event
+from http_cache import etag_matches
+from models import (
+    Appointment, AppointmentCreate, AppointmentDetail, BatchLookup, Customer, CustomerCreate, CustomerOverview,
+    CustomerPackage, CustomerPackageCreate, Package, PackageCreate, Payment, PaymentCreate,
+)
+from photos import MAX_PHOTO_BYTES, PHOTO_STORAGE_DIR, THUMBNAIL_SIZES, InvalidPhoto, PhotoStore, decode_photo
+from scheduling import end_time_for, parse_time
+from storage import APPOINTMENTS, EXPORT_BATCH_SIZE, Conflict, Entity, Repository, Storage
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; FAST_JSON is ignored without it
+    orjson = None
+
+# Opt-in fast path: list rows go straight from the driver to orjson bytes,
+# skipping per-row model validation and jsonable_encoder
+FAST_JSON = os.environ.get('FAST_JSON', 'false').lower() in ('1', 'true', 'yes') and orjson is not None
+
+# List endpoints return at most this many rows per page
+DEFAULT_PAGE_LIMIT = int(os.environ.get('DEFAULT_PAGE_LIMIT', '1000'))
+MAX_PAGE_LIMIT = int(os.environ.get('MAX_PAGE_LIMIT', '1000'))
+
+# Ids a /batch lookup may ask for at once
+BATCH_MAX_IDS = int(os.environ.get('BATCH_MAX_IDS', '1000'))
+
+# Customer search: results per request, and what a result contains unless ?fields= says otherwise
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SEARCH_DEFAULT_FIELDS = ["id", "name", "cpf", "email", "phone", "photo"]
+
+# Seconds a customer overview is reused; every write touching the customer drops it sooner
+OVERVIEW_CACHE_TTL = float(os.environ.get('OVERVIEW_CACHE_TTL', '10'))
+# Overviews kept per worker; the least recently read are dropped first
+OVERVIEW_CACHE_SIZE = int(os.environ.get('OVERVIEW_CACHE_SIZE', '1000'))
+# Upcoming and recent appointments listed in a customer overview
+OVERVIEW_APPOINTMENTS = 10
+
+# Seconds a computed /api/dashboard/stats result is reused
+DASHBOARD_CACHE_TTL = float(os.environ.get('DASHBOARD_CACHE_TTL', '30'))
+
+# Customers and packages read by id: seconds an entry is reused, and entries kept per worker
+ENTITY_CACHE_TTL = float(os.environ.get('ENTITY_CACHE_TTL', '60'))
+ENTITY_CACHE_SIZE = int(os.environ.get('ENTITY_CACHE_SIZE', '10000'))
+# Tell the other workers about every write over LISTEN/NOTIFY, so their caches drop the
+# entry without waiting for the TTL and their /api/events clients hear about it
+NOTIFY_CHANGES = os.environ.get('NOTIFY_CHANGES', 'false').lower() in ('1', 'true', 'yes')
+
+# Customer photos live on disk, keyed by content hash
+photo_store = PhotoStore(PHOTO_STORAGE_DIR)
+
+dashboard_cache = TTLCache(DASHBOARD_CACHE_TTL)
+customer_cache = LRUCache(ENTITY_CACHE_TTL, ENTITY_CACHE_SIZE)
+package_cache = LRUCache(ENTITY_CACHE_TTL, ENTITY_CACHE_SIZE)
+overview_cache = LRUCache(OVERVIEW_CACHE_TTL, OVERVIEW_CACHE_SIZE)
+
+# Table -> cache of its rows by id
+ENTITY_CACHES = {
+    "customers": customer_cache,
+    "packages": package_cache,
+}
+
+# Tells this worker's own notifications apart from the other workers'
+WORKER_ID = uuid.uuid4().hex
+
+# Tables whose writes are published on /api/events
+EVENT_TABLES = ("customers", "packages", "customer_packages", "appointments", "payments")
+
+event_bus = EventBus(WORKER_ID[:12])
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api")
+
+
+def get_storage(request: Request) -> Storage:
+    return request.app.state.storage
+
+
+def forget(table: str, id: Optional[str]):
+    """Drop one cached row, or the whole table's cache when the id is unknown"""
+    cache = ENTITY_CACHES[table]
+    if id:
+        cache.invalidate(id)
+    else:
+        cache.invalidate()
+
+
+async def changed(storage: Storage, table: str, action: str, id: Optional[str] = None, data=None,
+                  previous: Optional[dict] = None, **keys):
+    """Drop what a write made stale and publish it to /api/events.
+
+    ``id`` is the row written and ``data`` that row as the route returns it;
+    writes of many rows leave both out. The app's own caches are dropped
+    through ``on_change(table, **keys)``, here and, with NOTIFY_CHANGES, in
+    the other workers. When the write moved the row, ``previous`` holds the
+    keys it had before (another customer, another day), stale as well.
+    """
+    event = change_event(table, action, id, data)
+    apply_change(storage, event, keys, previous)
+    if NOTIFY_CHANGES:
+        message = {"origin": WORKER_ID, "event": event, "keys": jsonable_encoder(keys)}
+        if previous:
+            message["previous"] = jsonable_encoder(previous)
+        try:
+            await storage.notify(json.dumps(message))
+        except Exception as e:
+            # The write is committed; the other workers catch up when their caches expire
+            logger.warning("Could not notify the other workers of a %s change: %s", table, e)
+
+
+def apply_change(storage: Storage, event: dict, keys: dict, previous: Optional[dict] = None):
+    """What every worker does about a change, wherever it was made"""
+    dashboard_cache.invalidate()
+    if event["table"] in ENTITY_CACHES:
+        forget(event["table"], event["id"])
+    for stale in (keys, previous) if previous else (keys,):
+        # Overviews embed packages, appointments and payment totals, for any number of customers
+        if stale.get("customer_id"):
+            overview_cache.invalidate(stale["customer_id"])
+        else:
+            overview_cache.invalidate()
+        if storage.on_change:
+            storage.on_change(event["table"], **stale)
+    event_bus.publish(event)
+
+
+def decode_keys(keys: dict) -> dict:
+    if keys.get("day"):
+        # Dates travel as ISO strings; the app's caches are keyed by date
+        keys["day"] = date.fromisoformat(keys["day"])
+    return keys
+
+
+def change_received(storage: Storage, payload: str):
+    try:
+        message = json.loads(payload)
+        if message["origin"] != WORKER_ID:
+            previous = message.get("previous")
+            apply_change(
+                storage, message["event"], decode_keys(message["keys"]), decode_keys(previous) if previous else None
+            )
+    except (ValueError, KeyError, TypeError, AttributeError):
+        logger.warning("Ignoring malformed change notification %r", payload)
+
+
+def changes_missed(storage: Storage):
+    """Other workers' changes may have been lost: treat every table as changed"""
+    dashboard_cache.invalidate()
+    overview_cache.invalidate()
+    for table in EVENT_TABLES:
+        if table in ENTITY_CACHES:
+            forget(table, None)
+        if storage.on_change:
+            storage.on_change(table)
+    event_bus.reset()
+
+
+async def cached_customer(storage: Storage, customer_id: str) -> Optional[dict]:
+    return await customer_cache.get_or_load(customer_id, lambda: storage.customers.get(customer_id))
+
+
+async def cached_package(storage: Storage, package_id: str) -> Optional[dict]:
+    return await package_cache.get_or_load(package_id, lambda: storage.packages.get(package_id))
+
+
+async def cached_batch(cache: LRUCache, repository, ids: List[str]) -> List[dict]:
+    """Rows of ``ids`` in request order, cached ones from the cache and the rest in one query"""
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > BATCH_MAX_IDS:
+        raise HTTPException(status_code=422, detail=f"At most {BATCH_MAX_IDS} ids per batch")
+    rows = {}
+    for id in ids:
+        row = cache.get(id)
+        if row is not MISSING:
+            rows[id] = row
+    missing = [id for id in ids if id not in rows]
+    if missing:
+        generation = cache.generation
+        for row in await repository.get_many(missing):
+            cache.set(row['id'], row, generation)
+            rows[row['id']] = row
+    return [rows[id] for id in ids if id in rows]
+
+
+async def listen_for_changes(storage: Storage):
+    """Start receiving the other workers' changes; a no-op unless NOTIFY_CHANGES is set"""
+    if NOTIFY_CHANGES:
+        await storage.listen(lambda payload: change_received(storage, payload), lambda: changes_missed(storage))
+
+# ===============================
+# RESPONSES
+# ===============================
+
+def parse_fields(fields: Optional[str], model) -> Optional[List[str]]:
+    """Validate a comma separated ``fields=`` projection against the model"""
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in model.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+def json_default(value):
+    # DECIMAL columns; the models expose them as floats
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def page_response(items: list, next_cursor: Optional[str]) -> Response:
+    """List body stays a plain array; the cursor for the next page travels in X-Next-Cursor"""
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    if FAST_JSON:
+        return Response(orjson.dumps(items, default=json_default), media_type="application/json", headers=headers)
+    return JSONResponse(content=jsonable_encoder(items), headers=headers)
+
+def parse_expand(expand: Optional[str], entity: Entity) -> List[str]:
+    """Validate a comma separated ``expand=`` list against the relations of the entity"""
+    if not expand:
+        return []
+    requested = list(dict.fromkeys(name.strip() for name in expand.split(",") if name.strip()))
+    unknown = [name for name in requested if name not in entity.relations]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot expand: {', '.join(unknown)}")
+    return requested
+
+def project(data: dict, model, fields: Optional[List[str]]):
+    """Full model for a plain listing, or just the requested keys for a projection"""
+    if fields is None:
+        if FAST_JSON:
+            # Rows come from our own schema, so they are trusted as-is instead of re-validated
+            return {field: data.get(field) for field in model.model_fields}
+        return model(**data)
+    return {field: data.get(field) for field in fields}
+
+# ===============================
+# CUSTOMER ROUTES
+# ===============================
+
+def photo_url(customer_id: str, photo_hash: Optional[str]) -> Optional[str]:
+    if not photo_hash:
+        return None
+    return f"/api/customers/{customer_id}/photo?v={photo_hash[:16]}"
+
+def customer_data(row) -> dict:
+    """Stored customer as a dict, with the stored photo replaced by its URL"""
+    data = dict(row)
+    data['photo'] = photo_url(data['id'], data.pop('photo_hash', None))
+    return data
+
+def customer_from_row(row) -> Customer:
+    return Customer(**customer_data(row))
+
+def is_photo_url(value: Optional[str]) -> bool:
+    # Clients echo the photo URL back unchanged when editing other fields
+    return bool(value) and value.startswith("/api/customers/")
+
+async def store_photo(value: Optional[str]) -> Optional[str]:
+    """Store a base64/data URL photo from a JSON payload and return its hash"""
+    if not value:
+        return None
+    try:
+        return await run_in_threadpool(photo_store.put, decode_photo(value))
+    except InvalidPhoto as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@router.post("/customers", response_model=Customer)
+async def create_customer(customer: CustomerCreate, storage: Storage = Depends(get_storage)):
+    data = customer.dict()
+    data['photo_hash'] = await store_photo(data.pop('photo'))
+    data['id'] = str(uuid.uuid4())
+    try:
+        row = await storage.customers.insert(data)
+    except Conflict:
+        raise HTTPException(status_code=409, detail="A customer with this CPF already exists")
+    created = customer_from_row(row)
+    await changed(storage, "customers", "created", row['id'], created, customer_id=row['id'])
+    return created
+
+@router.get("/customers", response_model=List[Customer])
+async def get_customers(
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    storage: Storage = Depends(get_storage),
+):
+    projection = parse_fields(fields, Customer)
+    rows, next_cursor = await storage.customers.page(limit, cursor, projection)
+    return page_response([project(customer_data(row), Customer, projection) for row in rows], next_cursor)
+
+@router.post("/customers/batch", response_model=List[Customer])
+async def get_customers_batch(lookup: BatchLookup, fields: Optional[str] = None, storage: Storage = Depends(get_storage)):
+    """Customers with the given ids in request order; unknown ids are left out"""
+    projection = parse_fields(fields, Customer)
+    rows = await cached_batch(customer_cache, storage.customers, lookup.ids)
+    return page_response([project(customer_data(row), Customer, projection) for row in rows], None)
+
+# Registered before /customers/{customer_id} so "search" is not taken for an id
+@router.get("/customers/search")
+async def search_customers(
+    q: str = Query(..., min_length=2),
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+    fields: Optional[str] = None,
+    storage: Storage = Depends(get_storage),
+):
+    """Customers whose name, email, CPF or phone match ``q``, best matches first"""
+    projection = parse_fields(fields, Customer) or SEARCH_DEFAULT_FIELDS
+    rows = await storage.search_customers(q, projection, limit)
+    return [project(customer_data(row), Customer, projection) for row in rows]
+
+@router.get("/customers/{customer_id}", response_model=Customer)
+async def get_customer(customer_id: str, storage: Storage = Depends(get_storage)):
+    row = await cached_customer(storage, customer_id)
+    if not row:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    return customer_from_row(row)
+
+@router.get("/customers/{customer_id}/overview", response_model=CustomerOverview)
+async def get_customer_overview(customer_id: str, storage: Storage = Depends(get_storage)):
+    """Profile, packages, appointments and payment totals of one customer"""
+    overview = overview_cache.get(customer_id)
+    if overview is MISSING:
+        generation = overview_cache.generation
+        data = await storage.customer_overview(customer_id, date.today(), OVERVIEW_APPOINTMENTS)
+        if data is None:
+            raise HTTPException(status_code=404, detail="Customer not found")
+        overview = CustomerOverview(**dict(data, customer=customer_from_row(data['customer'])))
+        overview_cache.set(customer_id, overview, generation)
+    return overview
+
+@router.put("/customers/{customer_id}", response_model=Customer)
+async def update_customer(customer_id: str, customer: CustomerCreate, storage: Storage = Depends(get_storage)):
+    data = customer.dict()
+    photo = data.pop('photo')
+    if not is_photo_url(photo):
+        data['photo_hash'] = await store_photo(photo)
+        data['photo'] = None
+    try:
+        row = await storage.customers.update(customer_id, data)
+    except Conflict:
+        raise HTTPException(status_code=409, detail="A customer with this CPF already exists")
+    if not row:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    updated = customer_from_row(row)
+    await changed(storage, "customers", "updated", customer_id, updated, customer_id=customer_id)
+    return updated
+
+@router.delete("/customers/{customer_id}")
+async def delete_customer(customer_id: str, storage: Storage = Depends(get_storage)):
+    if not await storage.customers.delete(customer_id):
+        raise HTTPException(status_code=404, detail="Customer not found")
+    await changed(storage, "customers", "deleted", customer_id, customer_id=customer_id)
+    return {"message": "Customer deleted successfully"}
+
+@router.post("/customers/{customer_id}/photo", response_model=Customer)
+async def upload_customer_photo(customer_id: str, file: UploadFile = File(...), storage: Storage = Depends(get_storage)):
+    data = await file.read(MAX_PHOTO_BYTES + 1)
+    try:
+        photo_hash = await run_in_threadpool(photo_store.put, data)
+    except InvalidPhoto as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    row = await storage.customers.update(customer_id, {"photo_hash": photo_hash, "photo": None})
+    if not row:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    updated = customer_from_row(row)
+    await changed(storage, "customers", "updated", customer_id, updated, customer_id=customer_id)
+    return updated
+
+@router.get("/customers/{customer_id}/photo")
+async def get_customer_photo(
+    customer_id: str,
+    request: Request,
+    size: str = Query("original"),
+    v: Optional[str] = None,
+    storage: Storage = Depends(get_storage),
+):
+    if size != "original" and size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=422, detail=f"size must be one of: original, {', '.join(THUMBNAIL_SIZES)}")
+    row = await cached_customer(storage, customer_id)
+    photo_hash = row.get('photo_hash') if row else None
+    if not photo_hash:
+        raise HTTPException(status_code=404, detail="Photo not found")
+
+    etag = f'"{photo_hash[:32]}-{size}"'
+    if v and photo_hash.startswith(v):
+        # Versioned URLs change whenever the photo does, so they never go stale
+        cache_control = "private, max-age=31536000, immutable"
+    else:
+        cache_control = "private, no-cache"
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    found = await run_in_threadpool(photo_store.get, photo_hash, size)
+    if found is None:
+        # A row whose inline photo was not cleared yet (see migrations.py) can write a lost file back
+        inline = await storage.inline_photo(customer_id)
+        if inline and not is_photo_url(inline):
+            try:
+                await run_in_threadpool(photo_store.put, decode_photo(inline))
+                found = await run_in_threadpool(photo_store.get, photo_hash, size)
+            except (InvalidPhoto, OSError) as e:
+                # Undecodable base64, or bytes Pillow cannot read for a thumbnail
+                logger.warning("Could not restore the inline photo of customer %s: %s", customer_id, e)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Photo not found")
+    path, media_type = found
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+# ===============================
+# PACKAGE ROUTES
+# ===============================
+
+@router.post("/packages", response_model=Package)
+async def create_package(package: PackageCreate, storage: Storage = Depends(get_storage)):
+    row = await storage.packages.insert(dict(package.dict(), id=str(uuid.uuid4())))
+    created = Package(**row)
+    await changed(storage, "packages", "created", row['id'], created)
+    return created
+
+@router.get("/packages", response_model=List[Package])
+async def get_packages(
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    storage: Storage = Depends(get_storage),
+):
+    projection = parse_fields(fields, Package)
+    rows, next_cursor = await storage.packages.page(limit, cursor, projection)
+    return page_response([project(row, Package, projection) for row in rows], next_cursor)
+
+@router.post("/packages/batch", response_model=List[Package])
+async def get_packages_batch(lookup: BatchLookup, fields: Optional[str] = None, storage: Storage = Depends(get_storage)):
+    """Packages with the given ids in request order; unknown ids are left out"""
+    projection = parse_fields(fields, Package)
+    rows = await cached_batch(package_cache, storage.packages, lookup.ids)
+    return page_response([project(row, Package, projection) for row in rows], None)
+
+@router.get("/packages/{package_id}", response_model=Package)
+async def get_package(package_id: str, storage: Storage = Depends(get_storage)):
+    row = await cached_package(storage, package_id)
+    if not row:
+        raise HTTPException(status_code=404, detail="Package not found")
+    return Package(**row)
+
+@router.put("/packages/{package_id}", response_model=Package)
+async def update_package(package_id: str, package: PackageCreate, storage: Storage = Depends(get_storage)):
+    row = await storage.packages.update(package_id, package.dict())
+    if not row:
+        raise HTTPException(status_code=404, detail="Package not found")
+    updated = Package(**row)
+    await changed(storage, "packages", "updated", package_id, updated)
+    return updated
+
+@router.delete("/packages/{package_id}")
+async def delete_package(package_id: str, storage: Storage = Depends(get_storage)):
+    if not await storage.packages.delete(package_id):
+        raise HTTPException(status_code=404, detail="Package not found")
+    await changed(storage, "packages", "deleted", package_id)
+    return {"message": "Package deleted successfully"}
+
+# ===============================
+# CUSTOMER PACKAGE ROUTES
+# ===============================
+
+@router.post("/customer-packages", response_model=CustomerPackage)
+async def create_customer_package(customer_package: CustomerPackageCreate, storage: Storage = Depends(get_storage)):
+    row = await storage.customer_packages.insert(dict(customer_package.dict(), id=str(uuid.uuid4())))
+    created = CustomerPackage(**row)
+    await changed(storage, "customer_packages", "created", row['id'], created, customer_id=customer_package.customer_id)
+    return created
+
+@router.get("/customer-packages", response_model=List[CustomerPackage])
+async def get_customer_packages(
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    cursor: Optional[str] = None,
+    storage: Storage = Depends(get_storage),
+):
+    rows, next_cursor = await storage.customer_packages.page(limit, cursor)
+    return page_response([project(row, CustomerPackage, None) for row in rows], next_cursor)
+
+@router.get("/customer-packages/customer/{customer_id}", response_model=List[CustomerPackage])
+async def get_packages_of_customer(customer_id: str, storage: Storage = Depends(get_storage)):
+    return [CustomerPackage(**row) for row in await storage.customer_packages.find(customer_id=customer_id)]
+
+# ===============================
+# APPOINTMENT ROUTES
+# ===============================
+
+@router.post("/appointments", response_model=Appointment)
+async def create_appointment(appointment: AppointmentCreate, storage: Storage = Depends(get_storage)):
+    try:
+        row = await storage.book_appointment(dict(appointment.dict(), id=str(uuid.uuid4())))
+    except Conflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    created = Appointment(**row)
+    await changed(
+        storage, "appointments", "created", row['id'], created, customer_id=appointment.customer_id, day=appointment.date
+    )
+    return created
+
+def appointment_detail(row: dict, fields: Optional[List[str]], expand: List[str]):
+    """Appointment with its expanded customer and package, each shaped like its own endpoint's response"""
+    if not expand:
+        return project(row, Appointment, fields)
+    data = dict(row)
+    if data.get("customer"):
+        data["customer"] = project(customer_data(data["customer"]), Customer, None)
+    if data.get("package"):
+        data["package"] = project(data["package"], Package, None)
+    return project(data, AppointmentDetail, None if fields is None else fields + expand)
+
+@router.get("/appointments", response_model=List[AppointmentDetail])
+async def get_appointments(
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    customer_id: Optional[str] = None,
+    instructor: Optional[str] = None,
+    status: Optional[str] = None,
+    service_type: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    storage: Storage = Depends(get_storage),
+):
+    """Appointments, newest first; ``expand=customer,package`` embeds those rows, joined by the same query"""
+    projection = parse_fields(fields, Appointment)
+    relations = parse_expand(expand, APPOINTMENTS)
+    # from/to are inclusive; each equality filter has a (field, date, time, id) index on Postgres
+    filters = [
+        (field, operator, value) for field, operator, value in [
+            ("date", ">=", date_from),
+            ("date", "<=", date_to),
+            ("customer_id", "=", customer_id),
+            ("instructor", "=", instructor),
+            ("status", "=", status),
+            ("service_type", "=", service_type),
+        ] if value is not None
+    ]
+    rows, next_cursor = await storage.appointments.page(limit, cursor, projection, filters, relations)
+    return page_response([appointment_detail(row, projection, relations) for row in rows], next_cursor)
+
+@router.get("/appointments/date/{day}", response_model=List[Appointment])
+async def get_appointments_of_day(day: date, storage: Storage = Depends(get_storage)):
+    """One day's agenda, earliest first"""
+    rows = await storage.appointments.find(date=day)
+    return [Appointment(**row) for row in reversed(rows)]
+
+@router.put("/appointments/{appointment_id}", response_model=Appointment)
+async def update_appointment(appointment_id: str, appointment: AppointmentCreate, storage: Storage = Depends(get_storage)):
+    """Reschedule or edit an appointment, with the same conflict checks as a new booking"""
+    # Read first: the customer and day it leaves are stale too
+    row = await storage.appointments.get(appointment_id)
+    if not row:
+        raise HTTPException(status_code=404, detail="Appointment not found")
+    before = Appointment(**row)
+    try:
+        row = await storage.book_appointment(appointment.dict(), appointment_id)
+    except Conflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not row:
+        raise HTTPException(status_code=404, detail="Appointment not found")
+    updated = Appointment(**row)
+    await changed(
+        storage, "appointments", "updated", appointment_id, updated,
+        previous={"customer_id": before.customer_id, "day": before.date},
+        customer_id=updated.customer_id, day=updated.date,
+    )
+    return updated
+
+@router.post("/appointments/{appointment_id}/redeem")
+async def redeem_appointment(appointment_id: str, storage: Storage = Depends(get_storage)):
+    """Mark an appointment attended and use one session of the customer's package"""
+    try:
+        redeemed = await storage.redeem_appointment(appointment_id)
+    except Conflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if redeemed is None:
+        raise HTTPException(status_code=404, detail="Appointment not found")
+    appointment = redeemed['appointment']
+    customer_package = CustomerPackage(**redeemed['customer_package'])
+
+    await changed(
+        storage, "customer_packages", "updated", customer_package.id, customer_package,
+        customer_id=appointment['customer_id'],
+    )
+    await changed(
+        storage, "appointments", "updated", appointment_id,
+        customer_id=appointment['customer_id'], day=appointment['date'],
+    )
+    return {
+        "appointment_id": appointment_id,
+        "status": "completed",
+        "customer_package": customer_package,
+    }
+
+# ===============================
+# PAYMENT ROUTES
+# ===============================
+
+@router.post("/payments", response_model=Payment)
+async def create_payment(payment: PaymentCreate, storage: Storage = Depends(get_storage)):
+    row = await storage.payments.insert(dict(payment.dict(), id=str(uuid.uuid4())))
+    created = Payment(**row)
+    await changed(storage, "payments", "created", row['id'], created)
+    return created
+
+@router.get("/payments", response_model=List[Payment])
+async def get_payments(
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    storage: Storage = Depends(get_storage),
+):
+    projection = parse_fields(fields, Payment)
+    rows, next_cursor = await storage.payments.page(limit, cursor, projection)
+    return page_response([project(row, Payment, projection) for row in rows], next_cursor)
+
+# ===============================
+# BULK IMPORT
+# ===============================
+
+async def insert_chunk(repository: Repository, chunk: list, result: BulkResult):
+    errors = await repository.insert_bulk([row for _, row in chunk])
+    for (line, _), error in zip(chunk, errors):
+        if error is None:
+            result.inserted += 1
+        else:
+            result.add_error(line, error)
+
+async def bulk_import(request: Request, fmt: Optional[str], model, storage: Storage, table: str, to_row) -> dict:
+    """Stream an NDJSON/CSV body into ``table``, validating with ``model`` and inserting in chunks"""
+    repository = getattr(storage, table)
+    result = BulkResult()
+    chunk = []
+    async for line, data in iter_records(request.stream(), bulk_format(request.headers.get("content-type"), fmt)):
+        item = data if isinstance(data, str) else validate_record(model, data)
+        if isinstance(item, str):
+            result.add_error(line, item)
+            continue
+        try:
+            chunk.append((line, await to_row(item)))
+        except HTTPException as e:
+            result.add_error(line, e.detail)
+            continue
+        if len(chunk) >= BULK_CHUNK_SIZE:
+            await insert_chunk(repository, chunk, result)
+            chunk = []
+    if chunk:
+        await insert_chunk(repository, chunk, result)
+
+    if result.inserted:
+        await changed(storage, table, "imported")
+    return result.as_dict()
+
+async def customer_row(customer: CustomerCreate) -> dict:
+    data = customer.dict()
+    data['photo_hash'] = await store_photo(data.pop('photo'))
+    return dict(data, id=str(uuid.uuid4()))
+
+async def package_row(package: PackageCreate) -> dict:
+    return dict(package.dict(), id=str(uuid.uuid4()), price=Decimal(str(package.price)))
+
+async def appointment_row(appointment: AppointmentCreate) -> dict:
+    # Imports load history as-is: slots are typed but not checked for conflicts
+    start = parse_time(appointment.time)
+    return dict(
+        appointment.dict(), id=str(uuid.uuid4()), start_time=start, end_time=end_time_for(start, appointment.service_type)
+    )
+
+@router.post("/customers/bulk")
+async def bulk_create_customers(request: Request, format: Optional[str] = None, storage: Storage = Depends(get_storage)):
+    """Import customers from an NDJSON or CSV body; invalid rows are reported, not fatal"""
+    return await bulk_import(request, format, CustomerCreate, storage, "customers", customer_row)
+
+@router.post("/packages/bulk")
+async def bulk_create_packages(request: Request, format: Optional[str] = None, storage: Storage = Depends(get_storage)):
+    return await bulk_import(request, format, PackageCreate, storage, "packages", package_row)
+
+@router.post("/appointments/bulk")
+async def bulk_create_appointments(request: Request, format: Optional[str] = None, storage: Storage = Depends(get_storage)):
+    return await bulk_import(request, format, AppointmentCreate, storage, "appointments", appointment_row)
+
+# ===============================
+# EXPORT
+# ===============================
+
+# Table -> (exported fields, date field used by the from/to filters)
+EXPORT_TABLES = {
+    "customers": (["id", "name", "cpf", "email", "phone", "address", "birth_date", "medical_notes", "created_at"], "created_at"),
+    "packages": (["id", "name", "type", "price", "description", "duration_days", "sessions_included", "created_at"], "created_at"),
+    "customer_packages": (["id", "customer_id", "package_id", "purchase_date", "amount_paid", "payment_method", "status",
+                           "remaining_sessions", "expiry_date", "created_at"], "purchase_date"),
+    "appointments": (["id", "customer_id", "package_id", "date", "time", "service_type", "instructor", "status", "notes",
+                      "created_at"], "date"),
+    "payments": (["id", "customer_package_id", "amount", "payment_date", "payment_method", "notes", "created_at"], "payment_date"),
+}
+
+def export_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+async def export_rows(rows, fields: List[str], fmt: str):
+    """Encode rows as they arrive, writing EXPORT_BATCH_SIZE rows per chunk to the socket"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer:
+        writer.writerow(fields)
+    rows_in_buffer = 0
+    async for row in rows:
+        if writer:
+            writer.writerow(["" if row.get(field) is None else export_value(row.get(field)) for field in fields])
+        else:
+            buffer.write(json.dumps({field: export_value(row.get(field)) for field in fields}, ensure_ascii=False))
+            buffer.write("\n")
+        rows_in_buffer += 1
+        if rows_in_buffer >= EXPORT_BATCH_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            rows_in_buffer = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+@router.get("/export/{table}")
+async def export_table(
+    table: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    storage: Storage = Depends(get_storage),
+):
+    """Stream a whole table as NDJSON or CSV, optionally limited to an inclusive date range"""
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown table, expected one of: {', '.join(EXPORT_TABLES)}")
+    fields, date_field = EXPORT_TABLES[table]
+    rows = getattr(storage, table).export(fields, date_field, date_from, date_to)
+
+    filename = f"{table}-{datetime.now().date().isoformat()}.{format}"
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        export_rows(rows, fields, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+# ===============================
+# DASHBOARD ROUTES
+# ===============================
+
+@router.get("/dashboard/stats")
+async def get_dashboard_stats(fresh: bool = False, storage: Storage = Depends(get_storage)):
+    # Keyed by day so today_appointments rolls over at midnight
+    key = date.today()
+    if not fresh:
+        stats = dashboard_cache.get(key)
+        if stats is not MISSING:
+            return stats
+
+    generation = dashboard_cache.generation
+    stats = await storage.dashboard_stats()
+    dashboard_cache.set(key, stats, generation)
+    return stats
+
+# ===============================
+# EVENTS
+# ===============================
+
+@router.get("/events")
+async def get_events(request: Request, tables: Optional[str] = None):
+    """Server-sent events: ``change`` after every write, ``reset`` when the client must refetch.
+
+    ``tables`` narrows the stream to a comma separated subset of EVENT_TABLES.
+    """
+    wanted = [table.strip() for table in (tables or "").split(",") if table.strip()]
+    unknown = [table for table in wanted if table not in EVENT_TABLES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown tables: {', '.join(unknown)}")
+    subscription = event_bus.subscribe(wanted, request.headers.get("last-event-id"))
+    if subscription is None:
+        raise HTTPException(status_code=503, detail="Too many event streams, try again later")
+    return StreamingResponse(
+        subscription.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
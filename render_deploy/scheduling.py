@@ -0,0 +1,136 @@
+"""Appointment slots, capacity rules and conflict detection.
+
+``Appointment.time`` used to be free text; it is now normalised to ``HH:MM``
+and stored alongside typed ``start_time``/``end_time`` columns so overlaps
+can be computed. Availability is answered from a per-day in-memory interval
+index; the authoritative conflict check happens in the database when a
+booking is written (see ``book_appointment`` in the storage backends).
+"""
+
+import json
+import os
+import re
+from bisect import bisect_left
+from datetime import time
+from typing import Dict, Iterable, List, Optional
+
+# Session length and capacity per service type, e.g.
+# SERVICE_RULES='{"Pilates Mat": {"capacity": 8}, "Avaliação": {"duration": 30}}'
+DEFAULT_DURATION_MINUTES = int(os.environ.get('APPOINTMENT_DURATION_MINUTES', '60'))
+DEFAULT_CAPACITY = 1
+SERVICE_RULES: Dict[str, dict] = json.loads(os.environ.get('SERVICE_RULES', '{}'))
+# Customers an instructor takes at once, capping every service's capacity, e.g.
+# INSTRUCTOR_RULES='{"Rita": {"capacity": 4}}'
+INSTRUCTOR_RULES: Dict[str, dict] = json.loads(os.environ.get('INSTRUCTOR_RULES', '{}'))
+
+STUDIO_OPEN = os.environ.get('STUDIO_OPEN', '06:00')
+STUDIO_CLOSE = os.environ.get('STUDIO_CLOSE', '22:00')
+SLOT_MINUTES = int(os.environ.get('SLOT_MINUTES', '30'))
+
+_TIME_RE = re.compile(r"^\s*(\d{1,2})\s*(?:[:hH.]\s*(\d{2})?)?\s*$")
+
+
+def parse_time(value: str) -> time:
+    """Accept the formats typed at the front desk: 9:00, 09:00, 9h, 9h30, 09.30"""
+    match = _TIME_RE.match(value or "")
+    if not match:
+        raise ValueError(f"Invalid time '{value}', expected HH:MM")
+    hour, minute = int(match.group(1)), int(match.group(2) or 0)
+    if hour > 23 or minute > 59:
+        raise ValueError(f"Invalid time '{value}', expected HH:MM")
+    return time(hour, minute)
+
+
+def to_minutes(value: time) -> int:
+    return value.hour * 60 + value.minute
+
+
+def from_minutes(minutes: int) -> time:
+    return time(minutes // 60, minutes % 60)
+
+
+def duration_for(service_type: str) -> int:
+    return int(SERVICE_RULES.get(service_type, {}).get("duration", DEFAULT_DURATION_MINUTES))
+
+
+def capacity_for(service_type: str, instructor: Optional[str] = None) -> int:
+    """Customers one instructor can take at once for this service"""
+    capacity = int(SERVICE_RULES.get(service_type, {}).get("capacity", DEFAULT_CAPACITY))
+    limit = INSTRUCTOR_RULES.get(instructor, {}).get("capacity") if instructor else None
+    return capacity if limit is None else min(capacity, int(limit))
+
+
+def end_time_for(start: time, service_type: str) -> time:
+    # Sessions never run past midnight
+    return from_minutes(min(to_minutes(start) + duration_for(service_type), 23 * 60 + 59))
+
+
+def find_conflict(existing: Iterable[dict], customer_id: str, instructor: Optional[str], service_type: str) -> Optional[str]:
+    """Reason the booking is not allowed, given the appointments overlapping its interval"""
+    same_class = 0
+    for appointment in existing:
+        if appointment['customer_id'] == customer_id:
+            return "Customer already has an appointment at this time"
+        # Without an instructor there is no one whose time or class size is at stake
+        if instructor is None or appointment['instructor'] != instructor:
+            continue
+        if appointment['service_type'] != service_type:
+            return f"Instructor is already booked for {appointment['service_type']} at this time"
+        same_class += 1
+    if same_class >= capacity_for(service_type, instructor):
+        return "This time slot is full"
+    return None
+
+
+class DayIndex:
+    """Active appointments of one day, per instructor, sorted by start minute"""
+
+    def __init__(self, appointments: Iterable[dict]):
+        self._by_instructor: Dict[Optional[str], List[tuple]] = {}
+        self._longest = 0
+        for appointment in appointments:
+            start, end = to_minutes(appointment['start_time']), to_minutes(appointment['end_time'])
+            self._by_instructor.setdefault(appointment['instructor'], []).append((start, end, appointment))
+            self._longest = max(self._longest, end - start)
+        for intervals in self._by_instructor.values():
+            intervals.sort(key=lambda interval: interval[0])
+
+    def overlapping(self, instructor: Optional[str], start: int, end: int) -> List[dict]:
+        intervals = self._by_instructor.get(instructor, [])
+        # Anything starting before ``start - longest`` has already ended
+        i = bisect_left(intervals, start - self._longest, key=lambda interval: interval[0])
+        found = []
+        for s, e, appointment in intervals[i:]:
+            if s >= end:
+                break
+            if e > start:
+                found.append(appointment)
+        return found
+
+    def slots(self, instructor: Optional[str], service_type: Optional[str]) -> List[dict]:
+        """Every slot between opening and closing time with its remaining capacity.
+
+        Follows the rules of ``find_conflict``: without an instructor nothing
+        caps a slot, so ``remaining`` is None and every slot is available.
+        """
+        opening, closing = to_minutes(parse_time(STUDIO_OPEN)), to_minutes(parse_time(STUDIO_CLOSE))
+        duration = duration_for(service_type) if service_type else SLOT_MINUTES
+        capacity = capacity_for(service_type, instructor) if service_type else 1
+        result = []
+        for start in range(opening, closing - duration + 1, SLOT_MINUTES):
+            overlapping = self.overlapping(instructor, start, start + duration)
+            if instructor is None:
+                remaining = None
+            elif service_type is None:
+                remaining = 0 if overlapping else 1
+            elif any(a['service_type'] != service_type for a in overlapping):
+                remaining = 0
+            else:
+                remaining = max(capacity - len(overlapping), 0)
+            result.append({
+                "time": from_minutes(start).strftime("%H:%M"),
+                "booked": len(overlapping),
+                "remaining": remaining,
+                "available": remaining is None or remaining > 0,
+            })
+        return result
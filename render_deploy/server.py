@@ -1,24 +1,44 @@
-from fastapi import FastAPI, APIRouter, HTTPException
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import JSONResponse, ORJSONResponse
 from starlette.middleware.cors import CORSMiddleware
 import asyncpg
 import os
 import logging
-from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
-import uuid
+from typing import Optional
 from datetime import datetime, date
-import base64
-import json
+from datetime import timedelta
+
+from cache import LRUCache, MISSING
+from compression import CompressionMiddleware
+from counters import reconcile_counters
+from jobs import JOBS_ENABLED, JobRunner
+from metrics import MetricsMiddleware, router as metrics_router
+import queries
+from routes import (
+    FAST_JSON, changed, customer_cache, dashboard_cache, event_bus, listen_for_changes, overview_cache, package_cache,
+    router as shared_router,
+)
+from scheduling import DayIndex
+from http_cache import REVALIDATE, CachedStaticFiles, ConditionalGetMiddleware, TableVersions, file_response
+from reports import GRANULARITIES, REVENUE_GROUPS, attendance_report, mark_all_days_dirty, pending_days, revenue_report
+from storage_postgres import PostgresStorage
 
 # Create the main app
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse if FAST_JSON else JSONResponse)
 
 # Database connection
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
+# Seconds a day's availability index is reused before being rebuilt from the database
+AVAILABILITY_CACHE_TTL = float(os.environ.get('AVAILABILITY_CACHE_TTL', '30'))
+# Days whose availability index a worker keeps; the least recently read are dropped first
+AVAILABILITY_CACHE_SIZE = int(os.environ.get('AVAILABILITY_CACHE_SIZE', '60'))
+
+availability_cache = LRUCache(AVAILABILITY_CACHE_TTL, AVAILABILITY_CACHE_SIZE)
+
+# Bumped by every write route; ETags of cached GETs are derived from them
+table_versions = TableVersions()
+
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
@@ -26,407 +46,119 @@ api_router = APIRouter(prefix="/api")
 # DATABASE SETUP
 # ===============================
 
-async def get_database():
-    return await asyncpg.connect(DATABASE_URL)
-
-async def init_database():
-    """Initialize database tables"""
-    conn = await get_database()
-    try:
-        # Create customers table
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS customers (
-                id VARCHAR PRIMARY KEY,
-                name VARCHAR NOT NULL,
-                cpf VARCHAR NOT NULL,
-                email VARCHAR NOT NULL,
-                phone VARCHAR NOT NULL,
-                address VARCHAR NOT NULL,
-                birth_date DATE NOT NULL,
-                photo TEXT,
-                medical_notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create packages table
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS packages (
-                id VARCHAR PRIMARY KEY,
-                name VARCHAR NOT NULL,
-                type VARCHAR NOT NULL,
-                price DECIMAL NOT NULL,
-                description TEXT NOT NULL,
-                duration_days INTEGER,
-                sessions_included INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create customer_packages table
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS customer_packages (
-                id VARCHAR PRIMARY KEY,
-                customer_id VARCHAR NOT NULL,
-                package_id VARCHAR NOT NULL,
-                purchase_date DATE NOT NULL,
-                amount_paid DECIMAL NOT NULL,
-                payment_method VARCHAR NOT NULL,
-                status VARCHAR DEFAULT 'active',
-                remaining_sessions INTEGER,
-                expiry_date DATE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create appointments table
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS appointments (
-                id VARCHAR PRIMARY KEY,
-                customer_id VARCHAR NOT NULL,
-                package_id VARCHAR NOT NULL,
-                date DATE NOT NULL,
-                time VARCHAR NOT NULL,
-                service_type VARCHAR NOT NULL,
-                instructor VARCHAR,
-                status VARCHAR DEFAULT 'scheduled',
-                notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create payments table
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS payments (
-                id VARCHAR PRIMARY KEY,
-                customer_package_id VARCHAR NOT NULL,
-                amount DECIMAL NOT NULL,
-                payment_date DATE NOT NULL,
-                payment_method VARCHAR NOT NULL,
-                notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        print("Database tables initialized successfully")
-    finally:
-        await conn.close()
+def invalidate_after_write(table: str, day: Optional[date] = None, **keys):
+    """Drop this app's caches after a write; called by ``changed`` in routes.py"""
+    if table == "appointments":
+        if day:
+            availability_cache.invalidate(day)
+        else:
+            availability_cache.invalidate()
+    table_versions.bump(table)
 
-# ===============================
-# MODELS
-# ===============================
+# CRUD goes through the storage layer; the Postgres-only routes below borrow
+# connections from the same pool
+storage = PostgresStorage(DATABASE_URL, on_change=invalidate_after_write)
+app.state.storage = storage
+acquire_connection = storage.acquire
 
-class Customer(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    cpf: str
-    email: str
-    phone: str
-    address: str
-    birth_date: date
-    photo: Optional[str] = None
-    medical_notes: Optional[str] = None
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-
-class CustomerCreate(BaseModel):
-    name: str
-    cpf: str
-    email: str
-    phone: str
-    address: str
-    birth_date: date
-    photo: Optional[str] = None
-    medical_notes: Optional[str] = None
-
-class Package(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    type: str
-    price: float
-    description: str
-    duration_days: Optional[int] = None
-    sessions_included: Optional[int] = None
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-
-class PackageCreate(BaseModel):
-    name: str
-    type: str
-    price: float
-    description: str
-    duration_days: Optional[int] = None
-    sessions_included: Optional[int] = None
-
-class CustomerPackage(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    customer_id: str
-    package_id: str
-    purchase_date: date
-    amount_paid: float
-    payment_method: str
-    status: str = "active"
-    remaining_sessions: Optional[int] = None
-    expiry_date: Optional[date] = None
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-
-class CustomerPackageCreate(BaseModel):
-    customer_id: str
-    package_id: str
-    purchase_date: date
-    amount_paid: float
-    payment_method: str
-    remaining_sessions: Optional[int] = None
-    expiry_date: Optional[date] = None
-
-class Appointment(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    customer_id: str
-    package_id: str
-    date: date
-    time: str
-    service_type: str
-    instructor: Optional[str] = None
-    status: str = "scheduled"
-    notes: Optional[str] = None
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-
-class AppointmentCreate(BaseModel):
-    customer_id: str
-    package_id: str
-    date: date
-    time: str
-    service_type: str
-    instructor: Optional[str] = None
-    notes: Optional[str] = None
-
-class Payment(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    customer_package_id: str
-    amount: float
-    payment_date: date
-    payment_method: str
-    notes: Optional[str] = None
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-
-class PaymentCreate(BaseModel):
-    customer_package_id: str
-    amount: float
-    payment_date: date
-    payment_method: str
-    notes: Optional[str] = None
-
-# ===============================
-# CUSTOMER ROUTES
-# ===============================
+# Periodic sweeps (package expiry, no-shows, report rollups); see jobs.py
+# Job -> table its sweep updates; report rollups are not served by the CRUD routes
+SWEPT_TABLES = {"expire_packages": "customer_packages", "mark_no_shows": "appointments"}
 
-@api_router.post("/customers", response_model=Customer)
-async def create_customer(customer: CustomerCreate):
-    conn = await get_database()
-    try:
-        customer_dict = customer.dict()
-        customer_id = str(uuid.uuid4())
-        
-        await conn.execute('''
-            INSERT INTO customers (id, name, cpf, email, phone, address, birth_date, photo, medical_notes)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-        ''', customer_id, customer_dict['name'], customer_dict['cpf'], customer_dict['email'],
-            customer_dict['phone'], customer_dict['address'], customer_dict['birth_date'],
-            customer_dict.get('photo'), customer_dict.get('medical_notes'))
-        
-        customer_dict['id'] = customer_id
-        return Customer(**customer_dict)
-    finally:
-        await conn.close()
-
-@api_router.get("/customers", response_model=List[Customer])
-async def get_customers():
-    conn = await get_database()
-    try:
-        rows = await conn.fetch('SELECT * FROM customers ORDER BY created_at DESC')
-        return [Customer(**dict(row)) for row in rows]
-    finally:
-        await conn.close()
-
-@api_router.get("/customers/{customer_id}", response_model=Customer)
-async def get_customer(customer_id: str):
-    conn = await get_database()
-    try:
-        row = await conn.fetchrow('SELECT * FROM customers WHERE id = $1', customer_id)
-        if not row:
-            raise HTTPException(status_code=404, detail="Customer not found")
-        return Customer(**dict(row))
-    finally:
-        await conn.close()
-
-@api_router.put("/customers/{customer_id}", response_model=Customer)
-async def update_customer(customer_id: str, customer: CustomerCreate):
-    conn = await get_database()
-    try:
-        customer_dict = customer.dict()
-        
-        result = await conn.execute('''
-            UPDATE customers 
-            SET name=$2, cpf=$3, email=$4, phone=$5, address=$6, birth_date=$7, photo=$8, medical_notes=$9
-            WHERE id=$1
-        ''', customer_id, customer_dict['name'], customer_dict['cpf'], customer_dict['email'],
-            customer_dict['phone'], customer_dict['address'], customer_dict['birth_date'],
-            customer_dict.get('photo'), customer_dict.get('medical_notes'))
-        
-        if result == 'UPDATE 0':
-            raise HTTPException(status_code=404, detail="Customer not found")
-        
-        customer_dict['id'] = customer_id
-        return Customer(**customer_dict)
-    finally:
-        await conn.close()
-
-@api_router.delete("/customers/{customer_id}")
-async def delete_customer(customer_id: str):
-    conn = await get_database()
-    try:
-        result = await conn.execute('DELETE FROM customers WHERE id = $1', customer_id)
-        if result == 'DELETE 0':
-            raise HTTPException(status_code=404, detail="Customer not found")
-        return {"message": "Customer deleted successfully"}
-    finally:
-        await conn.close()
+async def changed_by_sweep(job: str):
+    if job in SWEPT_TABLES:
+        await changed(storage, SWEPT_TABLES[job], "swept")
 
-# ===============================
-# PACKAGE ROUTES
-# ===============================
+job_runner = JobRunner(acquire_connection, on_change=changed_by_sweep)
 
-@api_router.post("/packages", response_model=Package)
-async def create_package(package: PackageCreate):
-    conn = await get_database()
-    try:
-        package_dict = package.dict()
-        package_id = str(uuid.uuid4())
-        
-        await conn.execute('''
-            INSERT INTO packages (id, name, type, price, description, duration_days, sessions_included)
-            VALUES ($1, $2, $3, $4, $5, $6, $7)
-        ''', package_id, package_dict['name'], package_dict['type'], package_dict['price'],
-            package_dict['description'], package_dict.get('duration_days'), package_dict.get('sessions_included'))
-        
-        package_dict['id'] = package_id
-        return Package(**package_dict)
-    finally:
-        await conn.close()
-
-@api_router.get("/packages", response_model=List[Package])
-async def get_packages():
-    conn = await get_database()
-    try:
-        rows = await conn.fetch('SELECT * FROM packages ORDER BY created_at DESC')
-        return [Package(**dict(row)) for row in rows]
-    finally:
-        await conn.close()
-
-@api_router.get("/packages/{package_id}", response_model=Package)
-async def get_package(package_id: str):
-    conn = await get_database()
-    try:
-        row = await conn.fetchrow('SELECT * FROM packages WHERE id = $1', package_id)
-        if not row:
-            raise HTTPException(status_code=404, detail="Package not found")
-        return Package(**dict(row))
-    finally:
-        await conn.close()
-
-@api_router.put("/packages/{package_id}", response_model=Package)
-async def update_package(package_id: str, package: PackageCreate):
-    conn = await get_database()
-    try:
-        package_dict = package.dict()
-        
-        result = await conn.execute('''
-            UPDATE packages 
-            SET name=$2, type=$3, price=$4, description=$5, duration_days=$6, sessions_included=$7
-            WHERE id=$1
-        ''', package_id, package_dict['name'], package_dict['type'], package_dict['price'],
-            package_dict['description'], package_dict.get('duration_days'), package_dict.get('sessions_included'))
-        
-        if result == 'UPDATE 0':
-            raise HTTPException(status_code=404, detail="Package not found")
-        
-        package_dict['id'] = package_id
-        return Package(**package_dict)
-    finally:
-        await conn.close()
-
-@api_router.delete("/packages/{package_id}")
-async def delete_package(package_id: str):
-    conn = await get_database()
-    try:
-        result = await conn.execute('DELETE FROM packages WHERE id = $1', package_id)
-        if result == 'DELETE 0':
-            raise HTTPException(status_code=404, detail="Package not found")
-        return {"message": "Package deleted successfully"}
-    finally:
-        await conn.close()
+async def get_db():
+    """FastAPI dependency lending a pooled connection for the duration of a request"""
+    async with acquire_connection() as conn:
+        yield conn
 
 # ===============================
 # APPOINTMENT ROUTES
 # ===============================
 
-@api_router.post("/appointments", response_model=Appointment)
-async def create_appointment(appointment: AppointmentCreate):
-    conn = await get_database()
-    try:
-        appointment_dict = appointment.dict()
-        appointment_id = str(uuid.uuid4())
-        
-        await conn.execute('''
-            INSERT INTO appointments (id, customer_id, package_id, date, time, service_type, instructor, notes)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-        ''', appointment_id, appointment_dict['customer_id'], appointment_dict['package_id'],
-            appointment_dict['date'], appointment_dict['time'], appointment_dict['service_type'],
-            appointment_dict.get('instructor'), appointment_dict.get('notes'))
-        
-        appointment_dict['id'] = appointment_id
-        return Appointment(**appointment_dict)
-    finally:
-        await conn.close()
-
-@api_router.get("/appointments", response_model=List[Appointment])
-async def get_appointments():
-    conn = await get_database()
-    try:
-        rows = await conn.fetch('SELECT * FROM appointments ORDER BY date DESC, time DESC')
-        return [Appointment(**dict(row)) for row in rows]
-    finally:
-        await conn.close()
+@api_router.get("/availability")
+async def get_availability(day: date = Query(..., alias="date"), instructor: Optional[str] = None, service_type: Optional[str] = None):
+    """Open slots for one instructor on one day, answered from the in-memory day index"""
+    index = availability_cache.get(day)
+    if index is MISSING:
+        generation = availability_cache.generation
+        async with acquire_connection() as conn:
+            rows = await queries.fetch(conn, queries.DAY_SCHEDULE, day)
+        index = DayIndex(dict(row) for row in rows)
+        availability_cache.set(day, index, generation)
+    
+    return {
+        "date": day,
+        "instructor": instructor,
+        "service_type": service_type,
+        "slots": index.slots(instructor or None, service_type),
+    }
 
 # ===============================
-# DASHBOARD ROUTES
+# REPORTS
 # ===============================
 
-@api_router.get("/dashboard/stats")
-async def get_dashboard_stats():
-    conn = await get_database()
-    try:
-        # Get counts
-        total_customers = await conn.fetchval('SELECT COUNT(*) FROM customers')
-        total_packages = await conn.fetchval('SELECT COUNT(*) FROM packages')
-        total_appointments = await conn.fetchval('SELECT COUNT(*) FROM appointments')
-        active_customer_packages = await conn.fetchval("SELECT COUNT(*) FROM customer_packages WHERE status = 'active'")
-        
-        # Get today's appointments
-        today = datetime.now().date()
-        today_appointments = await conn.fetchval('SELECT COUNT(*) FROM appointments WHERE date = $1', today)
-        
-        # Get recent payments
-        recent_payments = await conn.fetch('SELECT * FROM payments ORDER BY payment_date DESC LIMIT 5')
-        
-        return {
-            "total_customers": total_customers or 0,
-            "total_packages": total_packages or 0,
-            "total_appointments": total_appointments or 0,
-            "active_customer_packages": active_customer_packages or 0,
-            "today_appointments": today_appointments or 0,
-            "recent_payments": [dict(payment) for payment in recent_payments]
-        }
-    finally:
-        await conn.close()
+def report_range(start: Optional[date], end: Optional[date], granularity: str) -> tuple:
+    """Inclusive date range of a report, the last year by default"""
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+    end = end or datetime.now().date()
+    start = start or end - timedelta(days=365)
+    if start > end:
+        raise HTTPException(status_code=400, detail="from must not be after to")
+    return start, end
+
+@api_router.get("/reports/revenue")
+async def get_revenue_report(
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    granularity: str = "month",
+    group_by: str = ",".join(REVENUE_GROUPS),
+    conn: asyncpg.Connection = Depends(get_db),
+):
+    """Revenue per period and package type / payment method, read from the daily rollups"""
+    start, end = report_range(date_from, date_to, granularity)
+    groups = [group.strip() for group in group_by.split(",") if group.strip()]
+    unknown = [group for group in groups if group not in REVENUE_GROUPS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by: {', '.join(unknown)}")
+
+    return {
+        "from": start,
+        "to": end,
+        "granularity": granularity,
+        "pending_days": await pending_days(conn, "revenue", start, end),
+        "rows": await revenue_report(conn, start, end, granularity, groups),
+    }
+
+@api_router.get("/reports/attendance")
+async def get_attendance_report(
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    granularity: str = "month",
+    instructor: Optional[str] = None,
+    conn: asyncpg.Connection = Depends(get_db),
+):
+    """Scheduled, completed, no-show and cancelled sessions per period and instructor"""
+    start, end = report_range(date_from, date_to, granularity)
+    return {
+        "from": start,
+        "to": end,
+        "granularity": granularity,
+        "pending_days": await pending_days(conn, "attendance", start, end),
+        "rows": await attendance_report(conn, start, end, granularity, instructor),
+    }
+
+@api_router.post("/reports/rebuild")
+async def rebuild_reports(conn: asyncpg.Connection = Depends(get_db)):
+    """Queue every day for a rollup refresh, e.g. after package types were edited"""
+    await mark_all_days_dirty(conn)
+    rows = await job_runner.run("refresh_reports")
+    return {"refreshed_days": rows}
 
 # ===============================
 # BASIC ROUTES
@@ -436,22 +168,82 @@ async def get_dashboard_stats():
 async def root():
     return {"message": "FitManager API - Sistema de Gestão de Clientes"}
 
-# Include the router in the main app
+@api_router.get("/system/pool")
+async def get_pool_stats():
+    """Connection pool saturation and acquire wait times, used to size DB_POOL_MAX_SIZE"""
+    return storage.pool_stats.snapshot(storage.pool)
+
+@api_router.post("/system/counters/reconcile")
+async def reconcile_stats_counters(dry_run: bool = False, conn: asyncpg.Connection = Depends(get_db)):
+    """Recount the dashboard counters from the source tables, reporting any drift"""
+    drift = await reconcile_counters(conn, dry_run=dry_run)
+    if drift and not dry_run:
+        dashboard_cache.invalidate()
+    return {"dry_run": dry_run, "drift": drift}
+
+@api_router.get("/system/cache")
+async def get_cache_stats():
+    """Hit/miss counters for the in-process caches of this worker"""
+    return {
+        "dashboard": dashboard_cache.stats(),
+        "availability": availability_cache.stats(),
+        "overview": overview_cache.stats(),
+        "customers": customer_cache.stats(),
+        "packages": package_cache.stats(),
+    }
+
+@api_router.get("/system/events")
+async def get_event_stats():
+    """Open /api/events streams of this worker, events waiting in their queues and streams reset"""
+    return event_bus.stats()
+
+@api_router.get("/system/jobs")
+async def get_job_stats():
+    """Schedule, duration and rows touched of the last run of each background sweep"""
+    return {"enabled": JOBS_ENABLED, "jobs": job_runner.snapshot()}
+
+@api_router.post("/system/jobs/{name}/run")
+async def run_job(name: str):
+    """Run a sweep immediately instead of waiting for its next tick"""
+    if name not in job_runner.jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+    rows = await job_runner.run(name)
+    if rows is None:
+        raise HTTPException(status_code=409, detail="Job is already running in another worker")
+    return {"job": name, "rows": rows}
+
+# Include the routers in the main app
 app.include_router(api_router)
+app.include_router(shared_router)
+# Prometheus scrape endpoint; registered before the frontend catch-all
+app.include_router(metrics_router)
 
 # Mount static files (frontend)
-app.mount("/static", StaticFiles(directory="build/static"), name="static")
+app.mount("/static", CachedStaticFiles(directory="build/static"), name="static")
 
+# index.html is not fingerprinted: revalidate it so a new deploy is picked up
 @app.get("/")
-async def serve_frontend():
-    return FileResponse("build/index.html")
+async def serve_frontend(request: Request):
+    return file_response(request, "build/index.html", "no-cache")
 
 @app.get("/{path:path}")
-async def serve_frontend_routes(path: str):
+async def serve_frontend_routes(path: str, request: Request):
     # Serve frontend for all routes that don't start with /api
     if path.startswith("api/"):
         raise HTTPException(status_code=404, detail="API endpoint not found")
-    return FileResponse("build/index.html")
+    return file_response(request, "build/index.html", "no-cache")
+
+app.add_middleware(
+    ConditionalGetMiddleware,
+    versions=table_versions,
+    rules=[
+        (r"/api/packages(/[^/]+)?", ("packages",), REVALIDATE),
+        # Also covers /api/customers/search, which reads nothing but customers
+        (r"/api/customers(/[^/]+)?", ("customers",), REVALIDATE),
+    ],
+)
+
+app.add_middleware(CompressionMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -459,8 +251,12 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Outermost, so latency and sizes include every other middleware
+app.add_middleware(MetricsMiddleware)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -470,4 +266,13 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("startup")
 async def startup_event():
-    await init_database()
\ No newline at end of file
+    await storage.open()
+    await storage.migrate()
+    await listen_for_changes(storage)
+    if JOBS_ENABLED:
+        job_runner.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await job_runner.stop()
+    await storage.close()
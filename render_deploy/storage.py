@@ -0,0 +1,240 @@
+"""Storage layer shared by the Postgres and Mongo backends.
+
+Routes talk to a ``Storage``: one ``Repository`` per entity, with the same
+async interface whichever database sits behind it. Rows go in and come out
+as plain dicts keyed by stored field names (``photo_hash`` rather than the
+``photo`` URL). Keyset pagination, projections and filters are described
+once here and translated to SQL by storage_postgres.py and to Mongo queries
+by storage_mongo.py.
+"""
+
+import base64
+import json
+import os
+from datetime import date, datetime
+from typing import AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+
+# Implementation built by open_storage(): "postgres" or "mongo"
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'postgres')
+
+# Connection pool settings, used for the asyncpg pool and the Motor client alike
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+
+# Rows an export reads from the database per round trip
+EXPORT_BATCH_SIZE = 500
+
+
+class Conflict(Exception):
+    """A write refused by a uniqueness rule or a booking conflict; routes answer 409"""
+
+
+class Entity(NamedTuple):
+    # Table or collection name
+    name: str
+    # Keyset order of listings, always descending; the last key is unique
+    order: Tuple[str, ...]
+    # Decode each order key back from a cursor
+    parsers: tuple
+    # Model field -> stored field, where they differ
+    field_map: Dict[str, str] = {}
+    # Values of fields a new row leaves out; Postgres has them as column defaults
+    defaults: Dict[str, object] = {}
+    # Related row a listing can embed -> (field holding its id, entity it is read from)
+    relations: Dict[str, tuple] = {}
+
+
+CUSTOMERS = Entity("customers", ("created_at", "id"), (datetime.fromisoformat, str), {"photo": "photo_hash"})
+PACKAGES = Entity("packages", ("created_at", "id"), (datetime.fromisoformat, str))
+CUSTOMER_PACKAGES = Entity(
+    "customer_packages", ("created_at", "id"), (datetime.fromisoformat, str), defaults={"status": "active"}
+)
+APPOINTMENTS = Entity(
+    "appointments", ("date", "time", "id"), (date.fromisoformat, str, str), defaults={"status": "scheduled"},
+    relations={"customer": ("customer_id", CUSTOMERS), "package": ("package_id", PACKAGES)},
+)
+PAYMENTS = Entity("payments", ("created_at", "id"), (datetime.fromisoformat, str))
+
+# Operators a filter may use: (field, operator, value)
+FILTER_OPERATORS = ("=", ">=", "<=")
+
+
+def encode_cursor(*values) -> str:
+    """Opaque cursor holding the sort key of the last row of a page"""
+    raw = json.dumps([v.isoformat() if isinstance(v, (date, datetime)) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *parsers) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if len(values) != len(parsers):
+            raise ValueError("wrong number of keys")
+        return [parse(value) for parse, value in zip(parsers, values)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def stored_fields(entity: Entity, fields: Optional[List[str]]) -> Optional[List[str]]:
+    """Stored fields to read for a projection of model fields; the order keys are always read"""
+    if fields is None:
+        return None
+    return list(dict.fromkeys([entity.field_map.get(field, field) for field in fields] + list(entity.order)))
+
+
+def relation_keys(entity: Entity, expand: Optional[List[str]]) -> List[str]:
+    """Stored fields holding the ids of the relations to embed"""
+    return [entity.relations[name][0] for name in expand or []]
+
+
+class Repository:
+    """Async CRUD for one entity"""
+
+    def __init__(self, entity: Entity):
+        self.entity = entity
+
+    async def insert(self, data: dict) -> dict:
+        """Store a new row and return it as stored, defaults included; raises Conflict on duplicates"""
+        raise NotImplementedError
+
+    async def insert_bulk(self, rows: List[dict]) -> List[Optional[str]]:
+        """Store many new rows at once, going on past the ones refused.
+
+        Returns, for each row in order, None when it was stored or the reason it was not.
+        """
+        raise NotImplementedError
+
+    async def get(self, id: str, fields: Optional[List[str]] = None) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def get_many(self, ids: List[str]) -> List[dict]:
+        """Rows with any of ``ids``, in one query and in no particular order; unknown ids are left out"""
+        raise NotImplementedError
+
+    async def find(self, **equals) -> List[dict]:
+        """Every row whose fields equal ``equals``, in listing order"""
+        raise NotImplementedError
+
+    async def page(self, limit: int, cursor: Optional[str] = None, fields: Optional[List[str]] = None,
+                   filters: Optional[List[tuple]] = None,
+                   expand: Optional[List[str]] = None) -> Tuple[List[dict], Optional[str]]:
+        """One page in listing order plus the cursor of the next one, None on the last page.
+
+        ``fields`` are model fields to project on, ``filters`` are
+        ``(field, operator, value)`` triples ANDed together. Each name in
+        ``expand`` is one of the entity's ``relations``; the related row is
+        joined in by the same query and stored under that name, None when
+        it does not exist.
+        """
+        raise NotImplementedError
+
+    async def update(self, id: str, data: dict) -> Optional[dict]:
+        """Set the fields in ``data`` and return the updated row, or None if there is no such row"""
+        raise NotImplementedError
+
+    async def delete(self, id: str) -> bool:
+        raise NotImplementedError
+
+    def export(self, fields: List[str], date_field: str, date_from: Optional[date] = None,
+               date_to: Optional[date] = None) -> AsyncIterator[dict]:
+        """Every row whose ``date_field`` falls in the inclusive range, oldest first.
+
+        Rows are read EXPORT_BATCH_SIZE at a time as the caller iterates, never
+        all at once; a bound left out is open.
+        """
+        raise NotImplementedError
+
+
+class Storage:
+    """One repository per entity, plus the operations that span several of them.
+
+    ``on_change(table, **keys)`` is called by the routes after every write so
+    the app can drop whatever it caches; ``keys`` may carry ``customer_id``
+    and ``day``.
+    """
+
+    customers: Repository
+    packages: Repository
+    customer_packages: Repository
+    appointments: Repository
+    payments: Repository
+
+    def __init__(self, on_change: Optional[Callable] = None):
+        self.on_change = on_change
+
+    async def open(self):
+        raise NotImplementedError
+
+    async def migrate(self):
+        """Bring the schema or indexes up to date"""
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+    async def book_appointment(self, data: dict, appointment_id: Optional[str] = None) -> Optional[dict]:
+        """Insert an appointment, or replace ``appointment_id`` with ``data``.
+
+        Raises Conflict when the slot collides with another booking of the
+        same customer or instructor; returns None when ``appointment_id``
+        does not exist.
+        """
+        raise NotImplementedError
+
+    async def redeem_appointment(self, appointment_id: str) -> Optional[dict]:
+        """Mark a scheduled appointment completed and take one session of the customer's package.
+
+        The session comes from the soonest-expiring active package of the
+        appointment's package type still valid on its date; the package turns
+        ``exhausted`` on its last session. Returns ``{"appointment",
+        "customer_package"}``, None when there is no such appointment, and
+        raises Conflict when it is not scheduled or no package has a session
+        left. Parallel check-ins never take more sessions than a package has.
+        """
+        raise NotImplementedError
+
+    async def customer_overview(self, customer_id: str, today: date, appointments: int) -> Optional[dict]:
+        """The customer, its packages (each with its ``package``), its next and last ``appointments``
+        appointments around ``today`` and a payment summary; None when the customer does not exist.
+
+        Keys: customer, packages, upcoming_appointments, recent_appointments, payments.
+        """
+        raise NotImplementedError
+
+    async def dashboard_stats(self) -> dict:
+        raise NotImplementedError
+
+    async def search_customers(self, query: str, fields: List[str], limit: int) -> List[dict]:
+        """Customers whose name, email, CPF or phone match the words of ``query``, best matches first"""
+        raise NotImplementedError
+
+    async def inline_photo(self, customer_id: str) -> Optional[str]:
+        """Base64 photo still stored in the customer row, which no repository read returns"""
+        raise NotImplementedError
+
+    async def listen(self, callback: Callable[[str], None], on_missed: Optional[Callable[[], None]] = None):
+        """Call ``callback(payload)`` for every ``notify`` made by any worker, this one included.
+
+        ``on_missed()`` is called whenever notifications may have been lost:
+        when the channel drops and again once it is back. Backends without a
+        notification channel call neither; caches then rely on their TTL to
+        pick up writes made by other workers.
+        """
+
+    async def notify(self, payload: str):
+        pass
+
+
+def open_storage(backend: str = STORAGE_BACKEND, on_change: Optional[Callable] = None) -> Storage:
+    """Build the configured storage; drivers of the other backend are never imported"""
+    if backend == "postgres":
+        from storage_postgres import PostgresStorage
+        return PostgresStorage(os.environ.get('DATABASE_URL'), on_change=on_change)
+    if backend == "mongo":
+        from storage_mongo import MongoStorage
+        return MongoStorage.connect(os.environ.get('MONGO_URL'), os.environ.get('DB_NAME'), on_change=on_change)
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}, expected postgres or mongo")
@@ -0,0 +1,409 @@
+"""Mongo implementation of the storage layer, on Motor.
+
+BSON has no date type, so dates are kept as ISO strings (they still sort
+and compare correctly), slot times as ``HH:MM`` and decimals as floats.
+Documents are addressed by their ``id`` field; ``_id`` never leaves here.
+"""
+
+import logging
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+import metrics
+
+from scheduling import end_time_for, find_conflict, parse_time
+from storage import (
+    APPOINTMENTS, CUSTOMER_PACKAGES, CUSTOMERS, DB_POOL_ACQUIRE_TIMEOUT, DB_POOL_MAX_SIZE, DB_POOL_MIN_SIZE,
+    EXPORT_BATCH_SIZE, FILTER_OPERATORS, PACKAGES, PAYMENTS, Conflict, Entity, Repository, Storage, decode_cursor, encode_cursor,
+    relation_keys, stored_fields,
+)
+
+logger = logging.getLogger(__name__)
+
+MONGO_OPERATORS = {">=": "$gte", "<=": "$lte"}
+
+# Stored fields no read returns: the inline base64 photos that predate the
+# photo store, which only MongoStorage.inline_photo reads
+UNREAD_FIELDS = {CUSTOMERS.name: ("photo",)}
+
+# Fields stored as BSON datetimes; every other date is an ISO string
+DATETIME_FIELDS = ("created_at",)
+
+
+def to_bson(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, time):
+        return value.strftime("%H:%M")
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def to_document(data: dict) -> dict:
+    return {key: to_bson(value) for key, value in data.items()}
+
+
+def date_bound(field: str, day: date):
+    """``day`` as a bound on ``field``, in the type the field is stored as"""
+    return datetime.combine(day, time.min) if field in DATETIME_FIELDS else day.isoformat()
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Reports each command to metrics.py as ``<command> <collection>``.
+
+    Motor runs commands on driver threads, outside the request's context, so
+    their time is not added to the request's database time, and pymongo
+    does not expose how long a command waited for a pooled connection.
+    """
+
+    def __init__(self):
+        self.statements = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        statement = f"{event.command_name} {collection}" if isinstance(collection, str) else event.command_name
+        self.statements[event.request_id] = statement
+
+    def succeeded(self, event):
+        reply = event.reply
+        cursor = reply.get("cursor") or {}
+        batch = cursor.get("firstBatch", cursor.get("nextBatch"))
+        rows = len(batch) if batch is not None else reply.get("n", 0)
+        self._record(event, rows, False)
+
+    def failed(self, event):
+        self._record(event, 0, True)
+
+    def _record(self, event, rows: int, failed: bool):
+        statement = self.statements.pop(event.request_id, event.command_name)
+        metrics.record_query(statement, event.duration_micros / 1e6, rows, failed)
+
+
+class MongoRepository(Repository):
+    def __init__(self, collection, entity: Entity):
+        super().__init__(entity)
+        self.collection = collection
+
+    def _projection(self, fields: Optional[List[str]] = None, expand: Optional[List[str]] = None) -> dict:
+        projection = {field: 1 for field in stored_fields(self.entity, fields) or []}
+        if projection:
+            projection.update({key: 1 for key in relation_keys(self.entity, expand)})
+        else:
+            projection.update({field: 0 for field in UNREAD_FIELDS.get(self.entity.name, ())})
+        projection["_id"] = 0
+        return projection
+
+    def _sort(self) -> list:
+        return [(field, -1) for field in self.entity.order]
+
+    def _new_document(self, data: dict) -> dict:
+        # BSON datetimes keep milliseconds; return the value as it will be read back
+        now = datetime.utcnow()
+        created_at = now.replace(microsecond=now.microsecond // 1000 * 1000)
+        return {**self.entity.defaults, "created_at": created_at, **to_document(data)}
+
+    async def insert(self, data: dict) -> dict:
+        doc = self._new_document(data)
+        try:
+            await self.collection.insert_one(doc)
+        except DuplicateKeyError as e:
+            raise Conflict(str(e))
+        for field in ("_id", *UNREAD_FIELDS.get(self.entity.name, ())):
+            doc.pop(field, None)
+        return doc
+
+    async def insert_bulk(self, rows: List[dict]) -> List[Optional[str]]:
+        """Unordered insert_many: valid documents go in even when others fail"""
+        errors = [None] * len(rows)
+        try:
+            await self.collection.insert_many([self._new_document(row) for row in rows], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                errors[error["index"]] = error["errmsg"]
+        return errors
+
+    async def get(self, id: str, fields: Optional[List[str]] = None) -> Optional[dict]:
+        return await self.collection.find_one({"id": id}, self._projection(fields))
+
+    async def get_many(self, ids: List[str]) -> List[dict]:
+        return await self.collection.find({"id": {"$in": ids}}, self._projection()).to_list(None)
+
+    async def find(self, **equals) -> List[dict]:
+        return await self.collection.find(to_document(equals), self._projection()).sort(self._sort()).to_list(None)
+
+    async def page(self, limit: int, cursor: Optional[str] = None, fields: Optional[List[str]] = None,
+                   filters: Optional[List[tuple]] = None, expand: Optional[List[str]] = None):
+        """Keyset page; (a, b, c) < (x, y, z) is spelled out as an $or of prefixes.
+
+        Relations turn the find into an aggregation that $lookups each one
+        after the $limit, so only the rows returned are looked up.
+        """
+        order = self.entity.order
+        clauses = []
+        for field, operator, value in filters or []:
+            if operator not in FILTER_OPERATORS:
+                raise ValueError(f"Unsupported filter operator {operator!r}")
+            value = to_bson(value)
+            clauses.append({field: value} if operator == "=" else {field: {MONGO_OPERATORS[operator]: value}})
+        if cursor:
+            values = [to_bson(value) for value in decode_cursor(cursor, *self.entity.parsers)]
+            prefixes = []
+            for i, field in enumerate(order):
+                prefix = {order[j]: values[j] for j in range(i)}
+                prefix[field] = {"$lt": values[i]}
+                prefixes.append(prefix)
+            clauses.append({"$or": prefixes})
+        query = {"$and": clauses} if clauses else {}
+        projection = self._projection(fields, expand)
+        if expand:
+            pipeline = [
+                {"$match": query},
+                {"$sort": dict(self._sort())},
+                {"$limit": limit + 1},
+                {"$project": projection},
+            ]
+            unread = {}
+            for name in expand:
+                key, related = self.entity.relations[name]
+                pipeline.append({"$lookup": {"from": related.name, "localField": key, "foreignField": "id", "as": name}})
+                unread.update({f"{name}.{field}": 0 for field in ("_id", *UNREAD_FIELDS.get(related.name, ()))})
+            pipeline.append({"$project": unread})
+            docs = await self.collection.aggregate(pipeline).to_list(limit + 1)
+        else:
+            docs = await self.collection.find(query, projection).sort(self._sort()).limit(limit + 1).to_list(limit + 1)
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = encode_cursor(*(docs[-1][field] for field in order))
+        for doc in docs:
+            for name in expand or []:
+                # $lookup yields a list; ids are unique, so it holds one row or none
+                doc[name] = doc[name][0] if doc[name] else None
+        return docs, next_cursor
+
+    async def update(self, id: str, data: dict) -> Optional[dict]:
+        try:
+            return await self.collection.find_one_and_update(
+                {"id": id}, {"$set": to_document(data)}, self._projection(), return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError as e:
+            raise Conflict(str(e))
+
+    async def delete(self, id: str) -> bool:
+        result = await self.collection.delete_one({"id": id})
+        return result.deleted_count > 0
+
+    async def export(self, fields: List[str], date_field: str, date_from: Optional[date] = None,
+                     date_to: Optional[date] = None):
+        bounds = {}
+        if date_from:
+            bounds["$gte"] = date_bound(date_field, date_from)
+        if date_to:
+            bounds["$lt"] = date_bound(date_field, date_to + timedelta(days=1))
+        projection = dict({field: 1 for field in fields}, _id=0)
+        cursor = self.collection.find({date_field: bounds} if bounds else {}, projection)
+        async for doc in cursor.sort([(date_field, 1), ("id", 1)]).batch_size(EXPORT_BATCH_SIZE):
+            yield doc
+
+
+class MongoStorage(Storage):
+    def __init__(self, db, on_change=None):
+        super().__init__(on_change)
+        self.db = db
+        self.customers = MongoRepository(db.customers, CUSTOMERS)
+        self.packages = MongoRepository(db.packages, PACKAGES)
+        self.customer_packages = MongoRepository(db.customer_packages, CUSTOMER_PACKAGES)
+        self.appointments = MongoRepository(db.appointments, APPOINTMENTS)
+        self.payments = MongoRepository(db.payments, PAYMENTS)
+
+    @classmethod
+    def connect(cls, url: Optional[str], db_name: Optional[str], on_change=None) -> "MongoStorage":
+        if not url or not db_name:
+            raise ValueError("MONGO_URL and DB_NAME must be set")
+        # Motor keeps its own connection pool; size it like the Postgres one
+        client = AsyncIOMotorClient(
+            url,
+            minPoolSize=DB_POOL_MIN_SIZE,
+            maxPoolSize=DB_POOL_MAX_SIZE,
+            waitQueueTimeoutMS=int(DB_POOL_ACQUIRE_TIMEOUT * 1000),
+            event_listeners=[CommandTimer()],
+        )
+        return cls(client[db_name], on_change=on_change)
+
+    async def open(self):
+        # Motor connects lazily on the first operation
+        pass
+
+    async def migrate(self):
+        """Indexes matching the lookups and keyset orders the repositories use"""
+        for repository in (self.customers, self.packages, self.customer_packages, self.appointments, self.payments):
+            await repository.collection.create_index("id", unique=True)
+            await repository.collection.create_index(repository._sort())
+        await self.customer_packages.collection.create_index("customer_id")
+        await self.appointments.collection.create_index([("customer_id", 1), ("date", -1)])
+        await self.payments.collection.create_index([("payment_date", -1)])
+        try:
+            await self.customers.collection.create_index("cpf", unique=True)
+        except OperationFailure as e:
+            # Duplicate CPFs already stored; resolve them by hand and restart
+            logger.warning("Could not create the unique CPF index: %s", e)
+        # Text index of search_customers; no stemming, these are names, emails and numbers
+        await self.customers.collection.create_index(
+            [("name", "text"), ("email", "text"), ("cpf", "text"), ("phone", "text")],
+            name="customers_search",
+            weights={"name": 10, "cpf": 5, "email": 3, "phone": 3},
+            default_language="none",
+        )
+
+    async def close(self):
+        self.db.client.close()
+
+    async def book_appointment(self, data: dict, appointment_id: Optional[str] = None) -> Optional[dict]:
+        """Overlap check followed by the write.
+
+        Without multi-document transactions nothing serializes two bookings
+        racing for the same slot; the check only narrows that window.
+        """
+        start = parse_time(data['time'])
+        record = to_document(dict(data, start_time=start, end_time=end_time_for(start, data['service_type'])))
+        query = {
+            "date": record['date'],
+            "status": {"$ne": "cancelled"},
+            "start_time": {"$lt": record['end_time']},
+            "end_time": {"$gt": record['start_time']},
+            "$or": [{"customer_id": record['customer_id']}, {"instructor": record['instructor']}],
+        }
+        if appointment_id is not None:
+            query["id"] = {"$ne": appointment_id}
+        overlapping = await self.appointments.collection.find(
+            query, {"_id": 0, "customer_id": 1, "instructor": 1, "service_type": 1}
+        ).to_list(None)
+        conflict = find_conflict(
+            [dict({"instructor": None}, **doc) for doc in overlapping],
+            data['customer_id'], data['instructor'], data['service_type'],
+        )
+        if conflict:
+            raise Conflict(conflict)
+        if appointment_id is None:
+            return await self.appointments.insert(record)
+        return await self.appointments.update(appointment_id, record)
+
+    async def search_customers(self, query: str, fields: List[str], limit: int) -> List[dict]:
+        """Ranked by the text index's score"""
+        projection = {field: 1 for field in stored_fields(CUSTOMERS, fields)}
+        projection.update({"_id": 0, "score": {"$meta": "textScore"}})
+        cursor = self.customers.collection.find({"$text": {"$search": query}}, projection)
+        return await cursor.sort([("score", {"$meta": "textScore"})]).limit(limit).to_list(limit)
+
+    async def inline_photo(self, customer_id: str) -> Optional[str]:
+        doc = await self.customers.collection.find_one({"id": customer_id}, {"_id": 0, "photo": 1})
+        return doc.get("photo") if doc else None
+
+    async def redeem_appointment(self, appointment_id: str) -> Optional[dict]:
+        """Without transactions the appointment is claimed first, by a conditional update;
+        when no session can be taken it is put back to scheduled.
+        """
+        appointment = await self.appointments.collection.find_one_and_update(
+            {"id": appointment_id, "status": "scheduled"}, {"$set": {"status": "completed"}},
+            self.appointments._projection(),
+        )
+        if appointment is None:
+            current = await self.appointments.get(appointment_id, ["status"])
+            if current is None:
+                return None
+            raise Conflict(f"Appointment is already {current['status']}")
+        customer_package = await self._use_package_session(appointment)
+        if customer_package is None:
+            await self.appointments.collection.update_one({"id": appointment_id}, {"$set": {"status": "scheduled"}})
+            raise Conflict(f"Customer has no active package valid on {appointment['date']} with sessions left")
+        return {"appointment": appointment, "customer_package": customer_package}
+
+    async def _use_package_session(self, appointment: dict) -> Optional[dict]:
+        """Take the session by compare-and-set on remaining_sessions, looking again when another check-in won.
+
+        Like USE_PACKAGE_SESSION, the customer's packages of this kind already
+        past their expiry date are flipped to expired first.
+        """
+        collection = self.customer_packages.collection
+        await collection.update_many({
+            "customer_id": appointment['customer_id'], "package_id": appointment['package_id'],
+            "status": "active", "expiry_date": {"$ne": None, "$lt": date.today().isoformat()},
+        }, {"$set": {"status": "expired"}})
+        query = {
+            "customer_id": appointment['customer_id'],
+            "package_id": appointment['package_id'],
+            "status": "active",
+            "$and": [
+                {"$or": [{"remaining_sessions": None}, {"remaining_sessions": {"$gt": 0}}]},
+                {"$or": [{"expiry_date": None}, {"expiry_date": {"$gte": appointment['date']}}]},
+            ],
+        }
+        while True:
+            candidates = await collection.find(query, self.customer_packages._projection()).to_list(None)
+            if not candidates:
+                return None
+            # Like the Postgres ORDER BY expiry_date NULLS LAST, purchase_date, id
+            package = min(candidates, key=lambda cp: (
+                cp.get('expiry_date') is None, cp.get('expiry_date') or "", cp['purchase_date'], cp['id']
+            ))
+            remaining = package.get('remaining_sessions')
+            if remaining is None:
+                # Unlimited package: nothing to take
+                return package
+            taken = {"remaining_sessions": remaining - 1}
+            if remaining <= 1:
+                taken["status"] = "exhausted"
+            claimed = await collection.find_one_and_update(
+                {"id": package['id'], "status": "active", "remaining_sessions": remaining}, {"$set": taken},
+                self.customer_packages._projection(),
+            )
+            if claimed is not None:
+                return dict(claimed, **taken)
+
+    async def customer_overview(self, customer_id: str, today: date, appointments: int) -> Optional[dict]:
+        customer = await self.customers.get(customer_id)
+        if customer is None:
+            return None
+        packages = await self.customer_packages.find(customer_id=customer_id)
+        by_id = {row['id']: row for row in await self.packages.get_many(list({cp['package_id'] for cp in packages}))}
+        for customer_package in packages:
+            customer_package['package'] = by_id.get(customer_package['package_id'])
+
+        collection = self.appointments.collection
+        day = today.isoformat()
+        upcoming = collection.find({"customer_id": customer_id, "date": {"$gte": day}}, self.appointments._projection())
+        recent = collection.find({"customer_id": customer_id, "date": {"$lt": day}}, self.appointments._projection())
+        totals = await self.payments.collection.aggregate([
+            {"$match": {"customer_package_id": {"$in": [cp['id'] for cp in packages]}}},
+            {"$group": {
+                "_id": None, "count": {"$sum": 1}, "total": {"$sum": "$amount"},
+                "last_payment_date": {"$max": "$payment_date"},
+            }},
+            {"$project": {"_id": 0}},
+        ]).to_list(1)
+        return {
+            "customer": customer,
+            "packages": packages,
+            "upcoming_appointments": await upcoming.sort([("date", 1), ("time", 1)]).limit(appointments).to_list(None),
+            "recent_appointments": await recent.sort([("date", -1), ("time", -1)]).limit(appointments).to_list(None),
+            "payments": totals[0] if totals else {"count": 0, "total": 0, "last_payment_date": None},
+        }
+
+    async def dashboard_stats(self) -> dict:
+        recent_payments = await self.db.payments.find({}, {"_id": 0}).sort("payment_date", -1).limit(5).to_list(5)
+        return {
+            "total_customers": await self.db.customers.estimated_document_count(),
+            "total_packages": await self.db.packages.estimated_document_count(),
+            "total_appointments": await self.db.appointments.estimated_document_count(),
+            "active_customer_packages": await self.db.customer_packages.count_documents({"status": "active"}),
+            "today_appointments": await self.db.appointments.count_documents({"date": date.today().isoformat()}),
+            "recent_payments": recent_payments,
+        }
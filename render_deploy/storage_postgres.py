@@ -0,0 +1,656 @@
+"""Postgres implementation of the storage layer, on one shared asyncpg pool"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+import asyncpg
+from fastapi import HTTPException
+
+import metrics
+import queries
+from batching import GroupCommit
+from migrations import run_migrations
+from queries import STATEMENTS, check_statements, prepare_statements
+from scheduling import end_time_for, find_conflict, parse_time
+from storage import (
+    APPOINTMENTS, CUSTOMER_PACKAGES, CUSTOMERS, DB_POOL_ACQUIRE_TIMEOUT, DB_POOL_MAX_SIZE, DB_POOL_MIN_SIZE,
+    EXPORT_BATCH_SIZE, FILTER_OPERATORS, PACKAGES, PAYMENTS, Conflict, Entity, Repository, Storage, decode_cursor, encode_cursor,
+    relation_keys, stored_fields,
+)
+
+# Prepared statements cached per pooled connection, on top of those declared in queries.py
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', '100'))
+
+# Milliseconds new appointments and payments wait to be written together in one
+# transaction (group commit); 0 writes each on its own
+WRITE_BATCH_WINDOW_MS = float(os.environ.get('WRITE_BATCH_WINDOW_MS', '0'))
+# Rows written by one group commit; a batch this big is written without waiting out the window
+WRITE_BATCH_MAX_ROWS = int(os.environ.get('WRITE_BATCH_MAX_ROWS', '100'))
+
+# LISTEN/NOTIFY channel carrying changes between workers
+NOTIFY_CHANNEL = "fitmanager_changes"
+# Seconds before reconnecting a lost listener, doubled after each failed attempt up to the maximum
+LISTEN_RETRY_DELAY = 1.0
+LISTEN_RETRY_MAX_DELAY = 30.0
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    """Counters describing how long requests wait for a pooled connection"""
+
+    def __init__(self):
+        self.acquired = 0
+        self.timeouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_acquire(self, wait: float):
+        self.acquired += 1
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def record_release(self):
+        self.in_use -= 1
+
+    def snapshot(self, pool: Optional[asyncpg.Pool]):
+        size = pool.get_size() if pool else 0
+        idle = pool.get_idle_size() if pool else 0
+        return {
+            "min_size": DB_POOL_MIN_SIZE,
+            "max_size": DB_POOL_MAX_SIZE,
+            "size": size,
+            "idle": idle,
+            "in_use": self.in_use,
+            "peak_in_use": self.peak_in_use,
+            "saturation": round(self.in_use / DB_POOL_MAX_SIZE, 3) if DB_POOL_MAX_SIZE else 0,
+            "acquired": self.acquired,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(self.total_wait / self.acquired * 1000, 3) if self.acquired else 0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+def status_rows(status: str) -> int:
+    """Row count of a command status such as ``UPDATE 3`` or ``COPY 500``"""
+    count = status.rsplit(" ", 1)[-1] if status else ""
+    return int(count) if count.isdigit() else 0
+
+
+class TimedConnection(asyncpg.Connection):
+    """Pooled connection reporting the time and rows of every call to metrics.py.
+
+    ``label`` names the statement in the metrics instead of its SQL text;
+    queries.py passes the name it declared the statement under.
+    """
+
+    async def fetch(self, query, *args, label=None, **kwargs):
+        with metrics.query_timer(query, label) as result:
+            rows = await super().fetch(query, *args, **kwargs)
+            result.rows = len(rows)
+        return rows
+
+    async def fetchrow(self, query, *args, label=None, **kwargs):
+        with metrics.query_timer(query, label) as result:
+            row = await super().fetchrow(query, *args, **kwargs)
+            result.rows = int(row is not None)
+        return row
+
+    async def fetchval(self, query, *args, label=None, **kwargs):
+        with metrics.query_timer(query, label) as result:
+            value = await super().fetchval(query, *args, **kwargs)
+            result.rows = int(value is not None)
+        return value
+
+    async def execute(self, query, *args, label=None, **kwargs):
+        with metrics.query_timer(query, label) as result:
+            status = await super().execute(query, *args, **kwargs)
+            result.rows = status_rows(status)
+        return status
+
+    async def executemany(self, command, args, **kwargs):
+        with metrics.query_timer(command) as result:
+            await super().executemany(command, args, **kwargs)
+            result.rows = len(args)
+
+    async def copy_records_to_table(self, table_name, **kwargs):
+        with metrics.query_timer(f"COPY {table_name}") as result:
+            status = await super().copy_records_to_table(table_name, **kwargs)
+            result.rows = status_rows(status)
+        return status
+
+    async def prepare_cached(self, query: str):
+        """Parse ``query`` into the statement cache, where fetch/execute with arguments find it.
+
+        Unlike ``prepare()``, whose statements die with the pool checkout
+        they were made in, the cache lives as long as the connection.
+        executemany() prepares through the cache and, given no arguments,
+        runs nothing; it is called untimed, as nothing is executed.
+        """
+        await asyncpg.Connection.executemany(self, query, [])
+
+
+class PostgresRepository(Repository):
+    """Table-backed repository; the ``*_with`` variants run on a connection the caller already holds"""
+
+    def __init__(self, storage: "PostgresStorage", entity: Entity, batched: bool = False):
+        super().__init__(entity)
+        self.storage = storage
+        # Inserts go through a group commit when the storage batches writes
+        self.batch = storage.group_commit(entity.name, self._insert_many, self._insert_one) if batched else None
+
+    def _columns(self, fields: Optional[List[str]], expand: Optional[List[str]] = None) -> str:
+        columns = stored_fields(self.entity, fields)
+        if columns is None:
+            return queries.COLUMNS[self.entity.name]
+        return ", ".join(dict.fromkeys(columns + relation_keys(self.entity, expand)))
+
+    async def insert_with(self, conn, data: dict) -> dict:
+        columns = ", ".join(data)
+        placeholders = ", ".join(f"${i + 1}" for i in range(len(data)))
+        try:
+            row = await conn.fetchrow(
+                f"INSERT INTO {self.entity.name} ({columns}) VALUES ({placeholders}) "
+                f"RETURNING {queries.COLUMNS[self.entity.name]}", *data.values(),
+                label=f"{self.entity.name}.insert",
+            )
+        except asyncpg.UniqueViolationError as e:
+            raise Conflict(e.detail or str(e))
+        return dict(row)
+
+    async def insert_many_with(self, conn, rows: List[dict]) -> List[dict]:
+        """COPY the rows in, then read them back for their defaults; returned in the order given"""
+        columns = list(rows[0])
+        try:
+            await conn.copy_records_to_table(
+                self.entity.name, records=[[row.get(column) for column in columns] for row in rows], columns=columns
+            )
+        except asyncpg.UniqueViolationError as e:
+            raise Conflict(e.detail or str(e))
+        inserted = await queries.fetch(conn, queries.BY_IDS[self.entity.name], [row['id'] for row in rows])
+        by_id = {row.id: row.model_dump(exclude_unset=True) for row in inserted}
+        return [by_id[row['id']] for row in rows]
+
+    async def insert(self, data: dict) -> dict:
+        if self.batch is not None:
+            return await self.batch.submit(data)
+        return await self._insert_one(data)
+
+    async def _insert_one(self, data: dict) -> dict:
+        async with self.storage.acquire() as conn:
+            return await self.insert_with(conn, data)
+
+    async def _insert_many(self, rows: List[dict]) -> List[dict]:
+        async with self.storage.acquire() as conn:
+            async with conn.transaction():
+                return await self.insert_many_with(conn, rows)
+
+    async def insert_bulk(self, rows: List[dict]) -> List[Optional[str]]:
+        """COPY the rows in one transaction; if COPY refuses them, insert them one by one to isolate the bad rows"""
+        columns = list(rows[0])
+        records = [[row.get(column) for column in columns] for row in rows]
+        async with self.storage.acquire() as conn:
+            try:
+                async with conn.transaction():
+                    await conn.copy_records_to_table(self.entity.name, records=records, columns=columns)
+                return [None] * len(rows)
+            except asyncpg.PostgresError:
+                pass
+
+            placeholders = ", ".join(f"${i + 1}" for i in range(len(columns)))
+            insert = f"INSERT INTO {self.entity.name} ({', '.join(columns)}) VALUES ({placeholders})"
+            errors = []
+            for record in records:
+                try:
+                    async with conn.transaction():
+                        await conn.execute(insert, *record, label=f"{self.entity.name}.import")
+                    errors.append(None)
+                except asyncpg.UniqueViolationError as e:
+                    errors.append(e.detail or str(e))
+                except asyncpg.PostgresError as e:
+                    errors.append(str(e))
+        return errors
+
+    async def get(self, id: str, fields: Optional[List[str]] = None) -> Optional[dict]:
+        columns = self._columns(fields)
+        async with self.storage.acquire() as conn:
+            if fields is None:
+                row = await queries.fetchrow(conn, queries.BY_ID[self.entity.name], id)
+                return row.model_dump(exclude_unset=True) if row else None
+            row = await conn.fetchrow(
+                f"SELECT {columns} FROM {self.entity.name} WHERE id = $1", id, label=f"{self.entity.name}.get"
+            )
+        return dict(row) if row else None
+
+    async def get_many(self, ids: List[str]) -> List[dict]:
+        async with self.storage.acquire() as conn:
+            rows = await queries.fetch(conn, queries.BY_IDS[self.entity.name], ids)
+        return [row.model_dump(exclude_unset=True) for row in rows]
+
+    async def find(self, **equals) -> List[dict]:
+        where = " AND ".join(f"{field} = ${i + 1}" for i, field in enumerate(equals))
+        order_by = ", ".join(f"{column} DESC" for column in self.entity.order)
+        async with self.storage.acquire() as conn:
+            rows = await conn.fetch(
+                f"SELECT {queries.COLUMNS[self.entity.name]} FROM {self.entity.name} WHERE {where} ORDER BY {order_by}",
+                *equals.values(),
+                label=f"{self.entity.name}.find",
+            )
+        return [dict(row) for row in rows]
+
+    async def page(self, limit: int, cursor: Optional[str] = None, fields: Optional[List[str]] = None,
+                   filters: Optional[List[tuple]] = None, expand: Optional[List[str]] = None):
+        """Keyset page: a row-value comparison on the order keys instead of OFFSET.
+
+        Relations are LEFT JOINed onto the page once it is cut, so only the
+        rows returned are looked up, and come back as one jsonb column each.
+        """
+        order = self.entity.order
+        args = []
+        conditions = []
+        for field, operator, value in filters or []:
+            if operator not in FILTER_OPERATORS:
+                raise ValueError(f"Unsupported filter operator {operator!r}")
+            args.append(value)
+            conditions.append(f"{field} {operator} ${len(args)}")
+        if cursor:
+            values = decode_cursor(cursor, *self.entity.parsers)
+            placeholders = ", ".join(f"${len(args) + i + 1}" for i in range(len(order)))
+            conditions.append(f"({', '.join(order)}) < ({placeholders})")
+            args.extend(values)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        args.append(limit + 1)
+        order_by = ", ".join(f"{column} DESC" for column in order)
+        query = (
+            f"SELECT {self._columns(fields, expand)} FROM {self.entity.name} {where} "
+            f"ORDER BY {order_by} LIMIT ${len(args)}"
+        )
+        if expand:
+            selected = ", ".join(f"to_jsonb({name}) AS {name}" for name in expand)
+            joins = []
+            for name in expand:
+                key, related = self.entity.relations[name]
+                joins.append(
+                    f"LEFT JOIN (SELECT {queries.COLUMNS[related.name]} FROM {related.name}) AS {name} "
+                    f"ON {name}.id = page.{key}"
+                )
+            order_by = ", ".join(f"page.{column} DESC" for column in order)
+            query = f"SELECT page.*, {selected} FROM ({query}) AS page {' '.join(joins)} ORDER BY {order_by}"
+        async with self.storage.acquire() as conn:
+            rows = await conn.fetch(query, *args, label=f"{self.entity.name}.page")
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(*(rows[-1][column] for column in order))
+        rows = [dict(row) for row in rows]
+        for row in rows:
+            for name in expand or []:
+                if row[name] is not None:
+                    row[name] = json.loads(row[name])
+        return rows, next_cursor
+
+    async def update_with(self, conn, id: str, data: dict) -> Optional[dict]:
+        assignments = ", ".join(f"{column} = ${i + 2}" for i, column in enumerate(data))
+        try:
+            row = await conn.fetchrow(
+                f"UPDATE {self.entity.name} SET {assignments} WHERE id = $1 "
+                f"RETURNING {queries.COLUMNS[self.entity.name]}", id, *data.values(),
+                label=f"{self.entity.name}.update",
+            )
+        except asyncpg.UniqueViolationError as e:
+            raise Conflict(e.detail or str(e))
+        return dict(row) if row else None
+
+    async def update(self, id: str, data: dict) -> Optional[dict]:
+        async with self.storage.acquire() as conn:
+            return await self.update_with(conn, id, data)
+
+    async def delete(self, id: str) -> bool:
+        async with self.storage.acquire() as conn:
+            result = await queries.execute(conn, queries.DELETE_BY_ID[self.entity.name], id)
+        return result != 'DELETE 0'
+
+
+    async def export(self, fields: List[str], date_field: str, date_from: Optional[date] = None,
+                     date_to: Optional[date] = None):
+        """Server-side cursor; the connection stays borrowed until the last row has been read.
+
+        asyncpg Records are yielded as they are, read like dicts.
+        """
+        conditions = []
+        args = []
+        if date_from:
+            args.append(date_from)
+            conditions.append(f"{date_field} >= ${len(args)}")
+        if date_to:
+            # Upper bound is exclusive on the next day so it also works for timestamp columns
+            args.append(date_to + timedelta(days=1))
+            conditions.append(f"{date_field} < ${len(args)}")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"SELECT {', '.join(fields)} FROM {self.entity.name} {where} ORDER BY {date_field}, id"
+        async with self.storage.acquire() as conn:
+            async with conn.transaction():
+                async for record in conn.cursor(query, *args, prefetch=EXPORT_BATCH_SIZE):
+                    yield record
+
+
+class PackageRepository(PostgresRepository):
+    async def update(self, id: str, data: dict) -> Optional[dict]:
+        async with self.storage.acquire() as conn:
+            async with conn.transaction():
+                row = await self.update_with(conn, id, data)
+                if row:
+                    # Revenue rollups are keyed by package type, which may have just changed
+                    await queries.execute(conn, queries.MARK_PACKAGE_REVENUE_DIRTY, id)
+        return row
+
+
+def search_terms(query: str) -> tuple:
+    """Normalise a search box value into the trigram text and the tsquery prefix terms.
+
+    Anything that looks like a CPF or phone number is reduced to digits, the
+    form the search columns store them in.
+    """
+    query = query.strip().lower()
+    if re.fullmatch(r"[\d\s.()/+-]+", query):
+        query = re.sub(r"\D", "", query)
+    words = re.findall(r"\w+", query)
+    return query, " & ".join(f"{word}:*" for word in words)
+
+
+def schedule_keys(day, customer_id: str, instructor: Optional[str]) -> set:
+    return {f"appointments:{day}:customer:{customer_id}", f"appointments:{day}:instructor:{instructor or ''}"}
+
+
+async def lock_schedule(conn, day, customer_id: str, instructor: Optional[str]):
+    """Serialize bookings that could collide: same instructor or same customer on the same day"""
+    for key in sorted(schedule_keys(day, customer_id, instructor)):
+        await queries.execute(conn, queries.LOCK_SCHEDULE_KEY, key)
+
+
+def overlaps(booked: dict, record: dict) -> bool:
+    """Whether two bookings of the same day share time and a customer or an instructor"""
+    return (
+        booked['date'] == record['date']
+        and booked['start_time'] < record['end_time'] and booked['end_time'] > record['start_time']
+        and (booked['customer_id'] == record['customer_id'] or booked['instructor'] == record['instructor'])
+    )
+
+
+class PostgresStorage(Storage):
+    def __init__(self, dsn: Optional[str], on_change=None, write_batch_window_ms: float = WRITE_BATCH_WINDOW_MS):
+        super().__init__(on_change)
+        self.dsn = dsn
+        self.pool: Optional[asyncpg.Pool] = None
+        self.listener: Optional[asyncpg.Connection] = None
+        self.listen_callbacks = None
+        self.reconnecting: Optional[asyncio.Task] = None
+        self.pool_stats = PoolStats()
+        self.statements_checked = False
+        self.write_batch_window_ms = write_batch_window_ms
+        self.batches: List[GroupCommit] = []
+        self.customers = PostgresRepository(self, CUSTOMERS)
+        self.packages = PackageRepository(self, PACKAGES)
+        self.customer_packages = PostgresRepository(self, CUSTOMER_PACKAGES)
+        self.appointments = PostgresRepository(self, APPOINTMENTS)
+        self.payments = PostgresRepository(self, PAYMENTS, batched=True)
+        self.bookings = self.group_commit("appointments", self._book_many, self._book_one)
+
+    def group_commit(self, name: str, write_batch, write_one) -> Optional[GroupCommit]:
+        """A GroupCommit for one kind of write, or None when WRITE_BATCH_WINDOW_MS is 0"""
+        if not self.write_batch_window_ms:
+            return None
+        batch = GroupCommit(name, write_batch, write_one, self.write_batch_window_ms / 1000, WRITE_BATCH_MAX_ROWS)
+        self.batches.append(batch)
+        return batch
+
+    async def open(self):
+        """Create the shared connection pool used by every request"""
+        self.pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE + len(STATEMENTS),
+            connection_class=TimedConnection,
+            init=self._init_connection,
+        )
+        metrics.DB_POOL_CONNECTIONS.function = self.pool_connections
+
+    async def _init_connection(self, conn):
+        # Before migrate() checked them the tables may not exist yet; such
+        # connections prepare each statement on its first use instead
+        if self.statements_checked:
+            await prepare_statements(conn)
+
+    async def migrate(self):
+        async with self.pool.acquire() as conn:
+            await run_migrations(conn)
+            await check_statements(conn)
+        self.statements_checked = True
+        # Reopen the connections made so far, so that init prepares them too
+        await self.pool.expire_connections()
+
+    async def close(self):
+        for batch in self.batches:
+            await batch.drain()
+        # Cleared first, so that closing the listener is not taken for losing it
+        self.listen_callbacks = None
+        if self.reconnecting is not None:
+            self.reconnecting.cancel()
+            self.reconnecting = None
+        if self.listener is not None:
+            listener, self.listener = self.listener, None
+            await listener.close()
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def pool_connections(self) -> dict:
+        if self.pool is None:
+            return {}
+        idle = self.pool.get_idle_size()
+        return {("idle",): idle, ("in_use",): self.pool.get_size() - idle}
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Borrow a pooled connection, recording how long the request waited for it"""
+        if self.pool is None:
+            raise HTTPException(status_code=503, detail="Database not available")
+        started = time.perf_counter()
+        try:
+            conn = await self.pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.pool_stats.timeouts += 1
+            metrics.DB_POOL_TIMEOUTS.inc()
+            raise HTTPException(status_code=503, detail="Database busy, try again")
+        wait = time.perf_counter() - started
+        self.pool_stats.record_acquire(wait)
+        metrics.DB_POOL_WAIT.observe(wait)
+        try:
+            yield conn
+        finally:
+            self.pool_stats.record_release()
+            await self.pool.release(conn)
+
+    async def book_appointment(self, data: dict, appointment_id: Optional[str] = None) -> Optional[dict]:
+        """The overlap check and the write run under transaction-scoped advisory locks,
+        so two front desks booking the last place in a class cannot both succeed.
+        """
+        start = parse_time(data['time'])
+        end = end_time_for(start, data['service_type'])
+        record = dict(data, start_time=start, end_time=end)
+        if appointment_id is None and self.bookings is not None:
+            return await self.bookings.submit(record)
+        return await self._book_one(record, appointment_id)
+
+    async def _book_one(self, record: dict, appointment_id: Optional[str] = None) -> Optional[dict]:
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                await lock_schedule(conn, record['date'], record['customer_id'], record['instructor'])
+                overlapping = await queries.fetch(
+                    conn, queries.OVERLAPPING_APPOINTMENTS, record['date'], record['start_time'], record['end_time'],
+                    record['customer_id'], record['instructor'], appointment_id or '',
+                )
+                conflict = find_conflict(overlapping, record['customer_id'], record['instructor'], record['service_type'])
+                if conflict:
+                    raise Conflict(conflict)
+                if appointment_id is None:
+                    return await self.appointments.insert_with(conn, record)
+                return await self.appointments.update_with(conn, appointment_id, record)
+
+    async def _book_many(self, records: List[dict]) -> list:
+        """Book a group commit of new appointments: one lock statement, one overlap query, one COPY.
+
+        Each booking is checked against the stored ones and against those
+        accepted before it in the batch, so the outcome is the one the
+        bookings would have had one after another. Refused bookings get
+        their Conflict back, the others their stored row.
+        """
+        keys = sorted(set().union(*(
+            schedule_keys(record['date'], record['customer_id'], record['instructor']) for record in records
+        )))
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                await queries.execute(conn, queries.LOCK_SCHEDULE_KEYS, keys)
+                rows = await queries.fetch(conn, queries.OVERLAPPING_APPOINTMENTS_OF_BATCH, *(
+                    [record[column] for record in records]
+                    for column in ('date', 'start_time', 'end_time', 'customer_id', 'instructor')
+                ))
+                overlapping = {}
+                for row in rows:
+                    overlapping.setdefault(row['n'] - 1, []).append(row)
+                results, accepted = [], []
+                for i, record in enumerate(records):
+                    booked = overlapping.get(i, []) + [other for other in accepted if overlaps(other, record)]
+                    conflict = find_conflict(booked, record['customer_id'], record['instructor'], record['service_type'])
+                    if conflict:
+                        results.append(Conflict(conflict))
+                    else:
+                        accepted.append(record)
+                        results.append(record)
+                if accepted:
+                    stored = iter(await self.appointments.insert_many_with(conn, accepted))
+                    results = [result if isinstance(result, Conflict) else next(stored) for result in results]
+        return results
+
+    async def redeem_appointment(self, appointment_id: str) -> Optional[dict]:
+        """The appointment row stays locked until the session is taken, which is
+        a single conditional UPDATE (USE_PACKAGE_SESSION)
+        """
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                appointment = await queries.fetchrow(conn, queries.APPOINTMENT_FOR_CHECK_IN, appointment_id)
+                if not appointment:
+                    return None
+                if appointment['status'] != 'scheduled':
+                    raise Conflict(f"Appointment is already {appointment['status']}")
+                customer_package = await queries.fetchrow(
+                    conn, queries.USE_PACKAGE_SESSION,
+                    appointment['customer_id'], appointment['package_id'], appointment['date'],
+                )
+                if not customer_package:
+                    raise Conflict(f"Customer has no active package valid on {appointment['date']} with sessions left")
+                await queries.execute(conn, queries.COMPLETE_APPOINTMENT, appointment_id)
+        return {"appointment": dict(appointment), "customer_package": customer_package.model_dump()}
+
+    async def customer_overview(self, customer_id: str, today: date, appointments: int) -> Optional[dict]:
+        """Everything in a single round trip (CUSTOMER_OVERVIEW)"""
+        async with self.acquire() as conn:
+            row = await queries.fetchrow(conn, queries.CUSTOMER_OVERVIEW, customer_id, today, appointments)
+        if not row:
+            return None
+        customer = dict(row)
+        overview = {
+            key: json.loads(customer.pop(key))
+            for key in ("packages", "upcoming_appointments", "recent_appointments", "payments")
+        }
+        return dict(overview, customer=customer)
+
+    async def listen(self, callback, on_missed=None):
+        """LISTEN on a connection of its own, outside the pool, for as long as the app runs.
+
+        A lost connection is reopened in the background, retrying with
+        backoff; ``on_missed`` runs when it drops and again once it is back,
+        since other workers' notifications sent in between never arrive.
+        """
+        self.listen_callbacks = (callback, on_missed)
+        await self._connect_listener()
+
+    async def _connect_listener(self):
+        callback, _ = self.listen_callbacks
+        listener = await asyncpg.connect(self.dsn)
+        listener.add_termination_listener(self._listener_lost)
+        await listener.add_listener(NOTIFY_CHANNEL, lambda conn, pid, channel, payload: callback(payload))
+        self.listener = listener
+
+    def _listener_lost(self, conn):
+        if conn is not self.listener or self.listen_callbacks is None:
+            return
+        logger.warning("Change listener disconnected; reconnecting")
+        self.listener = None
+        self._changes_missed()
+        self.reconnecting = asyncio.get_running_loop().create_task(self._reconnect_listener())
+
+    async def _reconnect_listener(self):
+        delay = LISTEN_RETRY_DELAY
+        while self.listen_callbacks is not None:
+            await asyncio.sleep(delay)
+            try:
+                await self._connect_listener()
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError, asyncio.TimeoutError) as e:
+                delay = min(delay * 2, LISTEN_RETRY_MAX_DELAY)
+                logger.warning("Could not reconnect the change listener, retrying in %.0fs: %s", delay, e)
+                continue
+            logger.info("Change listener reconnected")
+            self._changes_missed()
+            break
+        self.reconnecting = None
+
+    def _changes_missed(self):
+        _, on_missed = self.listen_callbacks
+        if on_missed is not None:
+            on_missed()
+
+    async def notify(self, payload: str):
+        async with self.acquire() as conn:
+            await queries.execute(conn, queries.NOTIFY, NOTIFY_CHANNEL, payload)
+
+    async def search_customers(self, query: str, fields: List[str], limit: int) -> List[dict]:
+        """Word prefixes ("mar sil" finds "Maria Silva") match through the tsvector
+        index, typos and substrings of digits through the trigram index (migration 9).
+        """
+        text, prefix_query = search_terms(query)
+        if not text:
+            return []
+        columns = ", ".join(stored_fields(CUSTOMERS, fields))
+        async with self.acquire() as conn:
+            rows = await conn.fetch(f'''
+                SELECT {columns} FROM customers
+                WHERE search_vector @@ to_tsquery('simple', $2) OR $1 <% search_text
+                ORDER BY ts_rank(search_vector, to_tsquery('simple', $2)) + word_similarity($1, search_text) DESC, name
+                LIMIT $3
+            ''', text, prefix_query, limit, label="customers.search")
+        return [dict(row) for row in rows]
+
+    async def inline_photo(self, customer_id: str) -> Optional[str]:
+        async with self.acquire() as conn:
+            return await queries.fetchval(conn, queries.CUSTOMER_INLINE_PHOTO, customer_id)
+
+    async def dashboard_stats(self) -> dict:
+        """All dashboard numbers in a single round trip, read from the trigger-maintained counters"""
+        async with self.acquire() as conn:
+            row = await queries.fetchrow(conn, queries.DASHBOARD_STATS, datetime.now().date())
+        stats = dict(row)
+        stats['recent_payments'] = json.loads(stats['recent_payments'])
+        return stats
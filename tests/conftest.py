@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The API modules are imported the way server.py imports them, as top-level modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "render_deploy"))
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import random
+import uuid
+from datetime import date, timedelta
+
+import pytest
+
+from batching import GroupCommit
+from storage import Conflict
+
+
+def recording_group_commit(window: float = 0.01, max_size: int = 100, fail_batches: bool = False):
+    batches = []
+
+    async def write_batch(items):
+        batches.append(items)
+        if fail_batches:
+            raise RuntimeError("statement failed")
+        return [ValueError(item) if item < 0 else item * 10 for item in items]
+
+    async def write_one(item):
+        if item < 0:
+            raise ValueError(item)
+        return item * 10
+
+    return GroupCommit("test", write_batch, write_one, window, max_size), batches
+
+
+async def submit_all(batch: GroupCommit, items) -> list:
+    return await asyncio.gather(*(batch.submit(item) for item in items), return_exceptions=True)
+
+
+def test_concurrent_writes_share_one_batch():
+    async def run():
+        batch, batches = recording_group_commit()
+        return await submit_all(batch, [1, -2, 3]), batches
+
+    results, batches = asyncio.run(run())
+    assert batches == [[1, -2, 3]]
+    assert results[0] == 10 and results[2] == 30
+    assert isinstance(results[1], ValueError)
+
+
+def test_full_batch_is_written_without_waiting_out_the_window():
+    async def run():
+        batch, batches = recording_group_commit(window=10, max_size=2)
+        results = await asyncio.wait_for(submit_all(batch, [1, 2]), 1)
+        # A lone item waits for the window; drain writes it now
+        lone = asyncio.ensure_future(batch.submit(3))
+        await asyncio.sleep(0)
+        await batch.drain()
+        return results, await lone, batches
+
+    results, lone, batches = asyncio.run(run())
+    assert results == [10, 20] and lone == 30
+    assert batches == [[1, 2], [3]]
+
+
+def test_failed_batch_is_retried_one_by_one():
+    async def run():
+        batch, _ = recording_group_commit(fail_batches=True)
+        return await submit_all(batch, [1, -2])
+
+    results = asyncio.run(run())
+    assert results[0] == 10 and isinstance(results[1], ValueError)
+
+
+def test_batched_bookings_and_payments_on_postgres():
+    dsn = os.environ.get("TEST_DATABASE_URL")
+    if not dsn:
+        pytest.skip("TEST_DATABASE_URL not set")
+    from storage_postgres import PostgresStorage
+
+    day = date(2090, 1, 1) + timedelta(days=random.randrange(3000))
+    customer, instructor = uuid.uuid4().hex, uuid.uuid4().hex
+
+    def booking(customer_id, time, instructor=None):
+        return {
+            "id": str(uuid.uuid4()), "customer_id": customer_id, "package_id": "p1", "date": day, "time": time,
+            "service_type": "Pilates", "instructor": instructor, "notes": None,
+        }
+
+    async def run():
+        storage = PostgresStorage(dsn, write_batch_window_ms=20)
+        await storage.open()
+        await storage.migrate()
+        try:
+            bookings = await asyncio.gather(
+                # The customer twice at 09:00, and twice with the instructor at 10:00 (capacity 1)
+                storage.book_appointment(booking(customer, "09:00")),
+                storage.book_appointment(booking(customer, "09:30")),
+                storage.book_appointment(booking(uuid.uuid4().hex, "10:00", instructor)),
+                storage.book_appointment(booking(uuid.uuid4().hex, "10:00", instructor)),
+                storage.book_appointment(booking(customer, "12:00")),
+                return_exceptions=True,
+            )
+            payment = await storage.payments.insert({
+                "id": str(uuid.uuid4()), "customer_package_id": uuid.uuid4().hex, "amount": 90.0,
+                "payment_date": day, "payment_method": "pix", "notes": None,
+            })
+        finally:
+            await storage.close()
+        return bookings, payment
+
+    bookings, payment = asyncio.run(run())
+    assert [type(result) for result in bookings] == [dict, Conflict, dict, Conflict, dict]
+    assert bookings[0]["status"] == "scheduled" and bookings[0]["created_at"] is not None
+    assert str(bookings[4]["end_time"]) == "13:00:00"
+    assert payment["created_at"] is not None
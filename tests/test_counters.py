@@ -0,0 +1,92 @@
+import asyncio
+import os
+import random
+import uuid
+from datetime import date, timedelta
+
+import pytest
+
+from counters import reconcile_counters
+
+
+def postgres_dsn() -> str:
+    dsn = os.environ.get("TEST_DATABASE_URL")
+    if not dsn:
+        pytest.skip("TEST_DATABASE_URL not set")
+    return dsn
+
+
+def customer() -> dict:
+    return {
+        "id": str(uuid.uuid4()), "name": "Ana Souza", "cpf": uuid.uuid4().hex[:14], "email": "ana@example.com",
+        "phone": "11999990000", "address": "Rua A, 1", "birth_date": date(1990, 5, 17),
+    }
+
+
+def appointment(customer_id: str, day: date) -> dict:
+    return {
+        "id": str(uuid.uuid4()), "customer_id": customer_id, "package_id": str(uuid.uuid4()), "date": day,
+        "time": "09:00", "service_type": "pilates",
+    }
+
+
+def customer_package(customer_id: str) -> dict:
+    return {
+        "id": str(uuid.uuid4()), "customer_id": customer_id, "package_id": str(uuid.uuid4()),
+        "purchase_date": date(2090, 1, 1), "amount_paid": 90, "payment_method": "pix",
+    }
+
+
+def test_counters_follow_multi_row_writes_and_deletes():
+    from storage_postgres import PostgresStorage
+
+    # Far from the days the other tests book on
+    day = date(2090, 1, 1) + timedelta(days=20000 + random.randrange(3000))
+    moved_to = day + timedelta(days=1)
+
+    async def counters(conn) -> dict:
+        values = {row['name']: row['value'] for row in await conn.fetch('SELECT name, value FROM stats_counters')}
+        for d in (day, moved_to):
+            values[d] = await conn.fetchval(
+                "SELECT COALESCE(SUM(value), 0) FROM stats_daily_counters WHERE name = 'appointments' AND day = $1", d
+            )
+        return values
+
+    async def run():
+        storage = PostgresStorage(postgres_dsn())
+        await storage.open()
+        try:
+            await storage.migrate()
+            async with storage.acquire() as conn:
+                before = await counters(conn)
+            customers = [customer() for _ in range(3)]
+            appointments = [appointment(customers[0]["id"], day) for _ in range(4)]
+            packages = [customer_package(customers[0]["id"]) for _ in range(3)]
+            # COPY: one statement, one trigger run per table
+            assert await storage.customers.insert_bulk(customers) == [None] * 3
+            assert await storage.appointments.insert_bulk(appointments) == [None] * 4
+            assert await storage.customer_packages.insert_bulk(packages) == [None] * 3
+            async with storage.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute('DELETE FROM customers WHERE id = ANY($1)', [c["id"] for c in customers[:2]])
+                    await conn.execute(
+                        'UPDATE appointments SET date = $2 WHERE id = $1', appointments[0]["id"], moved_to
+                    )
+                    await conn.execute(
+                        'DELETE FROM appointments WHERE id = ANY($1)', [a["id"] for a in appointments[1:3]]
+                    )
+                    await conn.execute("UPDATE customer_packages SET status = 'expired' WHERE id = $1", packages[0]["id"])
+                    await conn.execute('DELETE FROM customer_packages WHERE id = ANY($1)', [p["id"] for p in packages[1:]])
+                after = await counters(conn)
+                drift = await reconcile_counters(conn, dry_run=True)
+            return before, after, drift
+        finally:
+            await storage.close()
+
+    before, after, drift = asyncio.run(run())
+    delta = {name: after[name] - before[name] for name in after}
+    assert delta["customers"] == 1
+    assert delta["appointments"] == 2
+    assert delta["active_customer_packages"] == 0
+    assert delta[day] == 1 and delta[moved_to] == 1
+    assert not {name for name in drift if name in (f"appointments:{day}", f"appointments:{moved_to}")}
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import os
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+import routes
+from events import EventBus, change_event
+
+
+def received(subscription) -> list:
+    events = []
+    while not subscription.queue.empty():
+        events.append(subscription.queue.get_nowait().decode().split("\n")[1])
+    return events
+
+
+def test_slow_subscriber_is_reset_without_slowing_others():
+    bus = EventBus("w1", queue_size=2)
+    slow, fast = bus.subscribe(), bus.subscribe(["appointments"])
+    for n in range(3):
+        bus.publish(change_event("appointments", "created", str(n)))
+        received(fast)
+    assert received(slow) == ["event: reset"]
+    assert slow not in bus.subscribers and fast in bus.subscribers
+    bus.publish(change_event("payments", "created", "p"))
+    assert received(fast) == []
+
+
+def test_reconnect_resumes_or_resets():
+    bus = EventBus("w1", queue_size=2)
+    for n in range(3):
+        bus.publish(change_event("customers", "created", str(n)))
+    assert received(bus.subscribe(last_event_id="w1-2")) == ["event: change"]
+    # w1-1 is older than the history kept, w2-3 was numbered by another worker
+    assert received(bus.subscribe(last_event_id="w1-0")) == ["event: reset"]
+    assert received(bus.subscribe(last_event_id="w2-3")) == ["event: reset"]
+
+
+def test_stream_sends_heartbeats_and_ends_at_max_age():
+    async def stream():
+        bus = EventBus("w1")
+        subscription = bus.subscribe()
+        chunks = [chunk async for chunk in subscription.stream(heartbeat=0.01, max_age=0.035)]
+        return chunks, bus.subscribers
+
+    chunks, subscribers = asyncio.run(stream())
+    assert chunks[0].startswith(b"retry:")
+    assert set(chunks[1:]) == {b": ping\n\n"}
+    assert not subscribers
+
+
+def test_large_rows_are_sent_without_data():
+    assert "data" not in change_event("customers", "updated", "c1", {"notes": "x" * 10000})
+    assert change_event("customers", "updated", "c1", {"notes": "x"})["data"] == {"notes": "x"}
+
+
+def test_other_workers_changes_reach_the_apps_caches():
+    calls = []
+    storage = SimpleNamespace(on_change=lambda table, **keys: calls.append((table, keys)))
+    event = change_event("appointments", "updated", "a1")
+    message = {"event": event, "keys": {"customer_id": "c1", "day": "2090-01-02"}}
+
+    routes.change_received(storage, json.dumps(dict(message, origin=routes.WORKER_ID)))
+    assert calls == []
+    routes.change_received(storage, json.dumps(dict(message, origin="another worker")))
+    assert calls == [("appointments", {"customer_id": "c1", "day": date(2090, 1, 2)})]
+
+    # A rescheduled appointment: the customer and day it left are stale too
+    previous = {"customer_id": "c0", "day": "2090-01-01"}
+    calls.clear()
+    routes.change_received(storage, json.dumps(dict(message, origin="another worker", previous=previous)))
+    assert calls == [
+        ("appointments", {"customer_id": "c1", "day": date(2090, 1, 2)}),
+        ("appointments", {"customer_id": "c0", "day": date(2090, 1, 1)}),
+    ]
+
+
+def test_failed_notify_does_not_fail_the_write(monkeypatch):
+    async def notify(payload):
+        raise OSError("connection lost")
+
+    monkeypatch.setattr(routes, "NOTIFY_CHANGES", True)
+    calls = []
+    storage = SimpleNamespace(on_change=lambda table, **keys: calls.append(table), notify=notify)
+    asyncio.run(routes.changed(storage, "customers", "updated", "c1"))
+    assert calls == ["customers"]
+
+
+def test_missed_changes_drop_every_cache_and_reset_streams():
+    calls = []
+    storage = SimpleNamespace(on_change=lambda table, **keys: calls.append((table, keys)))
+    routes.customer_cache.set("c1", {"id": "c1"}, routes.customer_cache.generation)
+    subscription = routes.event_bus.subscribe()
+
+    routes.changes_missed(storage)
+    assert calls == [(table, {}) for table in routes.EVENT_TABLES]
+    assert routes.customer_cache.get("c1") is routes.MISSING
+    assert received(subscription) == ["event: reset"]
+
+
+def test_lost_listener_reconnects_and_reports_missed_changes(monkeypatch):
+    dsn = os.environ.get("TEST_DATABASE_URL")
+    if not dsn:
+        pytest.skip("TEST_DATABASE_URL not set")
+    import storage_postgres
+    monkeypatch.setattr(storage_postgres, "LISTEN_RETRY_DELAY", 0.05)
+
+    async def run():
+        storage = storage_postgres.PostgresStorage(dsn)
+        await storage.open()
+        payloads, missed = [], []
+        try:
+            await storage.listen(payloads.append, lambda: missed.append(storage.listener is not None))
+            pid = storage.listener.get_server_pid()
+            async with storage.acquire() as conn:
+                await conn.execute("SELECT pg_terminate_backend($1)", pid)
+            for _ in range(100):
+                if len(missed) == 2:
+                    break
+                await asyncio.sleep(0.05)
+            await storage.notify("after")
+            for _ in range(100):
+                if payloads:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await storage.close()
+        return payloads, missed
+
+    payloads, missed = asyncio.run(run())
+    # Once when the connection dropped, once when it was back
+    assert missed == [False, True]
+    assert payloads == ["after"]
@@ -0,0 +1,195 @@
+import asyncio
+import os
+import random
+import uuid
+from datetime import date, timedelta
+
+import pytest
+
+import queries
+from queries import Statement
+
+
+def test_statement_names_are_unique():
+    with pytest.raises(ValueError):
+        queries.statement("customers_by_id", "SELECT 1")
+
+
+def test_lookups_by_id_return_each_tables_model():
+    for table, model in queries.MODELS.items():
+        assert queries.BY_ID[table].model is model and queries.BY_IDS[table].model is model
+
+
+def postgres_dsn() -> str:
+    dsn = os.environ.get("TEST_DATABASE_URL")
+    if not dsn:
+        pytest.skip("TEST_DATABASE_URL not set")
+    return dsn
+
+
+def test_declared_statements_are_prepared_on_every_connection():
+    from storage_postgres import PostgresStorage
+
+    async def run():
+        storage = PostgresStorage(postgres_dsn())
+        await storage.open()
+        try:
+            # migrate() checks every statement against the schema first
+            await storage.migrate()
+            async with storage.acquire() as conn:
+                prepared = {row['statement'] for row in await conn.fetch('SELECT statement FROM pg_prepared_statements')}
+        finally:
+            await storage.close()
+        return prepared
+
+    prepared = asyncio.run(run())
+    assert {declared.sql for declared in queries.STATEMENTS.values()} <= prepared
+
+
+def test_startup_fails_on_statements_the_schema_broke(monkeypatch):
+    from storage_postgres import PostgresStorage
+
+    monkeypatch.setitem(
+        queries.STATEMENTS, "customer_nickname", Statement("customer_nickname", "SELECT nickname FROM customers")
+    )
+
+    async def run():
+        storage = PostgresStorage(postgres_dsn())
+        await storage.open()
+        try:
+            await storage.migrate()
+        finally:
+            await storage.close()
+
+    with pytest.raises(RuntimeError, match="customer_nickname"):
+        asyncio.run(run())
+
+
+def test_session_is_taken_from_a_package_still_valid_on_the_day():
+    from storage_postgres import PostgresStorage
+
+    day = date(2090, 1, 1) + timedelta(days=random.randrange(3000))
+    customer, package = uuid.uuid4().hex, uuid.uuid4().hex
+
+    def customer_package(expiry_date):
+        return {
+            "id": str(uuid.uuid4()), "customer_id": customer, "package_id": package, "purchase_date": day,
+            "amount_paid": 90, "payment_method": "pix", "remaining_sessions": 5, "expiry_date": expiry_date,
+        }
+
+    async def run():
+        storage = PostgresStorage(postgres_dsn())
+        await storage.open()
+        try:
+            await storage.migrate()
+            # The expired one would come first: it has the sooner expiry date
+            expired = await storage.customer_packages.insert(customer_package(day - timedelta(days=1)))
+            valid = await storage.customer_packages.insert(customer_package(day + timedelta(days=30)))
+            # Already past its expiry date today: flipped by the same statement
+            lapsed = await storage.customer_packages.insert(customer_package(date.today() - timedelta(days=1)))
+            async with storage.acquire() as conn:
+                used = await queries.fetchrow(conn, queries.USE_PACKAGE_SESSION, customer, package, day)
+            return (
+                valid, used, await storage.customer_packages.get(expired["id"]),
+                await storage.customer_packages.get(lapsed["id"]),
+            )
+        finally:
+            await storage.close()
+
+    valid, used, expired_after, lapsed_after = asyncio.run(run())
+    assert used.id == valid["id"]
+    assert used.remaining_sessions == 4 and used.status == "active"
+    assert expired_after["remaining_sessions"] == 5 and expired_after["status"] == "active"
+    assert lapsed_after["remaining_sessions"] == 5 and lapsed_after["status"] == "expired"
+
+
+def test_concurrent_check_ins_share_out_the_last_session():
+    from storage import Conflict
+    from storage_postgres import PostgresStorage
+
+    day = date(2090, 1, 1) + timedelta(days=random.randrange(3000))
+    customer, package = uuid.uuid4().hex, uuid.uuid4().hex
+
+    async def run():
+        storage = PostgresStorage(postgres_dsn())
+        await storage.open()
+        try:
+            await storage.migrate()
+            last = await storage.customer_packages.insert({
+                "id": str(uuid.uuid4()), "customer_id": customer, "package_id": package, "purchase_date": day,
+                "amount_paid": 90, "payment_method": "pix", "remaining_sessions": 1,
+            })
+            appointments = [
+                await storage.appointments.insert({
+                    "id": str(uuid.uuid4()), "customer_id": customer, "package_id": package, "date": day,
+                    "time": f"{hour:02d}:00", "service_type": "pilates",
+                })
+                for hour in range(8, 12)
+            ]
+            results = await asyncio.gather(
+                *(storage.redeem_appointment(a["id"]) for a in appointments), return_exceptions=True
+            )
+            statuses = [(await storage.appointments.get(a["id"]))["status"] for a in appointments]
+            return results, statuses, await storage.customer_packages.get(last["id"])
+        finally:
+            await storage.close()
+
+    results, statuses, last_after = asyncio.run(run())
+    redeemed = [result for result in results if not isinstance(result, Exception)]
+    assert len(redeemed) == 1
+    assert all(isinstance(result, Conflict) for result in results if result not in redeemed)
+    assert sorted(statuses) == ["completed", "scheduled", "scheduled", "scheduled"]
+    assert last_after["remaining_sessions"] == 0 and last_after["status"] == "exhausted"
+
+
+def test_statements_built_per_request_share_one_metric_label():
+    import metrics
+    from storage_postgres import PostgresStorage
+
+    async def run():
+        storage = PostgresStorage(postgres_dsn())
+        await storage.open()
+        try:
+            await storage.migrate()
+            for fields in (["id", "name"], ["id", "email"], None):
+                await storage.customers.page(1, fields=fields)
+        finally:
+            await storage.close()
+
+    def page_calls():
+        counts = metrics.DB_QUERY_DURATION.values.get(("customers.page",), [0])
+        return sum(counts[:-1])
+
+    before, labels_before = page_calls(), set(metrics.DB_QUERY_DURATION.values)
+    asyncio.run(run())
+    assert page_calls() - before == 3
+    # No series named after the SQL of one projection
+    added = set(metrics.DB_QUERY_DURATION.values) - labels_before
+    assert not any("FROM customers" in statement for statement, in added)
+
+
+def test_customers_are_read_without_the_search_columns_or_the_inline_photo():
+    from storage_postgres import PostgresStorage
+
+    async def run():
+        storage = PostgresStorage(postgres_dsn())
+        await storage.open()
+        try:
+            await storage.migrate()
+            created = await storage.customers.insert({
+                "id": str(uuid.uuid4()), "name": "Ana Souza", "cpf": str(uuid.uuid4().int)[:11],
+                "email": "ana@example.com", "phone": "11 99999-0000", "address": "Rua das Flores, 10",
+                "birth_date": date(1990, 5, 17), "photo_hash": None, "medical_notes": None,
+            })
+            rows = [created, await storage.customers.get(created["id"])]
+            rows += await storage.customers.get_many([created["id"]])
+            async with storage.acquire() as conn:
+                rows.append(await queries.fetchrow(conn, queries.CUSTOMER_OVERVIEW, created["id"], date.today(), 1))
+            await storage.customers.delete(created["id"])
+        finally:
+            await storage.close()
+        return rows
+
+    for row in asyncio.run(run()):
+        assert "name" in row.keys() and "photo" not in row.keys()
+        assert "search_vector" not in row.keys() and "search_text" not in row.keys()
@@ -0,0 +1,44 @@
+from datetime import time
+
+import scheduling
+from scheduling import DayIndex, find_conflict
+
+
+def booked(customer_id, instructor=None, service_type="Pilates", start=time(9), end=time(10)) -> dict:
+    return {
+        "customer_id": customer_id, "instructor": instructor, "service_type": service_type,
+        "start_time": start, "end_time": end,
+    }
+
+
+def slot(index: DayIndex, instructor, service_type, at: str) -> dict:
+    return next(s for s in index.slots(instructor, service_type) if s["time"] == at)
+
+
+def test_availability_agrees_with_booking():
+    existing = [booked("c1"), booked("c2"), booked("c3", "Rita")]
+    index = DayIndex(existing)
+
+    # Unassigned bookings cap nothing: a third customer can still book 09:00
+    for service_type in ("Pilates", None):
+        nine = slot(index, None, service_type, "09:00")
+        assert nine["available"] and nine["booked"] == 2
+    assert find_conflict(index.overlapping(None, 9 * 60, 10 * 60), "c4", None, "Pilates") is None
+
+    # Rita's Pilates class (capacity 1) is full, for availability and booking alike
+    assert not slot(index, "Rita", "Pilates", "09:00")["available"]
+    assert find_conflict(index.overlapping("Rita", 9 * 60, 10 * 60), "c4", "Rita", "Pilates") == "This time slot is full"
+    assert slot(index, "Rita", "Pilates", "10:00")["available"]
+
+
+def test_instructor_capacity_caps_the_class(monkeypatch):
+    monkeypatch.setitem(scheduling.SERVICE_RULES, "Pilates Mat", {"capacity": 8})
+    monkeypatch.setitem(scheduling.INSTRUCTOR_RULES, "Rita", {"capacity": 2})
+    index = DayIndex([booked("c1", "Rita", "Pilates Mat"), booked("c2", "Rita", "Pilates Mat"),
+                      booked("c3", "Bia", "Pilates Mat")])
+
+    assert slot(index, "Rita", "Pilates Mat", "09:00")["remaining"] == 0
+    assert find_conflict(index.overlapping("Rita", 9 * 60, 10 * 60), "c4", "Rita", "Pilates Mat") == "This time slot is full"
+    # Other instructors keep the service's capacity
+    assert slot(index, "Bia", "Pilates Mat", "09:00")["remaining"] == 7
+    assert find_conflict(index.overlapping("Bia", 9 * 60, 10 * 60), "c4", "Bia", "Pilates Mat") is None
@@ -0,0 +1,493 @@
+"""The shared routes must behave the same on every storage backend.
+
+Each test runs once per backend: Mongo through mongomock-motor, and Postgres
+when TEST_DATABASE_URL points at a database the migrations may be applied
+to. Rows are created with unique values, so the Postgres database does not
+have to be empty.
+"""
+
+import base64
+import hashlib
+import io
+import json
+import os
+import random
+import uuid
+from datetime import date, timedelta
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import routes
+from photos import PhotoStore
+
+
+def build_app(storage) -> FastAPI:
+    app = FastAPI()
+    app.state.storage = storage
+    app.include_router(routes.router)
+
+    @app.on_event("startup")
+    async def startup():
+        await storage.open()
+        await storage.migrate()
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        await storage.close()
+
+    return app
+
+
+def mongo_storage():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from storage_mongo import MongoStorage
+    return MongoStorage(mongomock_motor.AsyncMongoMockClient()[f"fitmanager_{uuid.uuid4().hex}"])
+
+
+def postgres_storage():
+    dsn = os.environ.get("TEST_DATABASE_URL")
+    if not dsn:
+        pytest.skip("TEST_DATABASE_URL not set")
+    from storage_postgres import PostgresStorage
+    return PostgresStorage(dsn)
+
+
+@pytest.fixture(params=["mongo", "postgres"])
+def api(request, tmp_path, monkeypatch):
+    storage = mongo_storage() if request.param == "mongo" else postgres_storage()
+    changes = []
+    storage.on_change = lambda table, **keys: changes.append((table, keys))
+    monkeypatch.setattr(routes, "photo_store", PhotoStore(tmp_path))
+    for cache in (routes.dashboard_cache, routes.customer_cache, routes.package_cache, routes.overview_cache):
+        cache.invalidate()
+    with TestClient(build_app(storage)) as client:
+        client.changes = changes
+        yield client
+
+
+def unique_cpf() -> str:
+    return str(uuid.uuid4().int)[:11]
+
+
+def some_day() -> date:
+    # Far from real bookings and from other test runs on a shared database
+    return date(2090, 1, 1) + timedelta(days=random.randrange(3000))
+
+
+def new_customer(api, **fields) -> dict:
+    body = {
+        "name": "Ana Souza",
+        "cpf": unique_cpf(),
+        "email": "ana@example.com",
+        "phone": "11 99999-0000",
+        "address": "Rua das Flores, 10",
+        "birth_date": "1990-05-17",
+    }
+    response = api.post("/api/customers", json=dict(body, **fields))
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def new_appointment(api, customer_id: str, day: date, time: str = "09:00", **fields) -> dict:
+    body = {"customer_id": customer_id, "package_id": "p1", "date": day.isoformat(), "time": time, "service_type": "Pilates"}
+    return api.post("/api/appointments", json=dict(body, **fields))
+
+
+def png() -> bytes:
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_customer_round_trip(api):
+    created = new_customer(api)
+    assert created["birth_date"] == "1990-05-17"
+    assert created["photo"] is None
+
+    assert api.get(f"/api/customers/{created['id']}").json() == created
+
+    updated = api.put(f"/api/customers/{created['id']}", json=dict(created, name="Ana Lima"))
+    assert updated.status_code == 200
+    assert updated.json()["name"] == "Ana Lima"
+    assert updated.json()["created_at"] == created["created_at"]
+
+    assert api.delete(f"/api/customers/{created['id']}").status_code == 200
+    assert api.get(f"/api/customers/{created['id']}").status_code == 404
+    assert api.delete(f"/api/customers/{created['id']}").status_code == 404
+    assert [table for table, _ in api.changes] == ["customers"] * 3
+
+
+def test_duplicate_cpf_is_a_conflict(api):
+    first = new_customer(api)
+    second = new_customer(api)
+    assert api.post("/api/customers", json=dict(first, name="Outra")).status_code == 409
+    assert api.put(f"/api/customers/{second['id']}", json=dict(second, cpf=first["cpf"])).status_code == 409
+
+
+def test_missing_rows_are_not_found(api):
+    missing = str(uuid.uuid4())
+    customer = new_customer(api)
+    assert api.get(f"/api/customers/{missing}").status_code == 404
+    assert api.put(f"/api/customers/{missing}", json=dict(customer, cpf=unique_cpf())).status_code == 404
+    assert api.get(f"/api/packages/{missing}").status_code == 404
+    assert api.delete(f"/api/packages/{missing}").status_code == 404
+
+
+def test_customer_photo(api):
+    customer = new_customer(api)
+    response = api.post(f"/api/customers/{customer['id']}/photo", files={"file": ("a.png", png(), "image/png")})
+    assert response.status_code == 200
+    url = response.json()["photo"]
+    assert url.startswith(f"/api/customers/{customer['id']}/photo?v=")
+
+    photo = api.get(url)
+    assert photo.status_code == 200
+    assert photo.headers["content-type"] == "image/png"
+    assert api.get(url, headers={"If-None-Match": photo.headers["etag"]}).status_code == 304
+    # Part of the ETag is not a match
+    assert api.get(url, headers={"If-None-Match": f'"x{photo.headers["etag"]}x"'}).status_code == 200
+
+    # Clients send the URL back when editing other fields; the photo stays
+    kept = api.put(f"/api/customers/{customer['id']}", json=dict(response.json(), name="Bia"))
+    assert kept.json()["photo"] == url
+
+
+def test_lost_photo_file_is_written_back_from_the_inline_copy(api):
+    customer = new_customer(api)
+    data = png()
+    # A customer copied by the photo migration but not cleared yet, whose file went with a wiped filesystem
+    storage = api.app.state.storage
+    updated = api.portal.call(storage.customers.update, customer["id"], {
+        "photo_hash": hashlib.sha256(data).hexdigest(),
+        "photo": "data:image/png;base64," + base64.b64encode(data).decode(),
+    })
+    routes.customer_cache.invalidate()
+    # Only the photo route's fallback reads the inline copy
+    assert "photo" not in updated
+    assert "photo" not in api.portal.call(storage.customers.get, customer["id"])
+    assert "photo" not in api.portal.call(storage.customers.get_many, [customer["id"]])[0]
+
+    photo = api.get(f"/api/customers/{customer['id']}/photo")
+    assert photo.status_code == 200
+    assert photo.content == data
+
+
+def test_undecodable_inline_photo_is_not_found(api):
+    customer = new_customer(api)
+    api.portal.call(api.app.state.storage.customers.update, customer["id"], {
+        "photo_hash": hashlib.sha256(b"lost").hexdigest(),
+        "photo": "data:image/png;base64,bm90IGFuIGltYWdl",
+    })
+    routes.customer_cache.invalidate()
+
+    assert api.get(f"/api/customers/{customer['id']}/photo").status_code == 404
+
+
+def test_listing_is_newest_first_with_cursor_and_projection(api):
+    ids = [new_customer(api)["id"] for _ in range(3)]
+
+    first = api.get("/api/customers", params={"limit": 2})
+    assert [c["id"] for c in first.json()] == ids[::-1][:2]
+    second = api.get("/api/customers", params={"limit": 2, "cursor": first.headers["x-next-cursor"]})
+    assert second.json()[0]["id"] == ids[0]
+
+    projected = api.get("/api/customers", params={"limit": 1, "fields": "id,name"})
+    assert projected.json() == [{"id": ids[-1], "name": "Ana Souza"}]
+
+    assert api.get("/api/customers", params={"fields": "id,password"}).status_code == 400
+    assert api.get("/api/customers", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_packages_and_customer_packages(api):
+    body = {"name": "Mensal", "type": "monthly", "price": 250.0, "description": "8 aulas", "sessions_included": 8}
+    package = api.post("/api/packages", json=body).json()
+    assert api.get(f"/api/packages/{package['id']}").json() == package
+
+    updated = api.put(f"/api/packages/{package['id']}", json=dict(body, price=300.0)).json()
+    assert updated["price"] == 300.0
+
+    customer = new_customer(api)
+    customer_package = api.post("/api/customer-packages", json={
+        "customer_id": customer["id"],
+        "package_id": package["id"],
+        "purchase_date": "2090-01-01",
+        "amount_paid": 250.0,
+        "payment_method": "pix",
+        "remaining_sessions": 8,
+    }).json()
+    assert customer_package["status"] == "active"
+    assert api.get(f"/api/customer-packages/customer/{customer['id']}").json() == [customer_package]
+    assert api.get("/api/customer-packages", params={"limit": 1}).json() == [customer_package]
+
+    assert api.delete(f"/api/packages/{package['id']}").status_code == 200
+    assert api.get(f"/api/packages/{package['id']}").status_code == 404
+
+
+def new_customer_package(api, customer_id: str, **fields) -> tuple:
+    body = {"name": "Mensal", "type": "monthly", "price": 250.0, "description": "8 aulas", "sessions_included": 8}
+    package = api.post("/api/packages", json=body).json()
+    customer_package = api.post("/api/customer-packages", json=dict({
+        "customer_id": customer_id,
+        "package_id": package["id"],
+        "purchase_date": "2090-01-01",
+        "amount_paid": 250.0,
+        "payment_method": "pix",
+    }, **fields)).json()
+    return package, customer_package
+
+
+def test_customer_overview(api):
+    customer = new_customer(api)
+    package, customer_package = new_customer_package(api, customer["id"], remaining_sessions=8)
+    day = some_day()
+    upcoming = new_appointment(api, customer["id"], day, package_id=package["id"]).json()
+    recent = new_appointment(api, customer["id"], date(2001, 2, 3), package_id=package["id"]).json()
+    api.post("/api/payments", json={
+        "customer_package_id": customer_package["id"], "amount": 250.0, "payment_date": "2090-01-01",
+        "payment_method": "pix",
+    })
+
+    overview = api.get(f"/api/customers/{customer['id']}/overview").json()
+    assert overview["customer"] == customer
+    assert [(cp["id"], cp["package"]["id"]) for cp in overview["packages"]] == [(customer_package["id"], package["id"])]
+    assert [a["id"] for a in overview["upcoming_appointments"]] == [upcoming["id"]]
+    assert [a["id"] for a in overview["recent_appointments"]] == [recent["id"]]
+    assert overview["payments"] == {"count": 1, "total": 250.0, "last_payment_date": "2090-01-01"}
+    assert api.get(f"/api/customers/{uuid.uuid4()}/overview").status_code == 404
+
+
+def test_moving_an_appointment_refreshes_both_overviews(api):
+    first, second = new_customer(api), new_customer(api)
+    day = some_day()
+    appointment = new_appointment(api, first["id"], day).json()
+    # Both overviews are cached before the move
+    assert len(api.get(f"/api/customers/{first['id']}/overview").json()["upcoming_appointments"]) == 1
+    assert api.get(f"/api/customers/{second['id']}/overview").json()["upcoming_appointments"] == []
+
+    moved_to = day + timedelta(days=1)
+    body = {"customer_id": second["id"], "package_id": "p1", "date": moved_to.isoformat(), "time": "09:00",
+            "service_type": "Pilates"}
+    assert api.put(f"/api/appointments/{appointment['id']}", json=body).status_code == 200
+    assert api.get(f"/api/customers/{first['id']}/overview").json()["upcoming_appointments"] == []
+    assert len(api.get(f"/api/customers/{second['id']}/overview").json()["upcoming_appointments"]) == 1
+    days = {str(keys.get("day")) for table, keys in api.changes if table == "appointments"}
+    assert {day.isoformat(), moved_to.isoformat()} <= days
+    assert api.put(f"/api/appointments/{uuid.uuid4()}", json=body).status_code == 404
+
+
+def test_redeem_takes_one_session(api):
+    customer = new_customer(api)
+    package, customer_package = new_customer_package(api, customer["id"], remaining_sessions=1)
+    day = some_day()
+    first = new_appointment(api, customer["id"], day, "09:00", package_id=package["id"]).json()
+    second = new_appointment(api, customer["id"], day, "11:00", package_id=package["id"]).json()
+
+    redeemed = api.post(f"/api/appointments/{first['id']}/redeem")
+    assert redeemed.status_code == 200, redeemed.text
+    assert redeemed.json()["customer_package"]["remaining_sessions"] == 0
+    assert redeemed.json()["customer_package"]["status"] == "exhausted"
+    assert ("appointments", {"customer_id": customer["id"], "day": day}) in [
+        (table, dict(keys, day=date.fromisoformat(str(keys["day"])))) for table, keys in api.changes if "day" in keys
+    ]
+
+    assert "already completed" in api.post(f"/api/appointments/{first['id']}/redeem").json()["detail"]
+    assert api.post(f"/api/appointments/{second['id']}/redeem").status_code == 409
+    agenda = api.get(f"/api/appointments/date/{day.isoformat()}").json()
+    assert {a["id"]: a["status"] for a in agenda if a["customer_id"] == customer["id"]} == {
+        first["id"]: "completed", second["id"]: "scheduled",
+    }
+    assert api.post(f"/api/appointments/{uuid.uuid4()}/redeem").status_code == 404
+
+
+def test_redeem_expires_lapsed_packages(api):
+    customer = new_customer(api)
+    yesterday = (date.today() - timedelta(days=1)).isoformat()
+    package, lapsed = new_customer_package(api, customer["id"], remaining_sessions=3, expiry_date=yesterday)
+    valid = api.post("/api/customer-packages", json=dict(
+        {k: lapsed[k] for k in ("customer_id", "package_id", "purchase_date", "amount_paid", "payment_method")},
+        remaining_sessions=3,
+    )).json()
+    appointment = new_appointment(api, customer["id"], some_day(), "09:00", package_id=package["id"]).json()
+
+    redeemed = api.post(f"/api/appointments/{appointment['id']}/redeem").json()
+    assert redeemed["customer_package"]["id"] == valid["id"]
+    assert redeemed["customer_package"]["remaining_sessions"] == 2
+    packages = api.portal.call(lambda: api.app.state.storage.customer_packages.find(customer_id=customer["id"]))
+    assert {cp["id"]: cp["status"] for cp in packages} == {lapsed["id"]: "expired", valid["id"]: "active"}
+
+
+def test_batch_lookups(api):
+    customers = [new_customer(api) for _ in range(3)]
+    ids = [customers[2]["id"], str(uuid.uuid4()), customers[0]["id"], customers[2]["id"]]
+    # Warm the cache with one of them; the batch mixes cached and queried rows
+    api.get(f"/api/customers/{customers[0]['id']}")
+
+    found = api.post("/api/customers/batch", json={"ids": ids})
+    assert found.status_code == 200
+    assert found.json() == [customers[2], customers[0]]
+    projected = api.post("/api/customers/batch", params={"fields": "id,name"}, json={"ids": ids[:1]})
+    assert projected.json() == [{"id": customers[2]["id"], "name": "Ana Souza"}]
+    assert api.post("/api/customers/batch", json={"ids": ["x"] * 2 + [str(n) for n in range(routes.BATCH_MAX_IDS)]}).status_code == 422
+
+    body = {"name": "Avulso", "type": "single", "price": 50.0, "description": "1 aula"}
+    package = api.post("/api/packages", json=body).json()
+    assert api.post("/api/packages/batch", json={"ids": [package["id"], "nope"]}).json() == [package]
+
+
+def test_appointments_expand_customer_and_package(api):
+    customer = new_customer(api)
+    body = {"name": "Mensal", "type": "monthly", "price": 250.0, "description": "8 aulas"}
+    package = api.post("/api/packages", json=body).json()
+    day = some_day()
+    new_appointment(api, customer["id"], day, "09:00", package_id=package["id"])
+    new_appointment(api, customer["id"], day, "11:00", package_id=str(uuid.uuid4()))
+
+    params = {"customer_id": customer["id"], "expand": "customer,package"}
+    expanded = api.get("/api/appointments", params=params).json()
+    assert [a["time"] for a in expanded] == ["11:00", "09:00"]
+    assert all(a["customer"] == customer for a in expanded)
+    assert expanded[0]["package"] is None
+    assert expanded[1]["package"] == package
+
+    projected = api.get("/api/appointments", params=dict(params, fields="time", expand="package", limit=1))
+    assert projected.json() == [{"time": "11:00", "package": None}]
+    assert "x-next-cursor" in projected.headers
+    assert api.get("/api/appointments", params={"expand": "payments"}).status_code == 400
+
+
+def test_appointment_filters_and_pages(api):
+    customer = new_customer(api)
+    day = some_day()
+    days = [day + timedelta(days=n) for n in range(5)]
+    for d in days:
+        assert new_appointment(api, customer["id"], d).status_code == 200
+
+    seen = []
+    params = {"customer_id": customer["id"], "limit": 2}
+    while True:
+        response = api.get("/api/appointments", params=params)
+        seen += [a["date"] for a in response.json()]
+        if "x-next-cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["x-next-cursor"]
+    assert seen == [d.isoformat() for d in reversed(days)]
+
+    ranged = api.get("/api/appointments", params={
+        "customer_id": customer["id"], "from": days[1].isoformat(), "to": days[3].isoformat(), "fields": "date,status",
+    })
+    assert ranged.json() == [{"date": d.isoformat(), "status": "scheduled"} for d in reversed(days[1:4])]
+
+
+def test_booking_conflicts_and_rescheduling(api):
+    customer = new_customer(api)
+    day = some_day()
+    instructor = f"Instrutor {uuid.uuid4().hex[:8]}"
+    first = new_appointment(api, customer["id"], day, "09:00", instructor=instructor).json()
+    assert first["time"] == "09:00"
+
+    # Same customer, overlapping slot
+    assert new_appointment(api, customer["id"], day, "09:30").status_code == 409
+    later = new_appointment(api, customer["id"], day, "11:00").json()
+
+    move = {"customer_id": customer["id"], "package_id": "p1", "date": day.isoformat(), "service_type": "Pilates"}
+    assert api.put(f"/api/appointments/{later['id']}", json=dict(move, time="09:15")).status_code == 409
+    moved = api.put(f"/api/appointments/{later['id']}", json=dict(move, time="14:00"))
+    assert moved.status_code == 200
+    assert moved.json()["time"] == "14:00"
+    # Moving an appointment within its own slot does not conflict with itself
+    assert api.put(f"/api/appointments/{first['id']}", json=dict(move, time="09:30", instructor=instructor)).status_code == 200
+    assert api.put(f"/api/appointments/{uuid.uuid4()}", json=dict(move, time="18:00")).status_code == 404
+
+    # Other runs against a shared database may have booked the same day
+    agenda = [a for a in api.get(f"/api/appointments/date/{day.isoformat()}").json() if a["customer_id"] == customer["id"]]
+    assert [a["time"] for a in agenda] == ["09:30", "14:00"]
+
+
+def test_payments(api):
+    customer_package_id = str(uuid.uuid4())
+    created = api.post("/api/payments", json={
+        "customer_package_id": customer_package_id,
+        "amount": 250.5,
+        "payment_date": "2090-01-01",
+        "payment_method": "pix",
+    })
+    assert created.status_code == 200
+    assert created.json()["amount"] == 250.5
+    assert api.get("/api/payments", params={"limit": 1}).json() == [created.json()]
+
+
+def test_bulk_import_reports_bad_rows(api):
+    cpf = unique_cpf()
+    row = {"name": "Ana Souza", "email": "ana@example.com", "phone": "11 99999-0000", "address": "Rua das Flores, 10",
+           "birth_date": "1990-05-17"}
+    body = "\n".join([
+        json.dumps(dict(row, cpf=cpf)),
+        "{not json",
+        json.dumps({"name": "Sem CPF"}),
+        json.dumps(dict(row, cpf=cpf)),
+        json.dumps(dict(row, cpf=unique_cpf())),
+    ])
+    result = api.post("/api/customers/bulk", content=body, headers={"Content-Type": "application/x-ndjson"}).json()
+    assert result["inserted"] == 2
+    assert [error["line"] for error in result["errors"]] == [2, 3, 4]
+    assert api.changes[-1] == ("customers", {})
+
+
+def test_export_streams_a_date_range(api):
+    customer = new_customer(api)
+    # Past the days other tests book, and only this customer's rows are looked at
+    day = some_day() + timedelta(days=5000)
+    rows = [
+        {"customer_id": customer["id"], "package_id": "p1", "date": (day + timedelta(days=n)).isoformat(),
+         "time": "09:00", "service_type": "Pilates"}
+        for n in range(3)
+    ]
+    body = "\n".join(json.dumps(row) for row in rows)
+    assert api.post("/api/appointments/bulk", content=body).json()["inserted"] == 3
+
+    params = {"from": day.isoformat(), "to": (day + timedelta(days=1)).isoformat()}
+    exported = api.get("/api/export/appointments", params=params)
+    assert exported.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in exported.text.splitlines()]
+    lines = [line for line in lines if line["customer_id"] == customer["id"]]
+    assert [line["date"] for line in lines] == [rows[0]["date"], rows[1]["date"]]
+    assert lines[0]["status"] == "scheduled" and lines[0]["time"] == "09:00"
+
+    csv_rows = api.get("/api/export/appointments", params=dict(params, format="csv")).text.splitlines()
+    assert csv_rows[0].startswith("id,customer_id,package_id,date,time")
+    assert len([row for row in csv_rows if customer["id"] in row]) == 2
+    assert api.get("/api/export/invoices").status_code == 404
+
+
+def test_writes_publish_change_events(api):
+    subscription = routes.event_bus.subscribe(["customers", "payments"])
+    try:
+        customer = new_customer(api)
+        api.delete(f"/api/customers/{customer['id']}")
+        new_appointment(api, customer["id"], some_day())
+        events = []
+        while not subscription.queue.empty():
+            event = subscription.queue.get_nowait().decode()
+            events.append(json.loads(event.split("data: ", 1)[1]))
+    finally:
+        subscription.close()
+    assert events == [
+        {"table": "customers", "action": "created", "id": customer["id"], "data": customer},
+        {"table": "customers", "action": "deleted", "id": customer["id"]},
+    ]
+    assert api.get("/api/events", params={"tables": "customers,invoices"}).status_code == 400
+
+
+def test_dashboard_stats(api):
+    keys = {
+        "total_customers", "total_packages", "total_appointments", "active_customer_packages",
+        "today_appointments", "recent_payments",
+    }
+    before = api.get("/api/dashboard/stats").json()
+    assert set(before) == keys
+
+    new_customer(api)
+    assert api.get("/api/dashboard/stats").json()["total_customers"] == before["total_customers"] + 1